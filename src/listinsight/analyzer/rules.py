@@ -1,6 +1,8 @@
 import pandas as pd
 import numpy as np
 
+from analyzer.utilities import toDatetime
+
 sample_output = {
   "overreported": {
     "description": "what's over reported case",
@@ -47,12 +49,14 @@ def preprocessing():
     nonserious_cases = df_master.loc[df_master['CASE_SERIOUSNESS'] == "Not Serious",['CASE_ID']].values.tolist()
     
 
+LATE_SERIOUS = "Late & Serious"
+
 def rule_1() -> Result:
-    tagname = "Late & Serious"
+    tagname = LATE_SERIOUS
     description = "Case submitted Late to EV"
     
-    #convert columns to datetime
-    df_report[['RECEIPT_DATE','EMA_DATE']] = df_report[['RECEIPT_DATE','EMA_DATE']].apply(pd.to_datetime)
+    #convert columns to datetime, no-op for datasets typed at import
+    toDatetime(df_report, ['RECEIPT_DATE','EMA_DATE'])
 
     #calculate difference between dates
     df_report['DAYS_TO_EV'] = (df_report['EMA_DATE'] - df_report['EMA_DATE']) / np.timedelta64(1, 'D')
@@ -74,6 +78,9 @@ def rule_2():
 rules = [rule_1, 
          rule_2]
 
+# Tags set by the rules, their rows are highlighted in the data views
+rule_tags = [LATE_SERIOUS]
+
 
 
 
@@ -1,4 +1,11 @@
 import pandas as pd
 
+def toDatetime(df: pd.DataFrame, columns: list[str]) -> pd.DataFrame:
+    """Parse date columns, columns already typed at import are left as they are"""
+    for column in columns:
+        if not pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = pd.to_datetime(df[column])
+    return df
+
 def days(df):
-    df[['start_date','end_date']] = df[['start_date','end_date']].apply(pd.to_datetime)
\ No newline at end of file
+    toDatetime(df, ['start_date','end_date'])
@@ -1,14 +1,28 @@
 import io
 import logging
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from pathlib import Path
+from typing import Callable
 from functools import partial
 from qtpy import QtWidgets, QtCore, QtGui, Slot, Signal
 from dataclasses import dataclass, asdict
+from utilities.worker import Worker
 
 from .shortlister import ShortLister
-from .tagger import Tagger, TagDialog
-from .filter import FilterPane, Filter
+from .tagger import Tagger, TagDialog, TagStatisticsDialog
+from .filter import FilterPane, FilterDialog, Filter
+from .storage import (ConversionCache, WriteProfile, WRITE_PROFILES, writeParquet, readParquet, readMatchingRows, readColumn,
+                      openPartitioned, partitionExpression, RowGroupLayout, RowGroupReload, rowGroupLayout,
+                      readParquetLayout, reloadRowGroups)
+from utilities import config as mconf
+from .importer import ImportJob
+from .xlsx import streamWorkbook
+from .tagstore import TagStore
+from .tagindex import TagIndex
 
 logger = logging.getLogger(__name__)
 
@@ -26,12 +40,217 @@ class Metadata:
     
 
 class DataSet:
+    TAGS_COLUMN = "Tags"
+
     def __init__(self, df: pd.DataFrame, name: str):
+        df = self.dropLegacyTags(df)
         self._dataframe = df
         self._unfiltered_df = df.copy()
+        self._tags = TagStore() # tags of the project, set by the DataViewer
         self._metadata = Metadata()
         self.name = name
         self.filters: list[Filter] = []
+        self.loaded = True
+        self.num_rows = len(df)
+        self.dirty_rows: set[int] = set() # row positions in unfiltered_df
+        self.rows_match_file = True # unfiltered_df rows are in the parquet row order
+        self.partition_schema: pa.Schema = None # partition columns of a directory dataset
+        self.loaded_partition_filter = "" # partition expression the rows were read with
+        self._pk_index: pd.Index = None # primary key values in unfiltered_df row order
+        self.layout: RowGroupLayout = None # row groups of the parquet the rows were read from
+        self._tag_index: TagIndex = None # tags by row position of unfiltered_df
+        self._view_positions: np.ndarray = None # row positions in unfiltered_df of the filtered rows
+        self._view_positions_of: pd.DataFrame = None # filtered dataframe the positions were computed for
+        self._view_rows: np.ndarray = None # filtered row by row position of unfiltered_df, -1 if filtered out
+
+    @classmethod
+    def fromSchema(cls, parquet: Path, name: str) -> "DataSet":
+        """Create a placeholder dataset from the parquet footer, rows are not decoded
+
+        parquet may also be a directory of hive-partitioned parquets, handled
+        as a single dataset.
+        """
+        if parquet.is_dir():
+            partitioned = openPartitioned(parquet)
+            df = partitioned.schema.empty_table().to_pandas()
+            dataset = cls(df, name)
+            dataset.partition_schema = partitioned.partitioning.schema
+            dataset.num_rows = partitioned.count_rows()
+        else:
+            parquet_file = pq.ParquetFile(parquet)
+            df = parquet_file.schema_arrow.empty_table().to_pandas()
+            dataset = cls(df, name)
+            dataset.num_rows = parquet_file.metadata.num_rows
+
+        dataset.loaded = False
+        return dataset
+
+    def isPartitioned(self) -> bool:
+        return self.partition_schema is not None
+
+    def partitionFilter(self) -> tuple[pc.Expression | None, list[Filter]]:
+        """Return the expression pruning partitions for the enabled filters, and the filters it covers"""
+        if not self.isPartitioned():
+            return None, []
+        return partitionExpression(self.filters, self.partition_schema)
+
+    @classmethod
+    def dropLegacyTags(cls, df: pd.DataFrame) -> pd.DataFrame:
+        """Drop the empty Tags column older imports stored in the parquet, tags now live in the project"""
+        if cls.TAGS_COLUMN in df.columns and df[cls.TAGS_COLUMN].isna().all():
+            return df.drop(columns=cls.TAGS_COLUMN)
+        return df
+
+    def setData(self, df: pd.DataFrame):
+        """Replace the placeholder content with the decoded rows"""
+        df = self.dropLegacyTags(df)
+        self._dataframe = df
+        self._unfiltered_df = df.copy()
+        self.loaded = True
+        self.num_rows = len(df)
+        self.dirty_rows.clear()
+        self._pk_index = None
+        self._tag_index = None
+
+    def spliceRowGroups(self, frames: dict[int, pd.DataFrame], layout: RowGroupLayout):
+        """Swap reloaded row groups into unfiltered_df, the other rows are kept as they are"""
+        pieces = []
+        offsets = layout.offsets
+        next_label = len(self._unfiltered_df)
+        if next_label > 0 and pd.api.types.is_integer_dtype(self._unfiltered_df.index):
+            next_label = self._unfiltered_df.index.max() + 1
+
+        for i in range(len(offsets) - 1):
+            if i not in frames:
+                pieces.append(self._unfiltered_df.iloc[offsets[i]:offsets[i + 1]])
+            else:
+                labels = self._unfiltered_df.index[offsets[i]:offsets[i + 1]]
+                if len(labels) < len(frames[i]):
+                    # Rows appended to the file, in the last row group or in a new one
+                    appended = len(frames[i]) - len(labels)
+                    labels = labels.append(pd.RangeIndex(next_label, next_label + appended))
+                    next_label += appended
+                pieces.append(self.dropLegacyTags(frames[i]).set_axis(labels))
+
+        df = pd.concat(pieces) if len(pieces) > 0 else self._unfiltered_df.iloc[0:0]
+
+        # Row groups decode their own categories, concat falls back to object
+        for column, dtype in self._unfiltered_df.dtypes.items():
+            if isinstance(dtype, pd.CategoricalDtype) and column in df.columns and df[column].dtype == object:
+                df[column] = df[column].astype("category")
+        self._unfiltered_df = df
+        self._dataframe = df
+        self.num_rows = len(df)
+        self.dirty_rows.clear()
+        self._pk_index = None
+        self._tag_index = None
+        self.layout = layout
+
+    def setValue(self, row: int, column: int, value):
+        """Edit a cell of the filtered dataframe and mark its row dirty"""
+        label = self._dataframe.index[row]
+
+        # New value for a column typed as categorical at import
+        series = self._unfiltered_df.iloc[:, column]
+        if isinstance(series.dtype, pd.CategoricalDtype) and not pd.isna(value) and not value in series.cat.categories:
+            name = self._unfiltered_df.columns[column]
+            self._unfiltered_df[name] = series.cat.add_categories([value])
+            if self._dataframe is not self._unfiltered_df:
+                self._dataframe[name] = self._dataframe[name].cat.add_categories([value])
+
+        self._dataframe.iloc[row, column] = value
+
+        position = self._unfiltered_df.index.get_loc(label)
+        self._unfiltered_df.iloc[position, column] = value
+        self.dirty_rows.add(position)
+
+        if column == self.pk_loc:
+            self._pk_index = None
+            self._tag_index = None
+
+    def pkIndex(self) -> pd.Index:
+        """Return the primary key values by row position of unfiltered_df, built on first use"""
+        if self._pk_index is None:
+            self._pk_index = pd.Index(self._unfiltered_df[self.pk_name])
+        return self._pk_index
+
+    def upsert(self, df: pd.DataFrame) -> tuple[int, int]:
+        """Merge the rows of a new reporting period by primary key
+
+        Rows whose key exists are updated in place, only if a value changed,
+        and rows with a new key are appended. Both are marked dirty until the
+        dataset is saved.
+        Returns the number of updated and appended rows.
+        """
+        if self.pk_name == "":
+            raise ValueError(f"{self.name}: no primary key")
+
+        df = self.dropLegacyTags(df)
+        columns = list(self._unfiltered_df.columns)
+        missing = [c for c in columns if c not in df.columns]
+        if len(missing) > 0:
+            raise ValueError(f"Missing columns: {', '.join(map(str, missing))}")
+
+        df = df[columns].drop_duplicates(subset=self.pk_name, keep="last")
+
+        # Categories of the new period are added, not turned into missing values
+        for column in columns:
+            series = self._unfiltered_df[column]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                new_categories = pd.Index(df[column].dropna().unique()).difference(series.cat.categories)
+                self._unfiltered_df[column] = series.cat.add_categories(new_categories)
+
+        df = df.astype(self._unfiltered_df.dtypes.to_dict(), errors="ignore")
+
+        if not self.pkIndex().is_unique:
+            raise ValueError(f"{self.pk_name} has duplicate values")
+
+        positions = self.pkIndex().get_indexer(df[self.pk_name])
+        existing = positions >= 0
+
+        # Update changed rows
+        old = self._unfiltered_df.iloc[positions[existing]].reset_index(drop=True)
+        new = df[existing].reset_index(drop=True)
+        changed = ((old != new) & ~(old.isna() & new.isna())).any(axis=1).to_numpy()
+        changed_positions = positions[existing][changed]
+
+        for j, column in enumerate(columns):
+            self._unfiltered_df.iloc[changed_positions, j] = new.loc[changed, column].to_numpy()
+        self.dirty_rows.update(changed_positions.tolist())
+
+        # Append new rows
+        appended = df[~existing]
+        if len(appended) > 0:
+            start = len(self._unfiltered_df)
+            if pd.api.types.is_integer_dtype(self._unfiltered_df.index) and start > 0:
+                first_label = self._unfiltered_df.index.max() + 1
+            else:
+                first_label = start
+            appended = appended.set_axis(pd.RangeIndex(first_label, first_label + len(appended)))
+
+            self._unfiltered_df = pd.concat([self._unfiltered_df, appended])
+            self.dirty_rows.update(range(start, len(self._unfiltered_df)))
+            self._pk_index = self.pkIndex().append(pd.Index(appended[self.pk_name]))
+            self._tag_index = None
+
+        self._dataframe = self._unfiltered_df
+        self.num_rows = len(self._unfiltered_df)
+
+        return len(changed_positions), len(appended)
+
+    def isDirty(self) -> bool:
+        return len(self.dirty_rows) > 0
+
+    def changedOnDisk(self) -> bool:
+        """Return whether the parquet was rewritten since the rows in memory were read from it"""
+        if self.layout is None or self.isPartitioned() or not self.parquet.exists():
+            return False
+
+        try:
+            return rowGroupLayout(self.parquet).digests != self.layout.digests
+        except (OSError, pa.ArrowInvalid) as e:
+            logger.error(e)
+            return True
 
     @property
     def dataframe(self) -> pd.DataFrame:
@@ -81,6 +300,8 @@ class DataSet:
     @pk_name.setter
     def pk_name(self, name: str):
         self._metadata.primary_key_name = name
+        self._pk_index = None
+        self._tag_index = None
         try:
             self._metadata.primary_key_index = self.dataframe.columns.get_loc(self.pk_name)
         except Exception as e:
@@ -93,6 +314,120 @@ class DataSet:
     @property
     def pk_type(self):
         return self.dataframe[self.pk_name].dtype
+
+    def pkValue(self, row: int):
+        """Return the primary key value of a row of the filtered dataframe"""
+        if self.pk_loc is None or self.pk_loc < 0:
+            return None
+        return self._dataframe.iat[row, self.pk_loc]
+
+    @property
+    def tags(self) -> TagStore:
+        """Tags of the project keyed by primary key, joined to the view as a virtual last column"""
+        return self._tags
+
+    def setTagStore(self, store: TagStore):
+        self._tags = store
+        self._tag_index = None
+
+    @property
+    def tags_loc(self) -> int:
+        return len(self._dataframe.columns)
+
+    def tagIndex(self) -> TagIndex:
+        """Return the tags of the rows of unfiltered_df, built on first use"""
+        if self._tag_index is None:
+            if self.pk_name == "" or not self.pk_name in self._unfiltered_df.columns:
+                self._tag_index = TagIndex(pd.Index([None] * len(self._unfiltered_df), dtype=object))
+            else:
+                self._tag_index = TagIndex.build(self.pkIndex(), self.tags, self.pk_name)
+        return self._tag_index
+
+    def viewPositions(self) -> np.ndarray:
+        """Return the row positions in unfiltered_df of the rows of the filtered dataframe"""
+        if self._view_positions_of is not self._dataframe:
+            if self._dataframe is self._unfiltered_df:
+                self._view_positions = np.arange(len(self._unfiltered_df))
+            elif self._unfiltered_df.index.is_unique:
+                self._view_positions = self._unfiltered_df.index.get_indexer(self._dataframe.index)
+            else:
+                self._view_positions = np.full(len(self._dataframe), -1)
+            self._view_positions_of = self._dataframe
+            self._view_rows = None
+        return self._view_positions
+
+    def viewRowsOf(self, pks: list[str]) -> np.ndarray:
+        """Return the rows of the filtered dataframe having one of the pks"""
+        view_positions = self.viewPositions()
+        if self._view_rows is None:
+            # Inverse of view_positions: filtered row of each unfiltered_df row, -1 if filtered out
+            self._view_rows = np.full(len(self._unfiltered_df), -1)
+            found = view_positions >= 0
+            self._view_rows[view_positions[found]] = np.flatnonzero(found)
+
+        positions, _ = self.tagIndex().positionsOf(pks)
+        rows = self._view_rows[positions]
+        return rows[rows >= 0]
+
+    def tagLabel(self, row: int) -> str:
+        """Return the Tags column value of a row of the filtered dataframe"""
+        position = self.viewPositions()[row]
+        if position < 0:
+            # Index labels are not unique
+            pk = self.pkValue(row)
+            return "" if pk is None else ",".join(self.tagsOf(pk))
+        return self.tagIndex().label(position)
+
+    def tagsOf(self, pk) -> list[str]:
+        """Return the tags of a primary key value of this dataset, in the order of the store"""
+        tags = self.tags.tagsOf(pk)
+        return [tag for tag in self.tags.tags() if tag in tags and self.tags.matches(tag, self.pk_name)]
+
+    def tagsColumn(self) -> pd.Series:
+        """Return the Tags column of unfiltered_df, dictionary encoded"""
+        return pd.Series(self.tagIndex().column(), index=self._unfiltered_df.index, name=self.TAGS_COLUMN)
+
+    def tagCounts(self) -> dict[str, int]:
+        """Return the number of rows of each tag
+
+        The rows of a dataset not loaded yet are counted on its primary key
+        column, the only column read from the parquet.
+        """
+        if self.loaded:
+            return self.tagIndex().counts()
+
+        if self.pk_name == "":
+            return {}
+
+        try:
+            keys = readColumn(self.parquet, self.pk_name)
+        except (OSError, pa.ArrowInvalid, KeyError) as e:
+            logger.error(f"Cannot count the tagged rows of {self.name}: {e}")
+            return {}
+
+        return TagIndex.build(keys, self.tags, self.pk_name).counts()
+
+    def indexTag(self, pks: list[str], tag: str):
+        """Set a tag of the store on the rows of the pks, in the bitmaps and the Tags column only
+
+        Tags keyed by another column than the primary key are not joined.
+        """
+        if self._tag_index is None or not self.tags.matches(tag, self.pk_name):
+            return
+
+        positions, _ = self._tag_index.positionsOf(pks)
+        self._tag_index.add(tag, positions)
+
+    def unindexTag(self, pks: list[str], tag: str):
+        """Clear a tag removed from the store from the rows of the pks"""
+        if self._tag_index is None or len(pks) == 0:
+            return
+
+        positions, _ = self._tag_index.positionsOf(pks)
+        self._tag_index.remove(tag, positions)
+
+    def invalidateTagIndex(self):
+        self._tag_index = None
     
     def headers(self) -> list[str]:
         return self.dataframe.columns.values.tolist()
@@ -142,9 +477,24 @@ class DataSet:
         return info
 
 class PandasModel(QtCore.QAbstractTableModel):
+    # Row highlights, by priority
+    TAGGED, SHORTLISTED, FLAGGED = 1, 2, 3
+    HIGHLIGHT_COLORS = {TAGGED: QtGui.QColor(255, 243, 205),
+                        SHORTLISTED: QtGui.QColor(214, 234, 255),
+                        FLAGGED: QtGui.QColor(255, 214, 214)}
+    HIGHLIGHT_BLOCK = 256 # rows evaluated at once
+
+    sigTagsEdited = Signal(str, list) # pk, tags
+
     def __init__(self, dset: DataSet, parent=None):
         super(PandasModel, self).__init__(parent)
         self._dataset: DataSet = dset
+        self._shortlisted: set[str] = set()   # pks in the shortlist
+        self._flag_tags: set[str] = set()     # tags set by the analyzer rules
+        self._highlights: dict[int, np.ndarray] = {} # {block : highlight of its rows}
+        self._partition_worker: Worker = None # reads the partitions matching the filters
+        self._reading_partitions = ""         # partition expression being read
+        self.modelReset.connect(self.clearHighlights)
         
     @property
     def dataset(self):
@@ -155,13 +505,37 @@ class PandasModel(QtCore.QAbstractTableModel):
     
     def unfiltered_df(self):
         return self._dataset.unfiltered_df
+
+    def load(self, df: pd.DataFrame):
+        """Swap the decoded rows into a placeholder dataset"""
+        self.beginResetModel()
+        self.dataset.setData(df)
+        self.endResetModel()
+
+    def showRows(self, df: pd.DataFrame):
+        """Show rows read from the parquet of a placeholder dataset, which stays a placeholder"""
+        self.beginResetModel()
+        self.dataset.dataframe = self.dataset.dropLegacyTags(df)
+        self.endResetModel()
         
     def data(self, index: QtCore.QModelIndex, role: QtCore.Qt.ItemDataRole):
         if not index.isValid():
             return None
 
+        if role == QtCore.Qt.ItemDataRole.BackgroundRole:
+            return self.highlight(index.row())
+
         if role == QtCore.Qt.ItemDataRole.DisplayRole:
-            return str(self.dataset.dataframe.iloc[index.row(), index.column()])
+            if index.column() == self.dataset.tags_loc:
+                return self.dataset.tagLabel(index.row())
+
+            value = self.dataset.dataframe.iloc[index.row(), index.column()]
+
+            # Dates typed at import are shown without their midnight time
+            if isinstance(value, pd.Timestamp) and value == value.normalize():
+                return value.strftime("%Y-%m-%d")
+
+            return str(value)
 
         return None
 
@@ -169,10 +543,23 @@ class PandasModel(QtCore.QAbstractTableModel):
         if role != QtCore.Qt.ItemDataRole.EditRole:
             return False
 
-        if isinstance(value, list):
-            value = ','.join(value)
+        if index.column() == self.dataset.tags_loc:
+            pk = self.dataset.pkValue(index.row())
+            if pk is None:
+                return False
+
+            if isinstance(value, str):
+                value = [x.strip() for x in value.split(',') if x.strip() != ""]
+
+            # Tags are project wide, the Tagger applies them to every dataset
+            self.sigTagsEdited.emit(str(pk), value)
+            return True
+        else:
+            if isinstance(value, list):
+                value = ','.join(value)
 
-        self.dataset.dataframe.iloc[index.row(), index.column()] = value
+            self.dataset.setValue(index.row(), index.column(), value)
+        self._highlights.pop(index.row() // self.HIGHLIGHT_BLOCK, None)
         self.dataChanged.emit(index, index,
                                 [QtCore.Qt.ItemDataRole.DisplayRole, QtCore.Qt.ItemDataRole.EditRole])
         return True          
@@ -185,7 +572,7 @@ class PandasModel(QtCore.QAbstractTableModel):
 
     def columnCount(self, index) -> int:
         if index == QtCore.QModelIndex():
-            return len(self.dataset.headers())
+            return len(self.dataset.headers()) + 1 # virtual Tags column
 
         return 0
     
@@ -196,6 +583,8 @@ class PandasModel(QtCore.QAbstractTableModel):
         """
         if role == QtCore.Qt.ItemDataRole.DisplayRole:
             if orientation == QtCore.Qt.Orientation.Horizontal:
+                if section == self.dataset.tags_loc:
+                    return DataSet.TAGS_COLUMN
                 return str(self.dataset.dataframe.columns[section])
 
             if orientation == QtCore.Qt.Orientation.Vertical:
@@ -225,11 +614,35 @@ class PandasModel(QtCore.QAbstractTableModel):
     
     #TODO
     def apply_user_filter(self):
+        partition_filter, covered = self.dataset.partitionFilter()
+
+        # Filters on partition columns are applied by reading only the matching files,
+        # the other filters are applied once they are read
+        if (self.dataset.isPartitioned() and self.dataset.loaded
+                and str(partition_filter) != self.dataset.loaded_partition_filter):
+            self.readPartitions(partition_filter)
+            return
+
         df = self.unfiltered_df()
+
+        # Tag expressions are evaluated on the tag bitmaps, over all rows
+        mask = None
+        for filter in self.dataset.filters:
+            if filter.enabled and filter.attr == DataSet.TAGS_COLUMN:
+                try:
+                    filter_mask = self.dataset.tagIndex().evaluate(filter.expr)
+                except Exception as e:
+                    filter.failed = True
+                    logger.exception(e)
+                    return
+                mask = filter_mask if mask is None else mask & filter_mask
+        if mask is not None:
+            df = df[mask]
+
         for filter in self.dataset.filters:
-            if filter.enabled:
+            if filter.enabled and not filter in covered and filter.attr != DataSet.TAGS_COLUMN:
                 try:
-                    df = df.query(filter.expr)
+                    df = df.query(filter.expr, local_dict={"pd": pd})
                 except Exception as e:
                     filter.failed = True
                     logger.exception(e)
@@ -239,16 +652,138 @@ class PandasModel(QtCore.QAbstractTableModel):
         self.dataset.dataframe = df
         self.endResetModel()
 
-    def refresh(self):
-        df = pd.read_parquet(self.dataset.parquet)
+    def readPartitions(self, partition_filter: pc.Expression | None):
+        """Read the partitions matching the filters in the background"""
+        if self._partition_worker is not None and self._reading_partitions == str(partition_filter):
+            return
+
+        worker = Worker(readParquet, self.dataset.parquet, partition_filter=partition_filter)
+        worker.signals.sigResult.connect(partial(self.onPartitionsRead, str(partition_filter)))
+        worker.signals.sigFailed.connect(logger.error)
+        worker.signals.sigFinished.connect(partial(self.onPartitionReadFinished, worker))
+        self._partition_worker = worker
+        self._reading_partitions = str(partition_filter)
+        QtCore.QThreadPool.globalInstance().start(worker)
+
+    def onPartitionsRead(self, partition_filter: str, df: pd.DataFrame):
+        # The filters changed during the read
+        if partition_filter != self._reading_partitions:
+            return
+
         self.beginResetModel()
-        self.dataset.dataframe = self.dataset.unfiltered_df.copy()
+        self.dataset.setData(df)
+        self.dataset.loaded_partition_filter = partition_filter
         self.endResetModel()
 
-        # Disable filters
+        self.apply_user_filter()
+
+    def onPartitionReadFinished(self, worker: Worker):
+        if self._partition_worker is worker:
+            self._partition_worker = None
+
+    def upsert(self, df: pd.DataFrame) -> tuple[int, int]:
+        """Merge new rows into the dataset and re-apply the current filters"""
+        self.beginResetModel()
+        try:
+            counts = self.dataset.upsert(df)
+        finally:
+            self.endResetModel()
+
+        self.apply_user_filter()
+        return counts
+
+    def reload(self, result: RowGroupReload):
+        """Swap rows reloaded from disk into the model, keeping the current filters"""
+        self.beginResetModel()
+        if result.full is not None:
+            self.dataset.setData(result.full)
+            self.dataset.layout = result.layout
+        else:
+            self.dataset.spliceRowGroups(result.frames, result.layout)
+        self.dataset.rows_match_file = True
+        self.endResetModel()
+
+        self.apply_user_filter()
+
+    def refreshTags(self, pks: list[str]):
+        """Repaint the Tags cells and the highlight of the rows having one of the pks"""
+        rows = self.dataset.viewRowsOf(pks)
+        if len(rows) == 0:
+            return
+
+        for block in np.unique(rows // self.HIGHLIGHT_BLOCK).tolist():
+            self._highlights.pop(block, None)
+
+        top = self.index(int(rows.min()), 0)
+        bottom = self.index(int(rows.max()), self.dataset.tags_loc)
+        self.dataChanged.emit(top, bottom, [QtCore.Qt.ItemDataRole.DisplayRole, QtCore.Qt.ItemDataRole.BackgroundRole])
+
+    def refreshAllTags(self):
+        """Repaint the Tags cells and the highlights of every row"""
+        self.clearHighlights()
+
+        if self.rowCount(QtCore.QModelIndex()) > 0:
+            bottom = self.index(self.rowCount(QtCore.QModelIndex()) - 1, self.dataset.tags_loc)
+            self.dataChanged.emit(self.index(0, 0), bottom, [QtCore.Qt.ItemDataRole.DisplayRole, QtCore.Qt.ItemDataRole.BackgroundRole])
+
+    def setHighlightSources(self, shortlisted: set[str], flag_tags: set[str]):
+        """Set the shortlisted pks and the rule tags, and repaint the highlights"""
+        self._shortlisted = shortlisted
+        self._flag_tags = flag_tags
+        self.clearHighlights()
+
+        if self.rowCount(QtCore.QModelIndex()) > 0:
+            bottom = self.index(self.rowCount(QtCore.QModelIndex()) - 1, self.dataset.tags_loc)
+            self.dataChanged.emit(self.index(0, 0), bottom, [QtCore.Qt.ItemDataRole.BackgroundRole])
+
+    @Slot()
+    def clearHighlights(self):
+        self._highlights.clear()
+
+    def highlight(self, row: int) -> QtGui.QColor | None:
+        """Return the background of a row
+
+        The view only asks for the visible rows. They are evaluated by block
+        of HIGHLIGHT_BLOCK rows through the tag index, the result is cached
+        until the tags, the shortlist or the filtered rows change.
+        """
+        if self.dataset.pk_name == "":
+            return None
+
+        block = row // self.HIGHLIGHT_BLOCK
+        highlights = self._highlights.get(block)
+        if highlights is None:
+            highlights = self.evaluateHighlights(block)
+            self._highlights[block] = highlights
+
+        return self.HIGHLIGHT_COLORS.get(int(highlights[row - block * self.HIGHLIGHT_BLOCK]))
+
+    def evaluateHighlights(self, block: int) -> np.ndarray:
+        start = block * self.HIGHLIGHT_BLOCK
+        positions = self.dataset.viewPositions()[start:start + self.HIGHLIGHT_BLOCK]
+        highlights = np.zeros(len(positions), dtype=np.int8)
+
+        found = positions >= 0
+        positions = positions[found]
+        tag_index = self.dataset.tagIndex()
+
+        levels = np.zeros(len(positions), dtype=np.int8)
+        levels[tag_index.isTagged(positions)] = self.TAGGED
+        if len(self._shortlisted) > 0:
+            levels[tag_index.keys[positions].isin(self._shortlisted)] = self.SHORTLISTED
+        for tag in self._flag_tags:
+            levels[tag_index.contains(tag, positions)] = self.FLAGGED
+
+        highlights[found] = levels
+        return highlights
+
+    def refresh(self):
+        """Show all rows again and disable the filters"""
         for filter in self.dataset.filters:
             filter.enabled = False
 
+        self.apply_user_filter()
+
     @Slot(str, int)
     def setPrimaryIndex(self, name):
         self.dataset.pk_name = name
@@ -283,8 +818,9 @@ class IndexMenu(QtWidgets.QMenu):
 
 class DataView(QtWidgets.QTableView):
     sigOpenTagManager = Signal(QtCore.QModelIndex)
-    sigAddToShortlist = Signal(str, str)
+    sigAddToShortlist = Signal(str, list)
     sigDatasetInfoChanged = Signal(DataSet)
+    sigTagFilteredRows = Signal()
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -299,6 +835,7 @@ class DataView(QtWidgets.QTableView):
         self.action_openTagMenu = QtGui.QAction(QtGui.QIcon(":tags"), "Manage Tag", self, triggered=self.openTagMenu)
         self.action_show_indexmenu = QtGui.QAction("Show Index Menu", self, triggered=self.showIndexMenu)
         self.action_addToShortlist = QtGui.QAction("Add to Shortlist", self, triggered=self.addToShortlist)
+        self.action_tagFilteredRows = QtGui.QAction(QtGui.QIcon(":tags"), "Tag all filtered rows", self, triggered=self.sigTagFilteredRows)
 
         self.horizontalHeader().sortIndicatorChanged.connect(self.sortByColumn)
 
@@ -313,6 +850,7 @@ class DataView(QtWidgets.QTableView):
     def contextMenuEvent(self, event: QtGui.QMouseEvent):
         """Creating a context menu"""
         self.context_menu.addAction(self.action_openTagMenu)
+        self.context_menu.addAction(self.action_tagFilteredRows)
         self.context_menu.addAction(self.action_show_indexmenu)
         self.context_menu.addAction(self.action_addToShortlist)
         self.context_menu.exec(QtGui.QCursor().pos())
@@ -321,10 +859,19 @@ class DataView(QtWidgets.QTableView):
         model: PandasModel = self.model()
         if model.dataset.pk_name == "":
             self.action_openTagMenu.setEnabled(False)
+            self.action_tagFilteredRows.setEnabled(False)
             self.action_addToShortlist.setEnabled(False)
         else:
             self.action_openTagMenu.setEnabled(True)
+            self.action_tagFilteredRows.setEnabled(True)
             self.action_addToShortlist.setEnabled(True)
+
+    def selectedRows(self) -> np.ndarray:
+        """Return the selected row positions, built from the selection ranges rather than per cell"""
+        ranges = [np.arange(r.top(), r.bottom() + 1) for r in self.selectionModel().selection()]
+        if len(ranges) == 0:
+            return np.array([], dtype=int)
+        return np.unique(np.concatenate(ranges))
         
     @Slot()
     def openTagMenu(self):
@@ -349,21 +896,11 @@ class DataView(QtWidgets.QTableView):
         index: QtCore.QModelIndex = self.selectionModel().currentIndex()
 
         model: PandasModel = self.model()
-        pk_value = index.sibling(index.row(), model.dataset.pk_loc).data(QtCore.Qt.ItemDataRole.DisplayRole)
-        tag_col_index = -1
-        _tags = 'None'
-        try:
-            tag_col_index = model.dataframe().columns.get_loc("Tags")
-        except Exception as e:
-            pass
-
-        if tag_col_index > -1:
-            _tags = index.sibling(index.row(), tag_col_index).data(QtCore.Qt.ItemDataRole.DisplayRole)
-        
-        if _tags == 'None':
-            tags = ""
+        pk_value = model.dataset.pkValue(index.row())
+        if pk_value is None:
+            return
 
-        self.sigAddToShortlist.emit(pk_value, tags)
+        self.sigAddToShortlist.emit(str(pk_value), model.dataset.tagsOf(pk_value))
 
     @Slot()
     def onPrimaryKeyChanged(self):
@@ -388,6 +925,30 @@ class DataViewer(QtWidgets.QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.project = {}
+        self._conversion_cache: ConversionCache = None
+        self._pool = QtCore.QThreadPool(self)
+        self._import_jobs: dict[str, ImportJob] = {} # {source : job}
+        self._import_total = 0
+        self._import_done = 0
+        self._import_succeeded = 0
+        self._load_workers: dict[str, Worker] = {} # {dataset_id : worker}
+        self._load_callbacks: dict[str, list[Callable]] = {} # {dataset_id : [callback(model)]}, run once loaded
+        self._sync_keys: dict[str, str] = {} # {dataset_id : primary key}, last selection synced to a placeholder
+        self._sync_workers: set[Worker] = set()
+        self._append_workers: dict[str, Worker] = {} # {dataset_id : worker}
+        self._reload_workers: dict[str, Worker] = {} # {dataset_id : worker}
+
+        # Reload datasets whose parquet or source file changed on disk
+        self._watcher = QtCore.QFileSystemWatcher(self)
+        self._changed_paths: set[str] = set()
+        self._deferred_reimports: set[str] = set() # sources changed while a dataset converted from them had unsaved edits
+        self._watch_timer = QtCore.QTimer(self)
+        self._watch_timer.setSingleShot(True)
+        self._watch_timer.setInterval(500) # wait for the writer to finish
+        self._shortlisted: set[str] = set() # pks in the shortlist, highlighted in the views
+        self._rule_tags: set[str] = set()   # tags set by the analyzer rules, highlighted in the views
+        self._shortlist_timer = QtCore.QTimer(self)
+        self._shortlist_timer.setSingleShot(True) # coalesce the signals of a shortlist load
 
         vbox = QtWidgets.QVBoxLayout(self)
         self.setLayout(vbox)
@@ -441,6 +1002,12 @@ class DataViewer(QtWidgets.QWidget):
         self.action_setTileView = QtGui.QAction(QtGui.QIcon(':layout-grid-line'), "Tile", self, triggered=self.setTileView)
         self.action_setTabbedView = QtGui.QAction(QtGui.QIcon(':folder-2-line'), "Tabbed", self, triggered=self.setTabbedView)
 
+        self.action_tagStatistics = QtGui.QAction(QtGui.QIcon(":tags"), "Tag statistics", self, triggered=self.showTagStatistics)
+
+        # Cancel import
+        self.action_cancelImport = QtGui.QAction(QtGui.QIcon(":close-line"), "Cancel import", self, triggered=self.cancelImport)
+        self.action_cancelImport.setEnabled(False)
+
         self.action_close = QtGui.QAction("Cl&ose", self, statusTip="Close the active window", triggered=self.close)
         self.action_closeall = QtGui.QAction("Close &All", self, statusTip="Close all the windows", triggered=self.close_all)
     
@@ -498,6 +1065,8 @@ class DataViewer(QtWidgets.QWidget):
         self.toolbar.addAction(self.action_getInfo)
         self.toolbar.addAction(self.action_resetFilters)
         self.toolbar.addAction(self.action_syncSelectionFilter)
+        self.toolbar.addAction(self.action_tagStatistics)
+        self.toolbar.addAction(self.action_cancelImport)
         
         spacer = QtWidgets.QWidget()
         spacer.setSizePolicy(QtWidgets.QSizePolicy.Policy.Expanding, QtWidgets.QSizePolicy.Policy.Preferred)
@@ -512,16 +1081,34 @@ class DataViewer(QtWidgets.QWidget):
 
     def connectSignals(self):
         self.mdi.subWindowActivated.connect(self.setCurrentFilterModel)
+        self.mdi.subWindowActivated.connect(self.onSubWindowActivated)
         self.filter_pane.sigToggleFilter.connect(self.toggleFilter)
         self.filter_pane.sigFilterChanged.connect(self.onFilterChanged)
+        self._watcher.fileChanged.connect(self.onFileChanged)
+        self._watcher.directoryChanged.connect(self.onFileChanged)
+        self._watch_timer.timeout.connect(self.reloadChangedFiles)
         # self.shortlister.sigTagsEdited.connect(self.tag_pane.)
+        self.tag_pane.model().sigTagged.connect(self.onTagged)
+        self.tag_pane.model().sigUntagged.connect(self.onUntagged)
+        self.tag_pane.model().modelReset.connect(self.onTagsReset)
+        shortlist_model = self.shortlister.model()
+        shortlist_model.modelReset.connect(self._shortlist_timer.start)
+        shortlist_model.rowsInserted.connect(self._shortlist_timer.start)
+        shortlist_model.rowsRemoved.connect(self._shortlist_timer.start)
+        shortlist_model.dataChanged.connect(self._shortlist_timer.start)
+        self._shortlist_timer.timeout.connect(self.onShortlistChanged)
+        self.tag_pane.model().sigTagRemoved.connect(self.onTagRemoved)
+        self.tag_pane.model().sigTagRenamed.connect(self.onTagRenamed)
+        self.tag_pane.model().sigMemberRenamed.connect(self.onTagMemberRenamed)
 
     def createDataView(self, dataset: DataSet):
         if dataset is not None:
+            dataset.setTagStore(self.tag_pane.model().store())
             pandas_model = PandasModel(dataset)
             table = DataView()
             table.tablename = dataset.name
             table.setModel(pandas_model)
+            pandas_model.setHighlightSources(self._shortlisted, self._rule_tags)
             table.updateContextMenu()
             table.resizeColumnsToContents()
             table.setSortingEnabled(True)
@@ -532,15 +1119,149 @@ class DataViewer(QtWidgets.QWidget):
             table.sigDatasetInfoChanged.connect(self.updateActionState)
             table.sigDatasetInfoChanged.connect(self.sigDatasetInfoChanged)
             table.sigAddToShortlist.connect(self.shortlister.addShortlistItem)
+            table.sigTagFilteredRows.connect(self.onTagFilteredRows)
+            pandas_model.sigTagsEdited.connect(self.onTagsEdited)
 
             subwindow = self.mdi.addSubWindow(table)
 
             subwindow.setWindowTitle(table.tablename)
             subwindow.show()
 
+            self.watch(dataset)
+
+    def watch(self, dataset: DataSet):
+        """Watch the parquet of a dataset and the source file it was converted from"""
+        parquet = dataset.parquet
+        if not parquet.exists():
+            return
+
+        paths = [parquet.as_posix()]
+        if parquet.is_dir():
+            paths.extend(p.as_posix() for p in parquet.rglob("*") if p.is_dir())
+        elif "project_rootpath" in self.project:
+            source = self.conversionCache().sourceOf(parquet)
+            if source is not None and source.exists():
+                paths.append(source.as_posix())
+
+        self._watcher.addPaths([p for p in paths if not p in self._watcher.files() + self._watcher.directories()])
+
+    @Slot(str)
+    def onFileChanged(self, path: str):
+        # Files replaced by a rename are no longer watched
+        if Path(path).exists() and not path in self._watcher.files() + self._watcher.directories():
+            self._watcher.addPath(path)
+
+        self._changed_paths.add(path)
+        self._watch_timer.start()
+
+    @Slot()
+    def reloadChangedFiles(self):
+        changed = self._changed_paths
+        self._changed_paths = set()
+
+        sources = []
+        for path in changed:
+            if not Path(path).exists():
+                continue
+
+            reloaded = False
+            for subwindow in self.mdi.subWindowList():
+                model: PandasModel = subwindow.widget().model()
+                parquet = model.dataset.parquet
+                if parquet.as_posix() == path or (parquet.is_dir() and parquet in Path(path).parents):
+                    self.reloadDataset(model)
+                    reloaded = True
+
+            if not reloaded:
+                sources.append(path)
+
+        # Source files are converted again, the rewritten parquets are reloaded in turn
+        if len(sources) > 0:
+            self.reimportSources(sources)
+
+    def reimportSources(self, sources: list[str]):
+        """Convert changed source files again, unless an open dataset converted from them has unsaved edits
+
+        The conversion would write over the parquet under the edits, it is
+        deferred until they are saved.
+        """
+        reimports = []
+        for source in sources:
+            dirty = [dataset.name for dataset in self.datasetsOf(Path(source)) if dataset.isDirty()]
+            if len(dirty) > 0:
+                self._deferred_reimports.add(source)
+                self.sigMessage.emit(f"{Path(source).name} changed, reimport deferred until the edits of {', '.join(dirty)} are saved")
+            else:
+                self._deferred_reimports.discard(source)
+                reimports.append(source)
+
+        if len(reimports) > 0:
+            self.loadFiles(reimports, update_json=False, reimport=True)
+
+    def datasetsOf(self, source: Path) -> list[DataSet]:
+        """Return the open datasets converted from a source file"""
+        datasets = []
+        for subwindow in self.mdi.subWindowList():
+            dataset: DataSet = subwindow.widget().model().dataset
+            if not dataset.parquet.is_dir() and self.conversionCache().sourceOf(dataset.parquet) == source:
+                datasets.append(dataset)
+        return datasets
+
+    def reloadDataset(self, model: PandasModel):
+        """Reload the changed row groups of a dataset in the background"""
+        dataset = model.dataset
+
+        # Not decoded yet: the rows will be read from the new file
+        if not dataset.loaded:
+            return
+
+        if dataset.isDirty():
+            self.sigMessage.emit(f"{dataset.name} changed on disk, unsaved edits are kept. Saving will ask before overwriting")
+            return
+
+        if dataset.uid in self._reload_workers:
+            # Try again once the running reload is done
+            self._changed_paths.add(dataset.parquet.as_posix())
+            self._watch_timer.start()
+            return
+
+        if dataset.isPartitioned():
+            partition_filter, covered = dataset.partitionFilter()
+            worker = Worker(lambda: RowGroupReload(None, {}, readParquet(dataset.parquet, partition_filter=partition_filter)))
+        else:
+            worker = Worker(reloadRowGroups, dataset.parquet, dataset.layout, dataset.rows_match_file)
+        worker.signals.sigResult.connect(partial(self.onDatasetReloaded, model))
+        worker.signals.sigFinished.connect(partial(self._reload_workers.pop, dataset.uid, None))
+        self._reload_workers[dataset.uid] = worker
+        self._pool.start(worker)
+
+    def onDatasetReloaded(self, model: PandasModel, result: RowGroupReload):
+        dataset = model.dataset
+
+        # Edited while reloading
+        if dataset.isDirty():
+            self.sigMessage.emit(f"{dataset.name} changed on disk, unsaved edits are kept")
+            return
+
+        if result.full is None and len(result.frames) == 0:
+            dataset.layout = result.layout
+            return
+
+        model.reload(result)
+
+        for subwindow in self.mdi.subWindowList():
+            table: DataView = subwindow.widget()
+            if table.model() is model:
+                table.resizeColumnsToContents()
+
+        reloaded = "all rows" if result.full is not None else f"{len(result.frames)} row groups"
+        self.sigMessage.emit(f"{dataset.name} reloaded ({reloaded})")
+
     #TODO
     def createFilterModel(self, dataset: DataSet):
-        self.filter_pane.createModel(dataset.uid, dataset.filters, dataset.dataframe.dtypes.to_dict())
+        attrs = dataset.dataframe.dtypes.to_dict()
+        attrs[DataSet.TAGS_COLUMN] = FilterDialog.TAGS_TYPE
+        self.filter_pane.createModel(dataset.uid, dataset.filters, attrs)
     
     @Slot(QtWidgets.QMdiSubWindow)
     def setCurrentFilterModel(self, subwindow: QtWidgets.QMdiSubWindow):
@@ -596,8 +1317,22 @@ class DataViewer(QtWidgets.QWidget):
             if metadata.get("dataset_id") == dataset_id:
                 return metadata
 
+    def conversionCache(self) -> ConversionCache:
+        """Return the source-to-parquet conversion cache of the current project"""
+        cache_file = Path(self.project.get("project_rootpath")).joinpath("parquets", "conversions.json")
+
+        if self._conversion_cache is None or self._conversion_cache._cache_file != cache_file:
+            self._conversion_cache = ConversionCache(cache_file)
+
+        return self._conversion_cache
+
     #TODO : merge with loadProjectData
-    def loadFiles(self, files: list, update_json: bool = True):
+    def loadFiles(self, files: list, update_json: bool = True, reimport: bool = False):
+        """Import files in the background, one job per file
+
+        With reimport, files already opened are converted again, e.g. after
+        they changed on disk.
+        """
         if not "project_rootpath" in self.project:
             return
 
@@ -605,58 +1340,129 @@ class DataViewer(QtWidgets.QWidget):
 
         if len(files) == 0:
             return
+
+        parquet_folder = QtCore.QDir(rootpath.joinpath("parquets").as_posix())
+        parquet_folder.mkpath(".")
+
+        loaded = {subwindow.widget().tablename for subwindow in self.mdi.subWindowList()}
+        cache = self.conversionCache()
+
+        # QSettings is read here, on the GUI thread, the jobs get the values
+        profile = mconf.settings.value("parquet_profile", "default", str)
+        threshold = mconf.settings.value("xlsx_stream_mb", 20, int)
+        writer = partial(self.save2Parquet, profile=profile)
+        streamer = partial(self.streamWorkbook, threshold_mb=threshold, profile=self.writeProfile(profile))
+
+        jobs = []
         for file in files:
             filepath = Path(file)
             
-            if self.isDatasetLoaded(filepath):
+            if filepath.as_posix() in self._import_jobs:
                 continue
 
-            datasets = self.readFile(filepath)
-            if len(datasets) == 0:
-                return
+            if self.isDatasetLoaded(filepath) and not reimport:
+                continue
+
+            job = ImportJob(filepath, rootpath, cache, self.readFile, writer, loaded, streamer, update_json)
+            job.signals.sigStage.connect(self.onImportStage)
+            job.signals.sigDatasetReady.connect(partial(self.onDatasetReady, update_json=job.update_json))
+            job.signals.sigFinished.connect(self.onImportFinished)
+            job.signals.sigFailed.connect(self.onImportFailed)
+            job.signals.sigCancelled.connect(self.onImportCancelled)
+            jobs.append(job)
 
-            dataset: DataSet
-            for dataset in datasets:
-                headers: list = dataset.headers()
+        if len(jobs) == 0:
+            return
 
-                if not 'Tags' in headers:
-                    headers.append('Tags')
-                    # df = df.reindex(columns=headers)
-                    dataset.dataframe.insert(len(dataset.headers()), 'Tags', None)
+        if len(self._import_jobs) == 0:
+            self._import_total = 0
+            self._import_done = 0
+            self._import_succeeded = 0
 
-                parquetfile = rootpath.joinpath("parquets", f"{dataset.name}.parquet")
-                parquet_folder = QtCore.QDir(rootpath.joinpath("parquets").as_posix())
-                parquet_folder.mkpath(".")
-                
-                if dataset is not None and filepath.parent != parquetfile.parent:
-                    if not self.save2Parquet(dataset.dataframe, parquetfile):
-                        return
+        self._import_total += len(jobs)
+        self.sigLoadingStarted.emit(self._import_total, "Importing datasets...")
+        self.action_cancelImport.setEnabled(True)
 
-                dataset.parquet = parquetfile
+        for job in jobs:
+            self._import_jobs[job.source] = job
+            self._pool.start(job)
 
-                dataset_info: dict = self.getDatasetInfoFromProject(dataset.uid)
-                dataset.deserialize(dataset_info)
+    @Slot()
+    def cancelImport(self):
+        """Cancel running imports, queued ones are dropped before they start"""
+        for job in list(self._import_jobs.values()):
+            if self._pool.tryTake(job):
+                self.onImportCancelled(job.source)
+            else:
+                job.cancel()
+
+    @Slot(str, str)
+    def onImportStage(self, source: str, stage: str):
+        self.sigMessage.emit(stage)
+
+    @Slot(object)
+    def onDatasetReady(self, dataset: DataSet, update_json: bool = True):
+        if self.isDatasetLoaded(dataset.parquet):
+            return
 
-                self.createDataView(dataset)
-                self.createFilterModel(dataset)
+        dataset_info: dict = self.getDatasetInfoFromProject(dataset.uid)
+        dataset.deserialize(dataset_info)
 
-                if update_json:
-                    self.sigDatasetImported.emit(dataset)
-            
-        self.updateActionState()
+        self.createDataView(dataset)
+        self.createFilterModel(dataset)
+
+        # Datasets served from the cache may already be part of the project
+        if update_json and dataset_info is None:
+            self.sigDatasetImported.emit(dataset)
+
+    @Slot(str, list, bool)
+    def onImportFinished(self, source: str, parquets: list, converted: bool):
+        if converted:
+            self.conversionCache().store(Path(source), parquets)
+            if not source in self._watcher.files():
+                self._watcher.addPath(source)
+        self._import_succeeded += 1
+        self.endImportJob(source)
+
+    @Slot(str, str)
+    def onImportFailed(self, source: str, err: str):
+        logger.error(f"Import failed: {source} - {err}")
+        self.endImportJob(source)
+
+    @Slot(str)
+    def onImportCancelled(self, source: str):
+        logger.info(f"Import cancelled: {source}")
+        self.endImportJob(source)
+
+    def endImportJob(self, source: str):
+        if self._import_jobs.pop(source, None) is None:
+            return
+
+        self._import_done += 1
+        self.sigLoadingProgress.emit(self._import_done)
+
+        if len(self._import_jobs) == 0:
+            self.action_cancelImport.setEnabled(False)
+            self.updateActionState()
+            self.sigLoadingEnded.emit(f"Dataset imported ({self._import_succeeded}/{self._import_total})")
 
     @Slot()
     def loadProjectData(self):
+        """Open the project with placeholder views
+
+        Only the parquet footers are read here. Rows are decoded the first time
+        a view is activated and its neighbours are prefetched in the background.
+        """
         dataset_list: list = self.project.get("datasets")
         if dataset_list is None:
             return
 
         cnt = 0
-        self.sigLoadingStarted.emit(len(dataset_list), "Loading datasets...")
+        self.sigLoadingStarted.emit(len(dataset_list), "Opening datasets...")
         
-        for dataset_info in dataset_list:
+        for i, dataset_info in enumerate(dataset_list):
             parquet_str = dataset_info.get("metadata", {}).get("parquet")
-            self.sigLoadingProgress.emit(cnt)
+            self.sigLoadingProgress.emit(i)
             parquet = Path(parquet_str)
 
             # Skip if file is missing
@@ -667,9 +1473,13 @@ class DataViewer(QtWidgets.QWidget):
             # Skip if dataset already loaded
             if self.isDatasetLoaded(parquet):
                 continue
-            
-            datasets = self.readFile(parquet)
-            dataset: DataSet = datasets[0]
+
+            try:
+                dataset = DataSet.fromSchema(parquet, parquet.stem.upper())
+            except Exception as e:
+                logger.error(e)
+                continue
+
             dataset.deserialize(dataset_info)
 
             self.createDataView(dataset)
@@ -678,7 +1488,170 @@ class DataViewer(QtWidgets.QWidget):
 
         self.sigLoadingProgress.emit(len(dataset_list))
         self.updateActionState()
-        self.sigLoadingEnded.emit(f"Dataset loaded ({cnt}/{len(dataset_list)})")
+        self.sigLoadingEnded.emit(f"Dataset opened ({cnt}/{len(dataset_list)})")
+
+    def loadDirectory(self, directory: Path):
+        """Open a directory of hive-partitioned parquets as a single dataset
+
+        Rows are decoded when the view is activated, filters on the partition
+        columns only read the matching files.
+        """
+        if not "project_rootpath" in self.project:
+            return
+
+        if self.isDatasetLoaded(directory):
+            return
+
+        try:
+            dataset = DataSet.fromSchema(directory, directory.name.upper())
+        except Exception as e:
+            logger.error(e)
+            self.sigMessage.emit(f"Cannot open {directory.name}")
+            return
+
+        dataset.parquet = directory
+        dataset_info: dict = self.getDatasetInfoFromProject(dataset.uid)
+        dataset.deserialize(dataset_info)
+
+        self.createDataView(dataset)
+        self.createFilterModel(dataset)
+        self.updateActionState()
+
+        if dataset_info is None:
+            self.sigDatasetImported.emit(dataset)
+
+        self.sigMessage.emit(f"{dataset.name} opened ({len(dataset.partition_schema.names)} partition columns)")
+
+    def appendToDataset(self, filepath: Path):
+        """Upsert the rows of a file (e.g. a new reporting period) into the active dataset by primary key"""
+        active_subwindow = self.mdi.activeSubWindow()
+        if active_subwindow is None:
+            return
+
+        model: PandasModel = active_subwindow.widget().model()
+        dataset = model.dataset
+
+        if dataset.pk_name == "":
+            self.sigMessage.emit(f"{dataset.name}: set a primary key before appending")
+            return
+
+        if dataset.isPartitioned():
+            self.sigMessage.emit(f"{dataset.name}: partitioned datasets are read-only")
+            return
+
+        if dataset.uid in self._append_workers:
+            return
+
+        self.loadDataset(model, callback=partial(self.readAppendFile, filepath))
+
+    def readAppendFile(self, filepath: Path, model: PandasModel):
+        dataset = model.dataset
+        if dataset.uid in self._append_workers:
+            return
+
+        self.sigMessage.emit(f"Reading {filepath.name}...")
+
+        worker = Worker(self.readFile, filepath)
+        worker.signals.sigResult.connect(partial(self.onAppendRead, model, filepath))
+        worker.signals.sigFailed.connect(self.sigMessage)
+        worker.signals.sigFinished.connect(partial(self._append_workers.pop, dataset.uid, None))
+        self._append_workers[dataset.uid] = worker
+        self._pool.start(worker)
+
+    def onAppendRead(self, model: PandasModel, filepath: Path, datasets: list[DataSet] | None):
+        if not datasets:
+            self.sigMessage.emit(f"Cannot read {filepath.name}")
+            return
+
+        # Workbooks: prefer the sheet named after the dataset
+        source = next((d for d in datasets if d.name == model.dataset.name), datasets[0])
+
+        try:
+            updated, appended = model.upsert(source.unfiltered_df)
+        except (ValueError, KeyError) as e:
+            logger.error(e)
+            self.sigMessage.emit(f"Cannot append {filepath.name}: {e}")
+            return
+
+        self.saveEdits(model.dataset)
+
+        for subwindow in self.mdi.subWindowList():
+            table: DataView = subwindow.widget()
+            if table.model() is model:
+                table.resizeColumnsToContents()
+
+        self.sigMessage.emit(f"{model.dataset.name}: {updated} rows updated, {appended} appended")
+
+    @Slot(QtWidgets.QMdiSubWindow)
+    def onSubWindowActivated(self, subwindow: QtWidgets.QMdiSubWindow):
+        if subwindow is None:
+            return
+
+        self.loadDataset(subwindow.widget().model())
+
+        # Prefetch the neighbouring windows, the likely next ones to be activated
+        subwindows = self.mdi.subWindowList()
+        i = subwindows.index(subwindow)
+        for neighbour in subwindows[i + 1:i + 3] + subwindows[max(i - 1, 0):i]:
+            self.loadDataset(neighbour.widget().model(), prefetch=True)
+
+    def loadDataset(self, model: PandasModel, prefetch: bool = False, callback: Callable = None):
+        """Decode the rows of a placeholder dataset in the background
+
+        callback is called with the model once the rows are loaded, right away
+        if they already are.
+        """
+        dataset = model.dataset
+
+        if dataset.loaded:
+            if callback is not None:
+                callback(model)
+            return
+
+        if callback is not None:
+            self._load_callbacks.setdefault(dataset.uid, []).append(callback)
+
+        if dataset.uid in self._load_workers:
+            return
+
+        ipc_cache = mconf.settings.value("ipc_cache", False, bool)
+        partition_filter, covered = dataset.partitionFilter()
+        dataset.loaded_partition_filter = str(partition_filter)
+
+        if not prefetch:
+            self.sigMessage.emit(f"Loading {dataset.name}...")
+
+        worker = Worker(readParquetLayout, dataset.parquet, ipc_cache, partition_filter)
+        worker.signals.sigResult.connect(partial(self.onDatasetLoaded, model))
+        worker.signals.sigFailed.connect(self.sigMessage)
+        worker.signals.sigFinished.connect(partial(self.onDatasetLoadFinished, dataset.uid))
+        self._load_workers[dataset.uid] = worker
+        self._pool.start(worker, -1 if prefetch else 1)
+
+    def onDatasetLoaded(self, model: PandasModel, result: tuple[pd.DataFrame, RowGroupLayout]):
+        if not model.dataset.loaded:
+            self.showLoadedDataset(model, result)
+
+        for callback in self._load_callbacks.pop(model.dataset.uid, []):
+            callback(model)
+
+    def onDatasetLoadFinished(self, uid: str):
+        self._load_workers.pop(uid, None)
+        # Callbacks of a failed load
+        self._load_callbacks.pop(uid, None)
+
+    def showLoadedDataset(self, model: PandasModel, result: tuple[pd.DataFrame, RowGroupLayout]):
+        df, layout = result
+        model.load(df)
+        model.dataset.layout = layout
+        if any(filter.enabled for filter in model.dataset.filters):
+            model.apply_user_filter()
+        self.sigMessage.emit(f"{model.dataset.name} loaded")
+
+        for subwindow in self.mdi.subWindowList():
+            table: DataView = subwindow.widget()
+            if table.model() is model:
+                table.resizeColumnsToContents()
     
     @classmethod
     def readFile(cls, filepath: Path, **kwargs) -> list[DataSet]:
@@ -734,6 +1707,34 @@ class DataViewer(QtWidgets.QWidget):
         return dfs
     
     #TODO
+    @classmethod
+    def streamWorkbook(cls, filepath: Path, parquet_folder: Path, stage: Callable,
+                       threshold_mb: int, profile: WriteProfile) -> list[DataSet] | None:
+        """Convert a large workbook sheet by sheet with bounded memory
+
+        Returns placeholder datasets, rows are decoded from the parquets when
+        their view is activated. None if the file is not a large workbook.
+        """
+        if filepath.suffix.lower() != ".xlsx":
+            return None
+
+        if filepath.stat().st_size < threshold_mb * 1024 * 1024:
+            return None
+
+        stage(f"Streaming {filepath.name}...")
+        parquets = streamWorkbook(filepath,
+                                  parquet_folder,
+                                  profile,
+                                  progress=lambda sheet, rows: stage(f"Streaming {sheet}: {rows} rows..."))
+
+        datasets = []
+        for parquet in parquets:
+            dataset = DataSet.fromSchema(parquet, parquet.stem.upper())
+            dataset.parquet = parquet
+            datasets.append(dataset)
+
+        return datasets
+
     def getDatasetInfoFromProject(self, dataset_id) -> dict | None:
         json_dataset: dict
         for json_dataset in self.project.get("datasets", []):
@@ -743,10 +1744,29 @@ class DataViewer(QtWidgets.QWidget):
         return None
     
     @classmethod
-    def save2Parquet(cls, df: pd.DataFrame, filepath: Path) -> bool:
-        """Save pandas dataframe to Apache Parquet file"""
+    def writeProfile(cls, profile: str = None) -> WriteProfile:
+        """Return a write profile, the "parquet_profile" setting by default"""
+        if profile is None:
+            profile = mconf.settings.value("parquet_profile", "default", str)
+
+        write_profile = WRITE_PROFILES.get(profile)
+        if write_profile is None:
+            logger.warning(f"Unknown parquet profile: {profile}")
+            write_profile = WRITE_PROFILES["default"]
+
+        return write_profile
+
+    @classmethod
+    def save2Parquet(cls, df: pd.DataFrame, filepath: Path, pk_name: str = "", profile: str = None) -> bool:
+        """Save pandas dataframe to Apache Parquet file
+
+        The layout (row groups, dictionary encoding, compression, page index and
+        primary key sorting) follows a write profile.
+        """
+        write_profile = cls.writeProfile(profile)
+
         try:
-            df.to_parquet(filepath.with_suffix('.parquet').as_posix())
+            writeParquet(df, filepath.with_suffix('.parquet'), write_profile, pk_name)
         except Exception as e:
             logger.error(e)
             return False
@@ -808,8 +1828,33 @@ class DataViewer(QtWidgets.QWidget):
                     continue
                 
                 widget: DataView = subwindow.widget()
-                widget.model().apply_pk_filter(sid)
-                widget.resizeColumnsToContents()
+                related: PandasModel = widget.model()
+                if related.dataset.loaded:
+                    related.apply_pk_filter(sid)
+                    widget.resizeColumnsToContents()
+                    continue
+
+                # Placeholder: read only the row groups that may hold the key
+                self._sync_keys[related.dataset.uid] = sid
+                worker = Worker(readMatchingRows, related.dataset.parquet, related.dataset.pk_name, sid)
+                worker.signals.sigResult.connect(partial(self.onSyncRowsRead, widget, sid))
+                worker.signals.sigFailed.connect(self.sigMessage)
+                worker.signals.sigFinished.connect(partial(self._sync_workers.discard, worker))
+                self._sync_workers.add(worker)
+                self._pool.start(worker, 1)
+
+    def onSyncRowsRead(self, widget: "DataView", sid: str, df: pd.DataFrame):
+        model: PandasModel = widget.model()
+        if self._sync_keys.get(model.dataset.uid) != sid:
+            # A later selection was synced meanwhile
+            return
+
+        del self._sync_keys[model.dataset.uid]
+        if model.dataset.loaded:
+            model.apply_pk_filter(sid)
+        else:
+            model.showRows(df)
+        widget.resizeColumnsToContents()
 
     @Slot()
     def resetFilters(self):
@@ -831,23 +1876,188 @@ class DataViewer(QtWidgets.QWidget):
         table: DataView = self.mdi.activeSubWindow().widget()
         table_model: PandasModel = table.model()
 
-        tags: str = index.sibling(index.row(), table.model().columnCount(QtCore.QModelIndex())-1).data(QtCore.Qt.ItemDataRole.DisplayRole)
-       
-        if tags == 'None':
-            self.tag_dialog.tag_list.model().setStringList([])
-        else:
-            self.tag_dialog.tag_list.model().setStringList(tags.split(","))
+        pk = table_model.dataset.pkValue(index.row())
+        tags = [] if pk is None else sorted(table_model.dataset.tagsOf(pk))
+        self.tag_dialog.tag_list.model().setStringList(tags)
 
         self.tag_dialog.exec()
 
     @Slot(str)
     def add2Tag(self, tagname: str):
+        """Tag the selected rows of the active view"""
         table: DataView = self.mdi.activeSubWindow().widget()
-        table_model: PandasModel = table.model()
-        index = table.selectionModel().currentIndex()
+        rows = table.selectedRows()
+        if len(rows) == 0:
+            rows = np.array([table.selectionModel().currentIndex().row()])
+
+        self.tagRows(table.model(), tagname, rows)
+
+    @Slot()
+    def onTagFilteredRows(self):
+        table: DataView = self.sender()
+        model: PandasModel = table.model()
+
+        tags: list = mconf.settings.value("tags", [], list)
+        tagname, ok = QtWidgets.QInputDialog.getItem(self,
+                                                     "Tag filtered rows",
+                                                     f"Tag the {len(model.dataframe())} rows of {model.dataset.name} with",
+                                                     sorted(set(tags) | set(self.tag_pane.model().store().tags())),
+                                                     editable=True)
+        if ok and tagname.strip() != "":
+            self.tagRows(model, tagname.strip())
+
+    def tagRows(self, model: PandasModel, tagname: str, rows: np.ndarray = None):
+        """Tag rows of the filtered view (all of them if rows is None) in one operation
+
+        The tree gets a single insert and the persistence a single write,
+        whatever the number of rows.
+        """
+        dataset = model.dataset
+        if dataset.pk_loc is None or dataset.pk_loc < 0:
+            return
+
+        keys = dataset.dataframe.iloc[:, dataset.pk_loc]
+        if rows is not None:
+            keys = keys.iloc[rows]
+        pks = pd.unique(keys.dropna().astype(str)).tolist()
+
+        if not self.checkTagKey(tagname, dataset):
+            return
+
+        # The datasets show it through sigTagged, the dataset parquet is not rewritten
+        self.tag_pane.model().add2Tag(pks, tagname, dataset.pk_name)
+        related = self.relatedRows(dataset, pks)
+
+        related = f" ({related} related rows in other datasets)" if related > 0 else ""
+        self.sigMessage.emit(f"{len(pks)} cases tagged {tagname}{related}")
+
+    def checkTagKey(self, tagname: str, dataset: DataSet) -> bool:
+        """Return whether the pks of a tag are values of the primary key column of a dataset"""
+        store = self.tag_pane.model().store()
+        if store.matches(tagname, dataset.pk_name):
+            return True
+
+        self.sigMessage.emit(f"{tagname} tags {store.keyOf(tagname)} values, {dataset.name} is keyed by {dataset.pk_name}")
+        return False
+
+    @Slot()
+    def onShortlistChanged(self):
+        shortlisted = {str(item.title).strip() for item in self.shortlister.model().items() if item.title}
+        if shortlisted == self._shortlisted:
+            return
+
+        self._shortlisted = shortlisted
+        self.updateHighlights()
+
+    def setRuleTags(self, tags: list[str]):
+        """Highlight the rows carrying a tag set by an analyzer rule"""
+        self._rule_tags = set(tags)
+        self.updateHighlights()
+
+    def updateHighlights(self):
+        for subwindow in self.mdi.subWindowList():
+            model: PandasModel = subwindow.widget().model()
+            model.setHighlightSources(self._shortlisted, self._rule_tags)
+
+    @Slot()
+    def showTagStatistics(self):
+        """Show the cases of each tag, its rows in each open dataset and the co-occurrence of the tags"""
+        cooccurrence = self.tag_pane.cooccurrence()
+        tags = cooccurrence.tags()
+
+        counts = pd.DataFrame({"Cases": [cooccurrence.count(tag) for tag in tags]}, index=tags)
+        for subwindow in self.mdi.subWindowList():
+            dataset: DataSet = subwindow.widget().model().dataset
+            dataset_counts = dataset.tagCounts()
+            counts[dataset.name] = [dataset_counts.get(tag, 0) for tag in tags]
+
+        dialog = TagStatisticsDialog(counts, cooccurrence.frame(), self)
+        dialog.exec()
+
+    def relatedRows(self, dataset: DataSet, pks: list[str]) -> int:
+        """Return the number of rows of the cases in the other loaded datasets keyed by the same column
+
+        e.g. master, event and report tables keyed by CASE_ID. They show the
+        tags of the project through their key index, so nothing is written for
+        them. Datasets not loaded yet join the tags when they load.
+        """
+        related_rows = 0
+
+        for subwindow in self.mdi.subWindowList():
+            related: DataSet = subwindow.widget().model().dataset
+            if related is dataset or not related.loaded or related.pk_name == "" or related.pk_name != dataset.pk_name:
+                continue
+
+            positions, _ = related.tagIndex().positionsOf(pks)
+            related_rows += len(positions)
+
+        return related_rows
 
-        primary_key: str = index.sibling(index.row(), table_model.dataset.pk_loc).data(QtCore.Qt.ItemDataRole.DisplayRole)
-        self.tag_pane.model().add2Tag([primary_key], tagname)
+    @Slot(str, list)
+    def onTagsEdited(self, pk: str, tags: list):
+        """Apply the Tags cell edited in a view to the project tags"""
+        model: PandasModel = self.sender()
+        dataset = model.dataset
+        tag_model = self.tag_pane.model()
+        current = dataset.tagsOf(pk)
+
+        for tag in current:
+            if tag not in tags:
+                tag_model.removeFromTag([pk], tag)
+        for tag in tags:
+            if tag in current:
+                continue
+            if not self.checkTagKey(tag, dataset):
+                continue
+            tag_model.add2Tag([pk], tag, dataset.pk_name)
+
+    @Slot(list, str)
+    def onTagged(self, pks: list, tagname: str):
+        """Apply a tag added to the project to the Tags column of every dataset"""
+        for subwindow in self.mdi.subWindowList():
+            model: PandasModel = subwindow.widget().model()
+            model.dataset.indexTag(pks, tagname)
+            model.refreshTags(pks)
+
+    @Slot(list, str)
+    def onUntagged(self, pks: list, tagname: str):
+        """Apply a removal made in the Tagger to the Tags column of every dataset"""
+        for subwindow in self.mdi.subWindowList():
+            model: PandasModel = subwindow.widget().model()
+            model.dataset.unindexTag(pks, tagname)
+            model.refreshTags(pks)
+
+    @Slot(str, list)
+    def onTagRemoved(self, tagname: str, pks: list):
+        self.rebuildTagIndexes()
+
+    @Slot(str, str)
+    def onTagRenamed(self, tagname: str, new_name: str):
+        self.rebuildTagIndexes()
+
+    def rebuildTagIndexes(self):
+        """Rebuild the tag index of every dataset on its next use, the bitmaps are keyed by tag"""
+        for subwindow in self.mdi.subWindowList():
+            model: PandasModel = subwindow.widget().model()
+            model.dataset.invalidateTagIndex()
+            model.refreshAllTags()
+
+    @Slot(str, str, str)
+    def onTagMemberRenamed(self, tagname: str, pk: str, new_pk: str):
+        """Move the tag to the new key in the datasets where the old key had it"""
+        for subwindow in self.mdi.subWindowList():
+            model: PandasModel = subwindow.widget().model()
+            model.dataset.unindexTag([pk], tagname)
+            model.dataset.indexTag([new_pk], tagname)
+            model.refreshTags([pk, new_pk])
+
+    @Slot()
+    def onTagsReset(self):
+        """Join the datasets to the tags of the project read in the background"""
+        for subwindow in self.mdi.subWindowList():
+            model: PandasModel = subwindow.widget().model()
+            model.dataset.setTagStore(self.tag_pane.model().store())
+            model.refreshAllTags()
          
     @Slot()
     def update_window_menu(self):
@@ -916,8 +2126,73 @@ class DataViewer(QtWidgets.QWidget):
             subwindow.showMaximized()
     
     def closeEvent(self, a0): #TODO
-        """Save dataframe to Parquet file upon closing the dataviewer"""
+        """Save modified datasets to their Parquet file upon closing the dataviewer"""
+        self.cancelImport()
+        self._deferred_reimports.clear()
+        self._pool.clear()
+        self._pool.waitForDone()
+
         for subwindow in self.mdi.subWindowList():
             model: PandasModel = subwindow.widget().model()
-            self.save2Parquet(model.dataframe(), model.dataset.parquet)
-        return super().closeEvent(a0)
\ No newline at end of file
+            self.saveEdits(model.dataset)
+        return super().closeEvent(a0)
+
+    def saveEdits(self, dataset: DataSet) -> bool:
+        """Save a dataset, asking before overwriting a parquet that changed on disk"""
+        if self.saveDataset(dataset):
+            self.reimportSources(list(self._deferred_reimports))
+            return True
+
+        if not dataset.changedOnDisk():
+            # Write failed, already logged
+            return False
+
+        answer = QtWidgets.QMessageBox.question(self,
+                                                "Save dataset",
+                                                f"{dataset.parquet.name} changed on disk since {dataset.name} was read.\n"
+                                                "Overwrite it with the rows in memory? The changes on disk will be lost.")
+        if answer != QtWidgets.QMessageBox.StandardButton.Yes:
+            self.sigMessage.emit(f"{dataset.name}: edits not saved, the file changed on disk")
+            return False
+
+        if not self.saveDataset(dataset, overwrite=True):
+            return False
+
+        self.reimportSources(list(self._deferred_reimports))
+        return True
+
+    @classmethod
+    def saveDataset(cls, dataset: DataSet, overwrite: bool = False) -> bool:
+        """Write back an edited dataset to its parquet
+
+        If the parquet changed on disk since the rows were read, nothing is
+        written unless overwrite, which writes the rows in memory over the
+        changes on disk.
+        """
+        if not dataset.isDirty():
+            return True
+
+        if dataset.isPartitioned():
+            logger.warning(f"{dataset.name}: partitioned datasets are read-only, edits are not saved")
+            return False
+
+        if not overwrite and dataset.changedOnDisk():
+            logger.warning(f"{dataset.name}: {dataset.parquet.name} changed on disk, edits are not saved")
+            return False
+
+        ok = cls.save2Parquet(dataset.unfiltered_df, dataset.parquet, dataset.pk_name)
+
+        # Rows were sorted on disk, in-memory positions no longer map to row groups
+        if ok and cls.writeProfile().sort_by_pk and dataset.pk_name != "":
+            dataset.rows_match_file = False
+
+        if ok:
+            dataset.dirty_rows.clear()
+
+            # Own write: the watcher must not reload it
+            try:
+                dataset.layout = rowGroupLayout(dataset.parquet)
+            except OSError as e:
+                logger.error(e)
+
+        return ok
\ No newline at end of file
@@ -1,7 +1,12 @@
+import pandas as pd
 from dataclasses import dataclass
 from qtpy import QtCore, QtWidgets, QtGui, Slot, Signal
 
 
+STRING_OPERATORS = ["contains", "endswith", "startswith"]
+ORDER_OPERATORS = [">", "<", ">=", "<="]
+
+
 @dataclass
 class Filter:
     attr: str
@@ -15,6 +20,60 @@ class Filter:
         return {"attr":self.attr, "oper":self.oper, "value":self.value, "expr":self.expr}
 
 
+def literal(dtype, value: str) -> str:
+    """Write a filter value as a DataFrame.query literal of the column type"""
+    value = value.strip()
+
+    if isinstance(dtype, pd.CategoricalDtype):
+        return literal(dtype.categories.dtype, value)
+
+    if pd.api.types.is_bool_dtype(dtype) and value.lower() in ["true", "false"]:
+        return str(value.lower() == "true")
+
+    if pd.api.types.is_numeric_dtype(dtype):
+        for number in [int, float]:
+            try:
+                return repr(number(value))
+            except ValueError:
+                pass
+        # e.g. another column
+        return value
+
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        try:
+            timestamp = pd.Timestamp(value)
+        except ValueError:
+            return f'"{value}"'
+        # Resolved from the local_dict given to DataFrame.query
+        return f'@pd.Timestamp("{timestamp.isoformat()}")'
+
+    return f'"{value}"'
+
+
+def filterExpression(attr_name: str, dtype, oper: str, value: str) -> str:
+    """Build the DataFrame.query expression of a filter on a column of the given dtype
+
+    String operators work on the text of any column, comparisons cast the
+    value to the column type. Datetime literals need local_dict={"pd": pd}.
+    """
+    attr = f'`{attr_name}`'
+
+    if oper in STRING_OPERATORS:
+        if not (pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)):
+            attr = f'{attr}.astype("str")'
+        return f'{attr}.str.{oper}("{value}", na=False)'
+
+    if oper == "in":
+        items = ", ".join(literal(dtype, x) for x in value.split(','))
+        return f"{attr} {oper} [{items}]"
+
+    # Unordered categories are compared on their values
+    if isinstance(dtype, pd.CategoricalDtype) and oper in ORDER_OPERATORS and not dtype.ordered:
+        attr = f'{attr}.astype("{dtype.categories.dtype}")'
+
+    return f'{attr} {oper} {literal(dtype, value)}'
+
+
 class FilterModel(QtCore.QAbstractListModel):
     sigToggleFilter = Signal(int)
 
@@ -93,6 +152,9 @@ class FilterModel(QtCore.QAbstractListModel):
         return True
     
 class FilterDialog(QtWidgets.QDialog):
+    TAGS_TYPE = "tags" # attribute type of the virtual Tags column
+    TAGS_OPERATOR = "matches"
+
     def __init__(self, attrs: dict = {}, parent = None):
         super().__init__(parent)
         self.setWindowTitle("Create filter expression")
@@ -107,16 +169,15 @@ class FilterDialog(QtWidgets.QDialog):
 
         formlayout.addRow("Attribut", self.attrs_box)
 
-        operators = ["==", "!=", ">", "<", ">=", "<=", "in", "contains", "startswith", "endswith"]
-
         self.operator = QtWidgets.QComboBox()
-        for op in operators:
-            self.operator.addItem(op)
         formlayout.addRow("Operator", self.operator)
 
         self.value = QtWidgets.QLineEdit()
         formlayout.addRow("Value", self.value)
 
+        self.attrs_box.currentIndexChanged.connect(self.updateOperators)
+        self.updateOperators()
+
         buttons = (QtWidgets.QDialogButtonBox.StandardButton.Save | QtWidgets.QDialogButtonBox.StandardButton.Cancel)
 
         self.buttonBox = QtWidgets.QDialogButtonBox(buttons)
@@ -125,6 +186,25 @@ class FilterDialog(QtWidgets.QDialog):
 
         formlayout.addWidget(self.buttonBox)
 
+    def isTagAttr(self) -> bool:
+        return self.attrs_box.currentData(QtCore.Qt.ItemDataRole.UserRole) == self.TAGS_TYPE
+
+    @Slot()
+    def updateOperators(self):
+        """Tags are filtered with an expression over tag names, other attributes with a comparison"""
+        if self.isTagAttr():
+            operators = [self.TAGS_OPERATOR]
+            self.value.setPlaceholderText('"Late & Serious" & ~Reviewed, Late | (A & B)')
+        else:
+            operators = ["==", "!=", ">", "<", ">=", "<=", "in", "contains", "startswith", "endswith"]
+            self.value.setPlaceholderText("")
+
+        current = self.operator.currentText()
+        self.operator.clear()
+        self.operator.addItems(operators)
+        if current in operators:
+            self.operator.setCurrentText(current)
+
     def getFilter(self) -> Filter:
         filter = Filter(self.attrs_box.currentText(),
                         self.operator.currentText(),
@@ -133,25 +213,16 @@ class FilterDialog(QtWidgets.QDialog):
         return filter
     
     def validate(self) -> str:
-        attr = f'`{self.attrs_box.currentText()}`'
-        oper = self.operator.currentText()
         value = self.value.text()
 
-        if self.attrs_box.currentData(QtCore.Qt.ItemDataRole.UserRole) == 'int64':
-            if oper in ["contains", "endswith", "startswith"]:
-                expr = f'{attr}.astype("str").str.{oper}("{value}", na=False)'
-            else:
-                expr = f'{attr} {oper} {value}'
-        else:
-            if oper == "in":
-                value = [x.strip() for x in value.split(',')]
-                expr = f"{attr} {oper} {value}"
-            elif oper in ["contains", "endswith", "startswith"]:
-                expr = f'{attr}.str.{oper}("{value}", na=False)'
-            else:
-                expr = f'{attr} {oper} "{value}"'
-        
-        return expr
+        if self.isTagAttr():
+            # Evaluated on the tag bitmaps, not by DataFrame.query
+            return value.strip()
+
+        return filterExpression(self.attrs_box.currentText(),
+                                self.attrs_box.currentData(QtCore.Qt.ItemDataRole.UserRole),
+                                self.operator.currentText(),
+                                value)
 
 class FilterPane(QtWidgets.QWidget):
     sigFilterChanged = Signal()
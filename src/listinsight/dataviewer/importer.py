@@ -0,0 +1,142 @@
+import logging
+import threading
+from pathlib import Path
+from typing import Callable
+from qtpy import QtCore, Signal
+
+from .storage import ConversionCache, rowGroupLayout
+from .inference import inferTypes
+
+logger = logging.getLogger(__name__)
+
+
+class ImportCancelled(Exception):
+    """Raised inside a job when the user cancelled the import"""
+
+
+class ImportSignals(QtCore.QObject):
+    sigStage = Signal(str, str)             # source, stage description
+    sigDatasetReady = Signal(object)        # DataSet, ready for its view
+    sigFinished = Signal(str, list, bool)   # source, parquets, converted
+    sigFailed = Signal(str, str)            # source, error
+    sigCancelled = Signal(str)              # source
+
+
+class ImportJob(QtCore.QRunnable):
+    """Import one file in a worker thread
+
+    Stages: cache lookup, read, type inference and parquet write.
+    Each finished dataset is handed back to the GUI thread with sigDatasetReady,
+    views are never touched from the worker.
+    """
+    def __init__(self,
+                 filepath: Path,
+                 rootpath: Path,
+                 cache: ConversionCache,
+                 reader: Callable,
+                 writer: Callable,
+                 loaded: set[str] = set(),
+                 streamer: Callable = None,
+                 update_json: bool = True):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.signals = ImportSignals()
+        self._filepath = filepath
+        self._rootpath = rootpath
+        self._cache = cache
+        self._reader = reader
+        self._writer = writer
+        self._loaded = loaded
+        self._streamer = streamer
+        self.update_json = update_json # new datasets are added to project.json
+        self._cancelled = threading.Event()
+
+    @property
+    def source(self) -> str:
+        return self._filepath.as_posix()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def isCancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def stage(self, description: str):
+        """Report the current stage, abort the job if it was cancelled meanwhile"""
+        if self.isCancelled():
+            raise ImportCancelled()
+        self.signals.sigStage.emit(self.source, description)
+
+    def run(self):
+        try:
+            parquets, converted = self.process()
+        except ImportCancelled:
+            self.signals.sigCancelled.emit(self.source)
+        except Exception as e:
+            logger.exception(e)
+            self.signals.sigFailed.emit(self.source, str(e))
+        else:
+            self.signals.sigFinished.emit(self.source, parquets, converted)
+
+    def process(self) -> tuple[list[Path], bool]:
+        parquet_folder = self._rootpath.joinpath("parquets")
+        is_source = self._filepath.parent != parquet_folder
+
+        # Serve unchanged source files straight from their existing parquets
+        self.stage(f"Looking up {self._filepath.name}...")
+        cached_parquets = self._cache.lookup(self._filepath) if is_source else None
+
+        if cached_parquets is not None:
+            datasets = []
+            for parquetfile in cached_parquets:
+                # Unchanged file already opened: nothing to import
+                if parquetfile.stem.upper() in self._loaded:
+                    continue
+
+                self.stage(f"Reading {parquetfile.name}...")
+                layout = rowGroupLayout(parquetfile) # taken before the rows, like readParquetLayout
+                dataset = self._reader(parquetfile)[0]
+                dataset.parquet = parquetfile
+                dataset.layout = layout
+                datasets.append(dataset)
+
+            for dataset in datasets:
+                self.stage(f"Opening {dataset.name}...")
+                self.signals.sigDatasetReady.emit(dataset)
+
+            return cached_parquets, False
+
+        # Large workbooks are converted without loading them in memory
+        if is_source and self._streamer is not None:
+            datasets = self._streamer(self._filepath, parquet_folder, self.stage)
+            if datasets is not None:
+                for dataset in datasets:
+                    self.signals.sigDatasetReady.emit(dataset)
+                return [dataset.parquet for dataset in datasets], True
+
+        self.stage(f"Reading {self._filepath.name}...")
+        datasets = self._reader(self._filepath)
+        if datasets is None:
+            raise ValueError(f"Cannot read {self._filepath.name}")
+
+        parquets = []
+        for dataset in datasets:
+            parquetfile = parquet_folder.joinpath(f"{dataset.name}.parquet")
+
+            if is_source:
+                # Parse dates and narrow types once, later reads get native types
+                self.stage(f"Inferring types of {dataset.name}...")
+                dataset.setData(inferTypes(dataset.unfiltered_df))
+
+                self.stage(f"Writing {parquetfile.name}...")
+                if not self._writer(dataset.dataframe, parquetfile):
+                    raise IOError(f"Cannot write {parquetfile.name}")
+
+            parquets.append(parquetfile)
+            dataset.parquet = parquetfile
+            # Saving edits checks the file is still the one the rows came from
+            dataset.layout = rowGroupLayout(parquetfile)
+
+            self.signals.sigDatasetReady.emit(dataset)
+
+        return parquets, is_source
@@ -0,0 +1,83 @@
+import logging
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+DATE_FORMATS = [
+    "%Y-%m-%d",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%d/%m/%Y",
+    "%d/%m/%Y %H:%M:%S",
+    "%m/%d/%Y",
+    "%d.%m.%Y",
+    "%d-%b-%Y",
+    "%d-%b-%y",
+    "%Y%m%d",
+]
+
+INFERRED_TYPES = "inferred_types" # key of the inference result in DataFrame.attrs
+
+
+def detectDateFormat(values: pd.Series, sample_size: int = 1000) -> str | None:
+    """Return the first format parsing every sampled value, None if the column is not a date"""
+    sample = values.dropna().drop_duplicates()
+    if len(sample) == 0 or not all(isinstance(x, str) for x in sample.head(sample_size)):
+        return None
+
+    sample = sample.head(sample_size).str.strip()
+    for date_format in DATE_FORMATS:
+        parsed = pd.to_datetime(sample, format=date_format, errors="coerce")
+        if parsed.notna().all():
+            return date_format
+
+    return None
+
+
+def inferTypes(df: pd.DataFrame, category_ratio: float = 0.5) -> pd.DataFrame:
+    """Convert columns read as text or float to their native type
+
+    - text dates are parsed with their detected format
+    - low-cardinality text becomes categorical
+    - floats holding only integers and missing values become nullable integers
+
+    The detected types are recorded in df.attrs[INFERRED_TYPES] and written
+    to the parquet metadata.
+    """
+    inferred = {}
+    df = df.copy()
+
+    for column in df.columns:
+        series = df[column]
+
+        if series.dtype == object:
+            date_format = detectDateFormat(series)
+            if date_format is not None:
+                parsed = pd.to_datetime(series.str.strip(), format=date_format, errors="coerce")
+                # Keep the text if values outside the sample do not parse
+                if parsed.isna().sum() == series.isna().sum():
+                    df[column] = parsed
+                    inferred[str(column)] = f"datetime:{date_format}"
+                    continue
+
+            non_null = series.notna().sum()
+            try:
+                distinct = series.nunique()
+            except TypeError:
+                # Unhashable values
+                continue
+
+            if non_null > 1 and distinct < category_ratio * non_null and series.dropna().map(type).eq(str).all():
+                df[column] = series.astype("category")
+                inferred[str(column)] = "category"
+
+        elif pd.api.types.is_float_dtype(series) and series.isna().any():
+            values = series.dropna()
+            if len(values) > 0 and (values == values.round()).all() and values.abs().max() < 2**53:
+                df[column] = series.astype("Int64")
+                inferred[str(column)] = "Int64"
+
+    df.attrs[INFERRED_TYPES] = inferred
+    return df
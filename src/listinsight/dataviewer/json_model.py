@@ -11,9 +11,11 @@ class TreeItem:
         self._value = ""
         self._value_type = None
         self._children = []
+        self._row = 0 # position in the parent, kept up to date by the parent
 
     def appendChild(self, item: "TreeItem"):
         """Add item as a child"""
+        item._row = len(self._children)
         self._children.append(item)
 
     def child(self, row: int) -> "TreeItem":
@@ -30,7 +32,7 @@ class TreeItem:
 
     def row(self) -> int:
         """Return the row where the current item occupies in the parent"""
-        return self._parent._children.index(self) if self._parent else 0
+        return self._row if self._parent else 0
 
     @property
     def key(self) -> str:
@@ -202,12 +202,12 @@ class ShortListModel(QtCore.QAbstractItemModel):
         return True
     
     def toJson(self) -> dict:
-        """Return a JSON-compatible dictionary"""
+        """Return a JSON-compatible dictionary, sharing no mutable state with the items"""
         document = {}
         item: ShortListItem
         for item in self._items:
             document[item.title] = {"finding":item.finding,
-                                    "tags":item.tags,
+                                    "tags":list(item.tags),
                                     "body":item.body}
         return document
 
@@ -451,14 +451,14 @@ class ShortLister(QtWidgets.QWidget):
     def newShortlistItem(self):
         self.addShortlistItem()
 
-    @Slot(str, str)
-    def addShortlistItem(self, title: str = "", tags: str = ""):
+    @Slot(str, list)
+    def addShortlistItem(self, title: str = "", tags: list = None):
         item_index = self.model().getItemByTitle(title)
         if item_index is not None:
             self.editShortlistItem(self._proxymodel.mapFromSource(item_index))
             return
 
-        item = ShortListItem("", title, [x.strip() for x in tags.split(',')])
+        item = ShortListItem("", title, [] if tags is None else list(tags))
         self.editor = ShortListEditor(item, self)
 
         if self.editor.exec():
@@ -0,0 +1,301 @@
+import time
+import logging
+import pandas as pd
+import pyarrow as pa
+from pathlib import Path
+from functools import partial
+from qtpy import QtWidgets, QtCore, QtGui, Slot, Signal
+
+from utilities.worker import Worker
+from .dataviewer import DataSet, PandasModel
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+logger = logging.getLogger(__name__)
+
+
+FETCH_SIZE = 2000
+
+
+def readRows(reader: pa.RecordBatchReader, count: int) -> tuple[pd.DataFrame, bool]:
+    """Read at least count rows from a result stream, return them and whether the stream is exhausted"""
+    batches = []
+    rows = 0
+    exhausted = False
+
+    while rows < count:
+        try:
+            batch = reader.read_next_batch()
+        except StopIteration:
+            exhausted = True
+            break
+        batches.append(batch)
+        rows += batch.num_rows
+
+    table = pa.Table.from_batches(batches, schema=reader.schema)
+    return table.to_pandas(), exhausted
+
+
+def executeQuery(cursor, sql: str) -> tuple[pa.RecordBatchReader | None, pd.DataFrame, bool]:
+    """Run a query and read its first rows, the rest stays in the engine"""
+    cursor.execute(sql)
+
+    # Statements without result set (CREATE, SET...)
+    if cursor.description is None:
+        return None, pd.DataFrame(), True
+
+    reader = cursor.fetch_record_batch(FETCH_SIZE)
+    df, exhausted = readRows(reader, FETCH_SIZE)
+    return reader, df, exhausted
+
+
+class QueryModel(PandasModel):
+    """Result of a query, fetched from the engine as the view scrolls
+
+    Each fetch reads as many rows as already shown, so scrolling to the end
+    of a large result costs a linear number of copies. Batches are read in
+    the thread pool, the rows are inserted when they arrive.
+    """
+    _closing_workers: set[Worker] = set() # fetches still running for closed models
+
+    def __init__(self, reader: pa.RecordBatchReader | None, df: pd.DataFrame, exhausted: bool, cursor=None, parent=None):
+        super().__init__(DataSet(df, "QUERY"), parent)
+        self._reader = reader
+        self._exhausted = exhausted or reader is None
+        self._cursor = cursor # keeps the result set open
+        self._fetch_worker: Worker = None
+
+    def columnCount(self, index) -> int:
+        if index == QtCore.QModelIndex():
+            return len(self.dataset.headers())
+
+        return 0
+
+    def canFetchMore(self, parent: QtCore.QModelIndex) -> bool:
+        return parent == QtCore.QModelIndex() and not self._exhausted
+
+    def fetchMore(self, parent: QtCore.QModelIndex):
+        if not self.canFetchMore(parent) or self._fetch_worker is not None:
+            return
+
+        self._fetch_worker = Worker(readRows, self._reader, max(FETCH_SIZE, len(self.dataset.dataframe)))
+        self._fetch_worker.signals.sigResult.connect(self.onRowsRead)
+        self._fetch_worker.signals.sigFailed.connect(self.onFetchFailed)
+        self._fetch_worker.signals.sigFinished.connect(self.onFetchFinished)
+        QtCore.QThreadPool.globalInstance().start(self._fetch_worker)
+
+    def isFetching(self) -> bool:
+        return self._fetch_worker is not None
+
+    @Slot(object)
+    def onRowsRead(self, result: tuple[pd.DataFrame, bool]):
+        if self._reader is None:
+            # Closed meanwhile
+            return
+
+        df, self._exhausted = result
+        if len(df) == 0:
+            return
+
+        start = len(self.dataset.dataframe)
+        self.beginInsertRows(QtCore.QModelIndex(), start, start + len(df) - 1)
+        self.dataset.setData(pd.concat([self.dataset.unfiltered_df, df], ignore_index=True))
+        self.endInsertRows()
+
+    @Slot(str)
+    def onFetchFailed(self, err: str):
+        self._exhausted = True
+        logger.error(err)
+
+    @Slot()
+    def onFetchFinished(self):
+        self._fetch_worker = None
+
+    def isExhausted(self) -> bool:
+        return self._exhausted
+
+    def close(self):
+        self._exhausted = True
+        self._reader = None
+        cursor, self._cursor = self._cursor, None
+        if cursor is None:
+            return
+
+        worker, self._fetch_worker = self._fetch_worker, None
+        if worker is None:
+            cursor.close()
+            return
+
+        # The batch being read still needs the result set
+        self._closing_workers.add(worker)
+        worker.signals.sigFinished.connect(cursor.close)
+        worker.signals.sigFinished.connect(partial(self._closing_workers.discard, worker))
+
+
+class SqlConsole(QtWidgets.QWidget):
+    """Query the project parquets in SQL with an embedded engine (duckdb)
+
+    Each dataset is exposed as a view named after the dataset. Queries run in
+    the engine, only the rows shown are converted to pandas.
+    """
+    sigMessage = Signal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._connection = None
+        self._cursor = None
+        self._worker: Worker = None
+        self._started = 0.0
+        self._datasets: dict[str, Path] = {} # {view name : parquet}
+
+        self.createActions()
+
+        self.toolbar = QtWidgets.QToolBar(self)
+        self.toolbar.setToolButtonStyle(QtCore.Qt.ToolButtonStyle.ToolButtonIconOnly)
+        self.toolbar.addAction(self.action_run)
+        self.toolbar.addAction(self.action_stop)
+
+        self.tables = QtWidgets.QListWidget()
+        self.tables.itemDoubleClicked.connect(self.insertTableName)
+
+        self.editor = QtWidgets.QPlainTextEdit()
+        self.editor.setFont(QtGui.QFont("Courier New", 10))
+        self.editor.setPlaceholderText('SELECT * FROM "DATASET" LIMIT 100')
+
+        self.result_view = QtWidgets.QTableView()
+
+        self.status_label = QtWidgets.QLabel()
+
+        right_splitter = QtWidgets.QSplitter(QtCore.Qt.Orientation.Vertical)
+        right_splitter.addWidget(self.editor)
+        right_splitter.addWidget(self.result_view)
+        right_splitter.setStretchFactor(1, 3)
+
+        splitter = QtWidgets.QSplitter()
+        splitter.addWidget(self.tables)
+        splitter.addWidget(right_splitter)
+        splitter.setStretchFactor(1, 4)
+
+        vbox = QtWidgets.QVBoxLayout(self)
+        vbox.addWidget(self.toolbar)
+        vbox.addWidget(splitter)
+        vbox.addWidget(self.status_label)
+        self.setLayout(vbox)
+
+        if duckdb is None:
+            self.editor.setPlaceholderText("Install duckdb to run SQL queries over the project datasets")
+            self.editor.setReadOnly(True)
+            self.action_run.setEnabled(False)
+
+    def createActions(self):
+        self.action_run = QtGui.QAction(QtGui.QIcon(":share-forward-2-line"), "Run (Ctrl+Enter)", self, triggered=self.runQuery)
+        self.action_run.setShortcut(QtGui.QKeySequence("Ctrl+Return"))
+        self.action_run.setShortcutContext(QtCore.Qt.ShortcutContext.WidgetWithChildrenShortcut)
+
+        self.action_stop = QtGui.QAction(QtGui.QIcon(":close-line"), "Stop", self, triggered=self.stopQuery)
+        self.action_stop.setEnabled(False)
+
+    def setProject(self, project: dict):
+        """Expose the datasets of the project as views"""
+        self._datasets.clear()
+        for dataset in project.get("datasets", []):
+            metadata: dict = dataset.get("metadata", {})
+            parquet = Path(metadata.get("parquet", ""))
+            if metadata.get("dataset_name") and parquet.exists():
+                self._datasets[metadata.get("dataset_name")] = parquet
+
+        self.tables.clear()
+        self.tables.addItems(sorted(self._datasets.keys()))
+
+        if self._connection is not None:
+            self.createViews()
+
+    def connection(self):
+        if self._connection is None:
+            self._connection = duckdb.connect()
+            self.createViews()
+        return self._connection
+
+    def createViews(self):
+        for name, parquet in self._datasets.items():
+            if parquet.is_dir():
+                source = f"read_parquet('{self.quote(parquet.as_posix())}/**/*.parquet', hive_partitioning = true)"
+            else:
+                source = f"read_parquet('{self.quote(parquet.as_posix())}')"
+
+            identifier = name.replace('"', '""')
+            try:
+                self._connection.execute(f'CREATE OR REPLACE VIEW "{identifier}" AS SELECT * FROM {source}')
+            except duckdb.Error as e:
+                logger.error(f"Cannot expose {name}: {e}")
+
+    @classmethod
+    def quote(cls, s: str) -> str:
+        return s.replace("'", "''")
+
+    @Slot(QtWidgets.QListWidgetItem)
+    def insertTableName(self, item: QtWidgets.QListWidgetItem):
+        self.editor.insertPlainText(f'"{item.text()}"')
+        self.editor.setFocus()
+
+    @Slot()
+    def runQuery(self):
+        if duckdb is None or self._worker is not None:
+            return
+
+        cursor = self.editor.textCursor()
+        sql = cursor.selectedText().replace("\u2029", "\n") if cursor.hasSelection() else self.editor.toPlainText()
+        if sql.strip() == "":
+            return
+
+        self._cursor = self.connection().cursor()
+        self._started = time.perf_counter()
+
+        self._worker = Worker(executeQuery, self._cursor, sql)
+        self._worker.signals.sigResult.connect(partial(self.onQueryResult, self._cursor))
+        self._worker.signals.sigFailed.connect(self.onQueryFailed)
+        self._worker.signals.sigFinished.connect(self.onQueryFinished)
+
+        self.action_run.setEnabled(False)
+        self.action_stop.setEnabled(True)
+        self.setStatus("Running...")
+        QtCore.QThreadPool.globalInstance().start(self._worker)
+
+    @Slot()
+    def stopQuery(self):
+        if self._cursor is not None:
+            self._cursor.interrupt()
+
+    def onQueryResult(self, cursor, result: tuple):
+        reader, df, exhausted = result
+        elapsed = time.perf_counter() - self._started
+
+        old_model = self.result_view.model()
+        model = QueryModel(reader, df, exhausted, cursor, parent=self)
+        self.result_view.setModel(model)
+        self.result_view.resizeColumnsToContents()
+        if isinstance(old_model, QueryModel):
+            old_model.close()
+            old_model.deleteLater()
+
+        more = "" if model.isExhausted() else "+ (more on scroll)"
+        self.setStatus(f"{len(df)}{more} rows in {elapsed:.2f} s")
+
+    @Slot(str)
+    def onQueryFailed(self, err: str):
+        self._cursor.close()
+        self.setStatus(err)
+
+    @Slot()
+    def onQueryFinished(self):
+        self._worker = None
+        self._cursor = None
+        self.action_run.setEnabled(True)
+        self.action_stop.setEnabled(False)
+
+    def setStatus(self, msg: str):
+        self.status_label.setText(msg)
+        self.sigMessage.emit(msg)
@@ -0,0 +1,461 @@
+import os
+import json
+import hashlib
+import logging
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.dataset as pads
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pathlib import Path
+from dataclasses import dataclass
+
+from utilities.utils import readJson, writeJson
+from .inference import INFERRED_TYPES
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(filepath: Path, sample_size: int = 1 << 20) -> dict:
+    """Return a cheap content fingerprint of a file
+
+    The hash only covers the first and last `sample_size` bytes so that large
+    workbooks can be fingerprinted without reading them entirely.
+    """
+    stat = filepath.stat()
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(stat.st_size).encode())
+
+    with open(filepath, mode='rb') as file:
+        digest.update(file.read(sample_size))
+        if stat.st_size > sample_size:
+            file.seek(max(sample_size, stat.st_size - sample_size))
+            digest.update(file.read(sample_size))
+
+    return {"size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "hash": digest.hexdigest()}
+
+
+def contentHash(filepath: Path, chunk_size: int = 1 << 20) -> str:
+    """Return the hash of the whole content of a file"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filepath, mode='rb') as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ConversionCache:
+    """Remember which parquets a source file (*.csv, *.xlsx) was converted into
+
+    Entries are keyed by the source fingerprint, so an unchanged file is
+    recognized even if it was moved or renamed. The fingerprint only samples
+    the file: when the modification time differs from the stored one, the
+    whole content is hashed and compared before the entry is trusted.
+    """
+    def __init__(self, cache_file: Path):
+        self._cache_file = cache_file
+        self._entries: dict = {}
+
+        if self._cache_file.exists():
+            data, err = readJson(self._cache_file.as_posix())
+            if err != "":
+                logger.warning(err)
+            self._entries = data
+
+    @classmethod
+    def key(cls, fprint: dict) -> str:
+        return f"{fprint.get('size')}:{fprint.get('hash')}"
+
+    def lookup(self, source: Path) -> list[Path] | None:
+        """Return the parquets of an unchanged source file, None on cache miss"""
+        try:
+            fprint = fingerprint(source)
+        except OSError as e:
+            logger.error(e)
+            return None
+
+        entry: dict = self._entries.get(self.key(fprint))
+        if entry is None:
+            return None
+
+        parquets = [Path(p) for p in entry.get("parquets", [])]
+        if len(parquets) == 0 or not all(p.exists() for p in parquets):
+            return None
+
+        if entry.get("mtime") != fprint.get("mtime"):
+            # Touched or edited in the part not sampled by the fingerprint
+            try:
+                content = contentHash(source)
+            except OSError as e:
+                logger.error(e)
+                return None
+
+            if content != entry.get("content"):
+                return None
+
+        return parquets
+
+    def store(self, source: Path, parquets: list[Path]):
+        try:
+            fprint = fingerprint(source)
+            content = contentHash(source)
+        except OSError as e:
+            logger.error(e)
+            return
+
+        self._entries[self.key(fprint)] = {"source": source.as_posix(),
+                                           "mtime": fprint.get("mtime"),
+                                           "content": content,
+                                           "parquets": [p.as_posix() for p in parquets]}
+        self.save()
+
+    def sourceOf(self, parquet: Path) -> Path | None:
+        """Return the source file a parquet was converted from"""
+        for entry in self._entries.values():
+            if parquet.as_posix() in entry.get("parquets", []):
+                return Path(entry.get("source"))
+        return None
+
+    def save(self):
+        ok, err = writeJson(self._cache_file.as_posix(), self._entries)
+        if not ok:
+            logger.error(err)
+
+
+@dataclass
+class WriteProfile:
+    """Parquet layout options used by save2Parquet"""
+    row_group_size: int = 64 * 1024
+    compression: str = "zstd"
+    compression_level: int | None = 3
+    dictionary_ratio: float = 0.5   # dictionary-encode columns with fewer distinct values than ratio * rows
+    write_page_index: bool = True
+    sort_by_pk: bool = False
+
+
+WRITE_PROFILES = {
+    "default": WriteProfile(),
+    # Cheap to write, e.g. for files rewritten on each close
+    "fast": WriteProfile(compression="snappy", compression_level=None, dictionary_ratio=0.1, write_page_index=False),
+    # Smallest files, slower to write
+    "compact": WriteProfile(row_group_size=128 * 1024, compression_level=9),
+    # Small row groups sorted by primary key, so lookups and filters skip most row groups
+    "lookup": WriteProfile(row_group_size=16 * 1024, sort_by_pk=True),
+}
+
+
+def dictionaryColumns(table: pa.Table, ratio: float) -> list[str]:
+    """Return the columns with a low cardinality relative to the number of rows"""
+    if table.num_rows == 0:
+        return []
+
+    columns = []
+    for name, column in zip(table.column_names, table.columns):
+        if pa.types.is_dictionary(column.type):
+            columns.append(name)
+            continue
+
+        try:
+            distinct = pc.count_distinct(column, mode="all").as_py()
+        except pa.ArrowNotImplementedError:
+            continue
+
+        if distinct < ratio * table.num_rows:
+            columns.append(name)
+
+    return columns
+
+
+INFERRED_TYPES_KEY = b"listinsight.inferred_types"
+
+
+def replaceFile(tmpfile: Path, filepath: Path):
+    """Atomically move a fully written temporary file over its target"""
+    os.replace(tmpfile, filepath)
+
+
+def tempPath(filepath: Path) -> Path:
+    return filepath.with_name(f".{filepath.name}.tmp")
+
+
+def writeParquet(df: pd.DataFrame, filepath: Path, profile: WriteProfile, pk_name: str = ""):
+    """Write a dataframe to parquet with the layout of the given profile
+
+    The file is written next to its target and renamed over it, so readers
+    never see a partially written parquet.
+    """
+    table = pa.Table.from_pandas(df)
+
+    # Keep the column types detected at import with the file
+    if INFERRED_TYPES in df.attrs:
+        metadata = dict(table.schema.metadata or {})
+        metadata[INFERRED_TYPES_KEY] = json.dumps(df.attrs[INFERRED_TYPES]).encode()
+        table = table.replace_schema_metadata(metadata)
+
+    if profile.sort_by_pk and pk_name in table.column_names:
+        table = table.sort_by(pk_name)
+
+    tmpfile = tempPath(filepath)
+    try:
+        pq.write_table(table,
+                       tmpfile.as_posix(),
+                       row_group_size=profile.row_group_size,
+                       compression=profile.compression,
+                       compression_level=profile.compression_level,
+                       use_dictionary=dictionaryColumns(table, profile.dictionary_ratio),
+                       write_page_index=profile.write_page_index,
+                       write_statistics=True)
+        replaceFile(tmpfile, filepath)
+    finally:
+        tmpfile.unlink(missing_ok=True)
+
+
+def rowGroupOffsets(metadata: pq.FileMetaData) -> list[int]:
+    """Return the first row of each row group, followed by the number of rows"""
+    offsets = [0]
+    for i in range(metadata.num_row_groups):
+        offsets.append(offsets[-1] + metadata.row_group(i).num_rows)
+    return offsets
+
+
+FINGERPRINT_KEY = b"listinsight.fingerprint"
+
+
+def footerFingerprint(parquet: Path) -> dict:
+    """Return the size, modification time and footer hash of a parquet
+
+    Only the footer is read: it holds the offsets, sizes and statistics of
+    every column chunk, so a rewrite changes it.
+    """
+    stat = parquet.stat()
+    digest = hashlib.blake2b(digest_size=16)
+
+    with open(parquet, mode='rb') as file:
+        # Footer: <metadata> <4-byte metadata length> PAR1
+        file.seek(max(stat.st_size - 8, 0))
+        tail = file.read(8)
+        footer_size = int.from_bytes(tail[:4], "little") + 8 if len(tail) == 8 else len(tail)
+        file.seek(max(stat.st_size - footer_size, 0))
+        digest.update(file.read(footer_size))
+
+    return {"size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "footer": digest.hexdigest()}
+
+
+def ipcCachePath(parquet: Path) -> Path:
+    return parquet.with_suffix(".arrow")
+
+
+def readIpcCache(parquet: Path, fprint: dict) -> pa.Table | None:
+    """Memory-map the Arrow IPC cache of a parquet, None if missing or stale"""
+    cache_file = ipcCachePath(parquet)
+    if not cache_file.exists():
+        return None
+
+    try:
+        reader = ipc.open_file(pa.memory_map(cache_file.as_posix(), 'r'))
+        metadata = reader.schema.metadata or {}
+        if json.loads(metadata.get(FINGERPRINT_KEY, b"{}")) != fprint:
+            return None
+        return reader.read_all()
+    except (OSError, pa.ArrowInvalid, ValueError) as e:
+        logger.warning(f"Ignoring IPC cache {cache_file.name}: {e}")
+        return None
+
+
+def writeIpcCache(parquet: Path, table: pa.Table, fprint: dict):
+    """Write an uncompressed Arrow IPC copy of a parquet, tagged with its fingerprint"""
+    cache_file = ipcCachePath(parquet)
+    metadata = dict(table.schema.metadata or {})
+    metadata[FINGERPRINT_KEY] = json.dumps(fprint).encode()
+    table = table.replace_schema_metadata(metadata)
+
+    tmpfile = tempPath(cache_file)
+    try:
+        with ipc.new_file(tmpfile.as_posix(), table.schema) as writer:
+            writer.write_table(table)
+        replaceFile(tmpfile, cache_file)
+    except OSError as e:
+        logger.warning(f"Cannot write IPC cache {cache_file.name}: {e}")
+    finally:
+        tmpfile.unlink(missing_ok=True)
+
+
+def readParquet(filepath: Path, ipc_cache: bool = False, partition_filter: pc.Expression = None) -> pd.DataFrame:
+    """Read a parquet, or a directory of hive-partitioned parquets, into pandas
+
+    For a directory, partition_filter prunes the files that cannot match.
+    With ipc_cache, an uncompressed Arrow IPC copy (<NAME>.arrow) is kept next
+    to the parquet and memory-mapped on the next reads, which then cost page
+    faults instead of decoding. The copy is rebuilt whenever the size,
+    modification time or footer of the parquet changes.
+    """
+    if filepath.is_dir():
+        return openPartitioned(filepath).to_table(filter=partition_filter).to_pandas()
+
+    if not ipc_cache:
+        return pd.read_parquet(filepath)
+
+    fprint = footerFingerprint(filepath)
+    table = readIpcCache(filepath, fprint)
+
+    if table is None:
+        table = pq.read_table(filepath)
+        writeIpcCache(filepath, table, fprint)
+
+    return table.to_pandas()
+
+
+def openPartitioned(directory: Path) -> pads.Dataset:
+    """Open a directory of parquets partitioned as key=value subfolders (e.g. year=2023/)"""
+    return pads.dataset(directory.as_posix(), format="parquet", partitioning="hive")
+
+
+def readMatchingRows(filepath: Path, column: str, value: str) -> pd.DataFrame:
+    """Read the rows where column equals value
+
+    The condition is pushed down to the reader: row groups (and partitions)
+    whose statistics exclude the value are not decoded.
+    """
+    dataset = pads.dataset(filepath.as_posix(), format="parquet", partitioning="hive" if filepath.is_dir() else None)
+
+    try:
+        scalar = pa.scalar(str(value).strip()).cast(dataset.schema.field(column).type)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, KeyError):
+        return dataset.schema.empty_table().to_pandas()
+
+    return dataset.to_table(filter=pc.field(column) == scalar).to_pandas()
+
+
+def readColumn(filepath: Path, column: str) -> pd.Index:
+    """Read a single column of a parquet, or of a directory of hive-partitioned parquets"""
+    dataset = pads.dataset(filepath.as_posix(), format="parquet", partitioning="hive" if filepath.is_dir() else None)
+    return pd.Index(dataset.to_table(columns=[column]).column(column).to_pandas())
+
+
+PARTITION_OPERATORS = ["==", "!=", ">", "<", ">=", "<=", "in"]
+
+
+def partitionExpression(filters: list, partition_schema: pa.Schema) -> tuple[pc.Expression | None, list]:
+    """Translate the enabled filters on partition columns into a pyarrow expression
+
+    Returns the expression, None if no filter applies, and the filters it covers.
+    """
+    expression = None
+    covered = []
+
+    for filter in filters:
+        if not filter.enabled or filter.oper not in PARTITION_OPERATORS:
+            continue
+
+        if filter.attr not in partition_schema.names:
+            continue
+
+        field_type = partition_schema.field(filter.attr).type
+        try:
+            if filter.oper == "in":
+                items = str(filter.value).strip("[]() ").split(',')
+                values = pa.array([x.strip().strip('"\'') for x in items]).cast(field_type)
+                condition = pc.field(filter.attr).isin(values)
+            else:
+                value = pa.scalar(str(filter.value).strip().strip('"\'')).cast(field_type)
+                field = pc.field(filter.attr)
+                condition = {"==": field == value,
+                             "!=": field != value,
+                             ">": field > value,
+                             "<": field < value,
+                             ">=": field >= value,
+                             "<=": field <= value}[filter.oper]
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            logger.warning(f"Filter not applicable to partition {filter.attr}: {e}")
+            continue
+
+        expression = condition if expression is None else expression & condition
+        covered.append(filter)
+
+    return expression, covered
+
+
+@dataclass
+class RowGroupLayout:
+    """Row boundaries and content digests of the row groups of a parquet"""
+    offsets: list[int]
+    digests: list[str]
+
+
+def rowGroupLayout(filepath: Path) -> RowGroupLayout:
+    """Digest the footer entries of each row group, so changed row groups are found without reading them
+
+    Only the parquet footer is read: each digest covers the row count and, for
+    every column chunk, its sizes and statistics. File offsets are left out, so
+    a row group that only moved because an earlier one changed size keeps its
+    digest.
+    """
+    metadata = pq.read_metadata(filepath)
+    digests = []
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{row_group.num_rows}:{row_group.total_byte_size}".encode())
+        for j in range(row_group.num_columns):
+            column = row_group.column(j)
+            digest.update(f"{column.path_in_schema}:{column.encodings}:{column.has_dictionary_page}:"
+                          f"{column.total_compressed_size}:{column.total_uncompressed_size}".encode())
+            if column.is_stats_set:
+                digest.update(repr(column.statistics.to_dict()).encode())
+        digests.append(digest.hexdigest())
+
+    return RowGroupLayout(rowGroupOffsets(metadata), digests)
+
+
+def readParquetLayout(filepath: Path, ipc_cache: bool = False, partition_filter: pc.Expression = None) -> tuple[pd.DataFrame, RowGroupLayout | None]:
+    """Read a parquet with its row group layout
+
+    The layout is taken before the rows, so a change in between shows up as a
+    changed row group on the next reload rather than being missed.
+    """
+    layout = None if filepath.is_dir() else rowGroupLayout(filepath)
+    return readParquet(filepath, ipc_cache, partition_filter), layout
+
+
+@dataclass
+class RowGroupReload:
+    """Result of reloadRowGroups: either the changed row groups or, when the layout moved, all rows"""
+    layout: RowGroupLayout
+    frames: dict[int, pd.DataFrame]
+    full: pd.DataFrame | None = None
+
+
+def reloadRowGroups(filepath: Path, layout: RowGroupLayout | None, in_file_order: bool = True) -> RowGroupReload:
+    """Decode only the row groups that changed since layout was taken
+
+    Row groups keeping their position and row count are compared by digest,
+    rows past the previous end are new, whether they were appended to the last
+    row group or to new ones. If earlier boundaries moved, rows were removed,
+    or the rows in memory are not in file order, the whole file is read.
+    """
+    new_layout = rowGroupLayout(filepath)
+
+    if layout is not None and new_layout.digests == layout.digests:
+        return RowGroupReload(new_layout, {})
+
+    if (layout is None or not in_file_order or new_layout.offsets[-1] < layout.offsets[-1]
+            or new_layout.offsets[:len(layout.offsets) - 1] != layout.offsets[:-1]):
+        return RowGroupReload(new_layout, {}, pd.read_parquet(filepath))
+
+    changed = [i for i, digest in enumerate(new_layout.digests)
+               if i >= len(layout.digests) or digest != layout.digests[i]]
+
+    frames = {}
+    parquet_file = pq.ParquetFile(filepath)
+    try:
+        for i in changed:
+            frames[i] = parquet_file.read_row_group(i).to_pandas()
+    finally:
+        parquet_file.close()
+
+    return RowGroupReload(new_layout, frames)
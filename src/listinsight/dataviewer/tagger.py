@@ -1,7 +1,14 @@
 import logging
+import pandas as pd
+from pathlib import Path
 from qtpy import QtCore, QtWidgets, Signal, Slot
 from typing import Any
 from utilities import config as mconf
+from utilities.worker import Worker
+
+from .tagstore import TagStore
+from .tagjournal import TagJournal, writeSnapshot, applyOperation
+from .tagstats import TagCooccurrence
 
 logger = logging.getLogger(__name__)
 
@@ -14,11 +21,19 @@ class TreeItem:
         self._value = ""
         self._value_type = None
         self._children = []
+        self._row = 0 # position in the parent, kept up to date by the parent
 
     def appendChild(self, item: "TreeItem"):
         """Add item as a child"""
+        item._row = len(self._children)
         self._children.append(item)
 
+    def removeChildren(self, position: int, count: int):
+        """Remove count children from position and renumber the following ones"""
+        del self._children[position:position + count]
+        for row in range(position, len(self._children)):
+            self._children[row]._row = row
+
     def child(self, row: int) -> "TreeItem":
         """Return the child of the current item from the given row"""
         return self._children[row]
@@ -33,7 +48,7 @@ class TreeItem:
 
     def row(self) -> int:
         """Return the row where the current item occupies in the parent"""
-        return self._parent._children.index(self) if self._parent else 0
+        return self._row if self._parent else 0
     
     @property
     def value(self) -> str:
@@ -55,66 +70,102 @@ class TreeItem:
         """Set the python type of the item's value."""
         self._value_type = value
 
-    @classmethod
-    def load(
-        cls, value: list | dict, parent: "TreeItem" = None, sort=True) -> "TreeItem":
-
-        rootItem = TreeItem(parent)
 
-        if isinstance(value, dict):
-            items = sorted(value.items()) if sort else value.items()
+class TagItem(TreeItem):
+    """Top level item of a tag, its primary keys are not items
 
-            for key, value in items:
-                child = cls.load(value, rootItem)
-                child.value = key
-                child.value_type = type(value)
-                rootItem.appendChild(child)
+    pks is the array of the tag members in display order, copied from the
+    store the first time the tag is expanded. Only the first fetched ones
+    are rows of the model.
+    """
 
-        elif isinstance(value, list):
-            for index, value in enumerate(value):
-                child = cls.load(value, rootItem)
-                child.value_type = type(value)
-                rootItem.appendChild(child)
-
-        else:
-            rootItem.value = value
-            rootItem.value_type = type(value)
-
-        return rootItem
+    def __init__(self, parent: TreeItem = None):
+        super().__init__(parent)
+        self.value_type = list
+        self.pks: list[str] | None = None
+        self.fetched = 0
 
 
 class TagModel(QtCore.QAbstractItemModel):
-    """ An editable model of Json data """
+    """Tree view over the tag store: tags at the top level, their primary keys below
+
+    Primary keys are fetched by blocks of FETCH_SIZE when a tag is expanded
+    or scrolled. Their indexes point to the TagItem of the tag while tag
+    indexes point to the root item, so no item is allocated per key.
+    """
+    FETCH_SIZE = 1000
+
+    sigTagged = Signal(list, str)            # pks, tag
+    sigUntagged = Signal(list, str)          # pks, tag
+    sigTagRemoved = Signal(str, list)        # tag, former pks
+    sigTagRenamed = Signal(str, str)         # tag, new name
+    sigMemberRenamed = Signal(str, str, str) # tag, pk, new pk
+    sigTagKeySet = Signal(str, str)          # tag, key column
   
     def __init__(self, parent: QtCore.QObject = None):
         super().__init__(parent)
+        self._store = TagStore()
         self._rootItem = TreeItem()
+        self._tag_items: dict[str, TagItem] = {}
         self._headers = ["Name"]
 
+    def store(self) -> TagStore:
+        return self._store
+
     def clear(self):
         """ Clear data from the model """
         self.load({})
 
     def load(self, document: dict):
-        """Load model from a nested dictionary returned by json.loads()
+        """Load model from a {tag : [pk, ...]} dictionary returned by json.loads()
 
         Arguments:
             document (dict): JSON-compatible dictionary
         """
 
         assert isinstance(
-            document, (dict, list, tuple)
-        ), "`document` must be of dict, list or tuple, " f"not {type(document)}"
+            document, dict
+        ), "`document` must be of dict, " f"not {type(document)}"
 
         self.beginResetModel()
 
-        self._rootItem = TreeItem.load(document)
-        self._rootItem.value_type = type(document)
+        self._store.load(document)
+        self.buildTree()
 
         self.endResetModel()
 
         return True
 
+    def loadStore(self, store: TagStore):
+        """Show a store loaded in the background"""
+        self.beginResetModel()
+        self._store = store
+        self.buildTree()
+        self.endResetModel()
+
+    def buildTree(self):
+        self._rootItem = TreeItem()
+        self._rootItem.value_type = dict
+        self._tag_items.clear()
+
+        for tag in self._store.tags():
+            self._rootItem.appendChild(self.createTagItem(tag))
+
+    def createTagItem(self, tag: str) -> TagItem:
+        tag_item = TagItem(self._rootItem)
+        tag_item.value = tag
+        self._tag_items[tag] = tag_item
+        return tag_item
+
+    def tagItem(self, index: QtCore.QModelIndex) -> TagItem | None:
+        """Return the tag item of a tag index, None for the root or a primary key"""
+        if not index.isValid() or index.internalPointer() is not self._rootItem:
+            return None
+        return self._rootItem.child(index.row())
+
+    def tagIndex(self, tag_item: TagItem) -> QtCore.QModelIndex:
+        return self.createIndex(tag_item.row(), 0, self._rootItem)
+
     def data(self, index: QtCore.QModelIndex, role: QtCore.Qt.ItemDataRole):
         """Override from QAbstractItemModel
 
@@ -126,9 +177,13 @@ class TagModel(QtCore.QAbstractItemModel):
 
         if role != QtCore.Qt.ItemDataRole.DisplayRole and role != QtCore.Qt.ItemDataRole.EditRole:
             return None
-        
-        item: TreeItem = index.internalPointer()
-        return item.value
+
+        tag_item = self.tagItem(index)
+        if tag_item is not None:
+            return tag_item.value
+
+        tag_item: TagItem = index.internalPointer()
+        return tag_item.pks[index.row()]
 
     def setData(self, index: QtCore.QModelIndex, value: Any, role: QtCore.Qt.ItemDataRole):
         """Override from QAbstractItemModel
@@ -142,8 +197,22 @@ class TagModel(QtCore.QAbstractItemModel):
 
         """
         if role == QtCore.Qt.ItemDataRole.EditRole:
-            item: TreeItem = index.internalPointer()
-            item.value = str(value)
+            value = str(value)
+            tag_item = self.tagItem(index)
+
+            if tag_item is not None:
+                if not self._store.renameTag(tag_item.value, value):
+                    return False
+                self._tag_items[value] = self._tag_items.pop(tag_item.value)
+                self.sigTagRenamed.emit(tag_item.value, value)
+                tag_item.value = value
+            else:
+                tag_item: TagItem = index.internalPointer()
+                pk = tag_item.pks[index.row()]
+                if not self._store.renameMember(tag_item.value, pk, value):
+                    return False
+                tag_item.pks[index.row()] = value
+                self.sigMemberRenamed.emit(tag_item.value, pk, value)
 
             self.dataChanged.emit(index, index, [QtCore.Qt.ItemDataRole.EditRole])
 
@@ -173,15 +242,9 @@ class TagModel(QtCore.QAbstractItemModel):
             return QtCore.QModelIndex()
 
         if not parent.isValid():
-            parentItem = self._rootItem
-        else:
-            parentItem = parent.internalPointer()
-
-        childItem = parentItem.child(row)
-        if childItem:
-            return self.createIndex(row, column, childItem)
-        else:
-            return QtCore.QModelIndex()
+            return self.createIndex(row, column, self._rootItem)
+
+        return self.createIndex(row, column, self.tagItem(parent))
 
     def parent(self, index: QtCore.QModelIndex) -> QtCore.QModelIndex:
         """Override from QAbstractItemModel
@@ -190,16 +253,10 @@ class TagModel(QtCore.QAbstractItemModel):
 
         """
 
-        if not index.isValid():
+        if not index.isValid() or index.internalPointer() is self._rootItem:
             return QtCore.QModelIndex()
 
-        childItem: TreeItem = index.internalPointer()
-        parentItem = childItem.parent()
-
-        if parentItem == self._rootItem:
-            return QtCore.QModelIndex()
-
-        return self.createIndex(parentItem.row(), 0, parentItem)
+        return self.tagIndex(index.internalPointer())
 
     def rowCount(self, parent=QtCore.QModelIndex()) -> int:
         """Override from QAbstractItemModel
@@ -210,11 +267,34 @@ class TagModel(QtCore.QAbstractItemModel):
             return 0
 
         if not parent.isValid():
-            parentItem = self._rootItem
-        else:
-            parentItem = parent.internalPointer()
+            return self._rootItem.childCount()
+
+        tag_item = self.tagItem(parent)
+        return 0 if tag_item is None else tag_item.fetched
+
+    def hasChildren(self, parent=QtCore.QModelIndex()) -> bool:
+        if not parent.isValid():
+            return self._rootItem.childCount() > 0
+
+        tag_item = self.tagItem(parent)
+        return tag_item is not None and self._store.count(tag_item.value) > 0
+
+    def canFetchMore(self, parent: QtCore.QModelIndex) -> bool:
+        tag_item = self.tagItem(parent)
+        return tag_item is not None and tag_item.fetched < self._store.count(tag_item.value)
 
-        return parentItem.childCount()
+    def fetchMore(self, parent: QtCore.QModelIndex):
+        if not self.canFetchMore(parent):
+            return
+
+        tag_item = self.tagItem(parent)
+        if tag_item.pks is None:
+            tag_item.pks = self._store.members(tag_item.value)
+
+        count = min(self.FETCH_SIZE, len(tag_item.pks) - tag_item.fetched)
+        self.beginInsertRows(parent, tag_item.fetched, tag_item.fetched + count - 1)
+        tag_item.fetched += count
+        self.endInsertRows()
 
     def columnCount(self, parent=QtCore.QModelIndex()) -> int:
         """Override from QAbstractItemModel
@@ -233,61 +313,104 @@ class TagModel(QtCore.QAbstractItemModel):
 
         return QtCore.Qt.ItemFlag.ItemIsEditable | QtCore.QAbstractItemModel.flags(self, index)
 
-    def to_json(self, item=None):
-
-        if item is None:
-            item = self._rootItem
-
-        nchild = item.childCount()
-
-        if item.value_type is dict:
-            document = {}
-            for i in range(nchild):
-                ch = item.child(i)
-                document[ch.value] = self.to_json(ch)
-            return document
-
-        elif item.value_type == list:
-            document = []
-            for i in range(nchild):
-                ch = item.child(i)
-                document.append(self.to_json(ch))
-            return document
-
-        else:
-            return item.value
-        
-    def append2Tag(self, values: list, parent_item: TreeItem, parent_index: QtCore.QModelIndex):
-        self.beginInsertRows(parent_index, parent_item.childCount(), parent_item.childCount() + len(values) - 1)
-        for value in values:
-            child_item = TreeItem(parent_item)
-            child_item.value = value
-            child_item.value_type = None
-            parent_item.appendChild(child_item)
-        self.endInsertRows()
-        
-    def addNewTag(self, values: list, tagname: str):
-        new_tag = TreeItem(self._rootItem)
-        new_tag.value = tagname
-        new_tag.value_type = type([])
-        self.beginInsertRows(QtCore.QModelIndex(), self._rootItem.childCount(), self._rootItem.childCount() + 1)
-        self._rootItem.appendChild(new_tag)
-        self.endInsertRows()
-        
-        index = self.index(self._rootItem.childCount(), 0)
-        self.append2Tag(values, new_tag, index)
+    def to_json(self) -> dict:
+        return self._store.to_json()
+
+    def tagsOf(self, pk) -> set[str]:
+        return self._store.tagsOf(pk)
 
     @Slot(list, str)
-    def add2Tag(self, values: list, tagname: str):
-        nchild = self._rootItem.childCount()
+    def add2Tag(self, values: list, tagname: str, key: str = ""):
+        """Add primary keys to a tag, created if needed; keys already tagged are skipped
+
+        key is the column the primary keys are values of, recorded when the
+        tag is created.
+        """
+        tag_item = self._tag_items.get(tagname)
+        created = tag_item is None
+
+        if created:
+            row = self._rootItem.childCount()
+            self.beginInsertRows(QtCore.QModelIndex(), row, row)
+            self._store.addTag(tagname)
+            self._rootItem.appendChild(self.createTagItem(tagname))
+            self.endInsertRows()
+            tag_item = self._tag_items[tagname]
+
+            if key:
+                self._store.setKey(tagname, key)
+                self.sigTagKeySet.emit(tagname, key)
+
+        added = self._store.add(tagname, values)
+        if len(added) == 0:
+            if created:
+                self.sigTagged.emit([], tagname)
+            return
+
+        tag_index = self.tagIndex(tag_item)
 
-        for i in range(nchild):
-            ch = self._rootItem.child(i)
-            if tagname == ch.value:
-                self.append2Tag(values, ch, self.index(i, 0))
-                return
-                 
-        self.addNewTag(values, tagname)
+        if tag_item.pks is not None:
+            # Show the new keys right away if the tag was fully fetched, otherwise on the next fetch
+            complete = tag_item.fetched == len(tag_item.pks)
+            tag_item.pks.extend(added)
+            if complete:
+                self.beginInsertRows(tag_index, tag_item.fetched, len(tag_item.pks) - 1)
+                tag_item.fetched = len(tag_item.pks)
+                self.endInsertRows()
+
+        self.dataChanged.emit(tag_index, tag_index, [QtCore.Qt.ItemDataRole.DisplayRole])
+        self.sigTagged.emit(added, tagname)
+
+    @Slot(list, str)
+    def removeFromTag(self, values: list, tagname: str):
+        tag_item = self._tag_items.get(tagname)
+        if tag_item is None:
+            return
+
+        removed = set(self._store.remove(tagname, values))
+        if len(removed) == 0:
+            return
+
+        tag_index = self.tagIndex(tag_item)
+
+        if tag_item.pks is not None:
+            rows = [row for row, pk in enumerate(tag_item.pks) if pk in removed]
+
+            # Remove contiguous blocks from the bottom, row numbers above stay valid
+            while len(rows) > 0:
+                last = rows.pop()
+                first = last
+                while len(rows) > 0 and rows[-1] == first - 1:
+                    first = rows.pop()
+
+                # Keys not fetched yet are not rows of the model
+                unfetched = max(first, tag_item.fetched)
+                if unfetched <= last:
+                    del tag_item.pks[unfetched:last + 1]
+                    last = unfetched - 1
+
+                if first <= last:
+                    self.beginRemoveRows(tag_index, first, last)
+                    del tag_item.pks[first:last + 1]
+                    tag_item.fetched -= last - first + 1
+                    self.endRemoveRows()
+
+        self.dataChanged.emit(tag_index, tag_index, [QtCore.Qt.ItemDataRole.DisplayRole])
+        self.sigUntagged.emit(list(removed), tagname)
+
+    @Slot(str)
+    def removeTag(self, tagname: str):
+        tag_item = self._tag_items.pop(tagname, None)
+        if tag_item is None:
+            return
+
+        row = tag_item.row()
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        members = self._store.removeTag(tagname)
+        self._rootItem.removeChildren(row, 1)
+        self.endRemoveRows()
+
+        self.sigTagRemoved.emit(tagname, members)
 
 
 class TagDialog(QtWidgets.QDialog):
@@ -355,14 +478,88 @@ class TagDialog(QtWidgets.QDialog):
             self.sigAdd2tag.emit(tag)
 
 
+class FrameModel(QtCore.QAbstractTableModel):
+    """Read-only table of a DataFrame with labelled rows and columns"""
+
+    def __init__(self, frame: pd.DataFrame, parent: QtCore.QObject = None):
+        super().__init__(parent)
+        self._frame = frame
+
+    def rowCount(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._frame)
+
+    def columnCount(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._frame.columns)
+
+    def data(self, index: QtCore.QModelIndex, role: QtCore.Qt.ItemDataRole) -> Any:
+        if not index.isValid():
+            return None
+
+        if role == QtCore.Qt.ItemDataRole.DisplayRole:
+            return str(self._frame.iat[index.row(), index.column()])
+
+        if role == QtCore.Qt.ItemDataRole.TextAlignmentRole:
+            return QtCore.Qt.AlignmentFlag.AlignRight | QtCore.Qt.AlignmentFlag.AlignVCenter
+
+    def headerData(self, section: int, orientation: QtCore.Qt.Orientation, role: QtCore.Qt.ItemDataRole) -> Any:
+        if role != QtCore.Qt.ItemDataRole.DisplayRole:
+            return None
+
+        if orientation == QtCore.Qt.Orientation.Horizontal:
+            return str(self._frame.columns[section])
+        return str(self._frame.index[section])
+
+
+class TagStatisticsDialog(QtWidgets.QDialog):
+    """Tag counts by dataset and co-occurrence of the tags"""
+
+    def __init__(self, counts: pd.DataFrame, cooccurrence: pd.DataFrame, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Tag Statistics")
+        self.resize(800, 500)
+
+        vbox = QtWidgets.QVBoxLayout()
+        self.setLayout(vbox)
+
+        tab = QtWidgets.QTabWidget()
+        for title, frame in [("Counts", counts), ("Co-occurrence", cooccurrence)]:
+            table = QtWidgets.QTableView()
+            table.setModel(FrameModel(frame, table))
+            table.resizeColumnsToContents()
+            tab.addTab(table, title)
+        vbox.addWidget(tab)
+
+        self.buttonBox = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.StandardButton.Close)
+        self.buttonBox.rejected.connect(self.reject)
+        vbox.addWidget(self.buttonBox)
+
+
 class Tagger(QtWidgets.QWidget):
-    sigSaveToJson = Signal(dict)
+    """Tag tree of the project, persisted to tagged.json through a TagJournal"""
 
     def __init__(self, parent = None):
         super().__init__(parent)
         self._model = TagModel()
-        self._model.dataChanged.connect(self.saveTagged)
-        self._model.rowsInserted.connect(self.saveTagged)
+        self._journal: TagJournal = None
+        self._reading = False        # tagged.json is read in the background
+        self._pending: list[dict] = [] # operations made during the read
+        self._workers: set[Worker] = set()
+        self._compacting = False
+        self._cooccurrence = TagCooccurrence()
+
+        self._model.sigTagged.connect(lambda pks, tag: self.record({"op": "add", "tag": tag, "pks": pks}))
+        self._model.sigUntagged.connect(lambda pks, tag: self.record({"op": "remove", "tag": tag, "pks": pks}))
+        self._model.sigTagRemoved.connect(lambda tag, pks: self.record({"op": "remove_tag", "tag": tag}))
+        self._model.sigTagRenamed.connect(lambda tag, name: self.record({"op": "rename_tag", "tag": tag, "name": name}))
+        self._model.sigMemberRenamed.connect(lambda tag, pk, name: self.record({"op": "rename_pk", "tag": tag, "pk": pk, "name": name}))
+        self._model.sigTagKeySet.connect(lambda tag, key: self.record({"op": "set_key", "tag": tag, "key": key}))
+
+        self._model.modelReset.connect(self._cooccurrence.invalidate)
+        self._model.sigTagged.connect(lambda pks, tag: self._cooccurrence.update(self._model.store(), tag, pks, 1))
+        self._model.sigUntagged.connect(lambda pks, tag: self._cooccurrence.update(self._model.store(), tag, pks, -1))
+        self._model.sigTagRemoved.connect(lambda tag, pks: self._cooccurrence.removeTag(tag))
+        self._model.sigTagRenamed.connect(self._cooccurrence.renameTag)
+        self._model.sigMemberRenamed.connect(self.onMemberRenamed)
         self.initUI()
     
     def initUI(self):
@@ -378,10 +575,103 @@ class Tagger(QtWidgets.QWidget):
 
     def model(self) -> TagModel:
         return self._model
-    
-    @Slot()
-    def saveTagged(self):
-        doc = self.model().to_json()
-        self.sigSaveToJson.emit(doc)
 
+    def cooccurrence(self) -> TagCooccurrence:
+        """Return the co-occurrence of the tags, computed on first use then kept up to date"""
+        if not self._cooccurrence.built:
+            self._cooccurrence.build(self._model.store())
+        return self._cooccurrence
+
+    @Slot(str, str, str)
+    def onMemberRenamed(self, tag: str, pk: str, new_pk: str):
+        self._cooccurrence.update(self._model.store(), tag, [pk], -1)
+        self._cooccurrence.update(self._model.store(), tag, [new_pk], 1)
+
+    def open(self, tagged_file: Path):
+        """Read the tags of a project in the background"""
+        self.closeJournal()
+        self._reading = True
+        self._pending.clear()
+
+        worker = Worker(TagJournal.read, tagged_file)
+        worker.signals.sigResult.connect(lambda result: self.onTaggedRead(tagged_file, result))
+        worker.signals.sigFailed.connect(self.onTaggedReadFailed)
+        worker.signals.sigFinished.connect(lambda: self._workers.discard(worker))
+        self._workers.add(worker)
+        QtCore.QThreadPool.globalInstance().start(worker)
+
+    def onTaggedRead(self, tagged_file: Path, result: tuple[TagStore, int, int]):
+        store, operations, sequence = result
+
+        # Operations made during the read were applied to the store being replaced
+        for entry in self._pending:
+            applyOperation(store, entry)
+
+        self._reading = False
+        self._model.loadStore(store)
+        self._journal = TagJournal(tagged_file, operations, sequence)
+
+        pending = self._pending
+        self._pending = []
+        for entry in pending:
+            self.record(entry)
+
+        # Fold the replayed operations into the snapshot
+        if operations > 0:
+            self.compact()
+
+    @Slot(str)
+    def onTaggedReadFailed(self, err: str):
+        logger.error(f"Cannot read the tags of the project: {err}")
+        self._reading = False
+        self._pending.clear()
+
+    def record(self, entry: dict):
+        """Append a tag operation to the journal, or queue it while the tags are read"""
+        if self._reading:
+            self._pending.append(entry)
+            return
 
+        if self._journal is None:
+            return
+
+        try:
+            self._journal.append(entry)
+        except OSError as e:
+            logger.error(f"Cannot save tags: {e}")
+            return
+
+        if self._journal.isCompactionDue():
+            self.compact()
+
+    def compact(self):
+        """Rewrite the snapshot in the background, the journal restarts empty"""
+        if self._journal is None or self._compacting:
+            return
+
+        self._journal.rotate()
+        self._compacting = True
+
+        worker = Worker(writeSnapshot, self._journal.snapshot_file, self._journal.rotated_file, self._model.to_json(),
+                        self._journal.sequence, self._model.store().keys())
+        worker.signals.sigResult.connect(self.onCompacted)
+        worker.signals.sigFailed.connect(logger.error)
+        worker.signals.sigFinished.connect(lambda: self.onCompactionFinished(worker))
+        self._workers.add(worker)
+        QtCore.QThreadPool.globalInstance().start(worker)
+
+    @Slot(object)
+    def onCompacted(self, result: tuple[bool, str]):
+        ok, err = result
+        if not ok:
+            logger.error(err)
+
+    def onCompactionFinished(self, worker: Worker):
+        self._workers.discard(worker)
+        self._compacting = False
+
+    @Slot()
+    def closeJournal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
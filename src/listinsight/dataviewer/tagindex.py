@@ -0,0 +1,252 @@
+import re
+import logging
+import numpy as np
+import pandas as pd
+
+from .tagstore import TagStore
+
+logger = logging.getLogger(__name__)
+
+# Number of set bits of each byte value
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+TOKEN_PATTERN = re.compile(r"""\s*(?:(?P<open>\()|(?P<close>\))|(?P<and>&|\bAND\b)|(?P<or>\||\bOR\b)|(?P<not>~|!|\bNOT\b)"""
+                           r"""|"(?P<quoted>[^"]*)"|(?P<name>[^\s()&|~!"]+))""")
+
+
+def tokenize(text: str) -> list[tuple[str, str]]:
+    """Split a tag expression into (kind, value) tokens"""
+    tokens = []
+    position = 0
+    text = text.rstrip()
+
+    while position < len(text):
+        match = TOKEN_PATTERN.match(text, position)
+        if match is None or match.end() == position:
+            raise ValueError(f"Unexpected character at {position}: {text[position:]}")
+        kind = match.lastgroup
+        if kind == "quoted":
+            kind = "name"
+        tokens.append((kind, match.group(match.lastgroup)))
+        position = match.end()
+
+    return tokens
+
+
+def parseTagExpression(text: str):
+    """Parse '"Late & Serious" & ~Reviewed' into a tree of ("and"|"or", left, right), ("not", x) and tag names
+
+    NOT binds tighter than AND, AND tighter than OR. Tag names with spaces
+    or operator characters are written in double quotes.
+    """
+    tokens = tokenize(text)
+    position = 0
+
+    def peek():
+        return tokens[position][0] if position < len(tokens) else None
+
+    def take(kind: str) -> str:
+        nonlocal position
+        if peek() != kind:
+            found = tokens[position][1] if position < len(tokens) else "end of expression"
+            raise ValueError(f"Expected {kind} in tag expression, found {found}")
+        position += 1
+        return tokens[position - 1][1]
+
+    def expression():
+        node = term()
+        while peek() == "or":
+            take("or")
+            node = ("or", node, term())
+        return node
+
+    def term():
+        node = factor()
+        while peek() == "and":
+            take("and")
+            node = ("and", node, factor())
+        return node
+
+    def factor():
+        if peek() == "not":
+            take("not")
+            return ("not", factor())
+        if peek() == "open":
+            take("open")
+            node = expression()
+            take("close")
+            return node
+        return take("name")
+
+    node = expression()
+    if position < len(tokens):
+        raise ValueError(f"Unexpected {tokens[position][1]} in tag expression")
+    return node
+
+
+class TagIndex:
+    """Tags of the rows of a dataset, by row position of unfiltered_df
+
+    - one bitmap per tag: bit i is set if row i has the tag. Bitmaps are
+      packed 8 rows per byte, so set algebra across tags runs on
+      num_rows / 8 bytes with numpy bitwise operations.
+    - the Tags column, dictionary encoded: one code per row into the
+      distinct comma-joined tag lists, in the order of the bitmaps.
+    """
+    def __init__(self, keys: pd.Index):
+        self.keys = keys # primary key values as text, by row position
+        self.num_rows = len(keys)
+        self._bitmaps: dict[str, np.ndarray] = {}
+        self._names: set[str] = set() # tags of the store, with or without rows here
+        self.codes = np.zeros(len(keys), dtype=np.int32)
+        self._labels: list[str] = [""]
+        self._label_codes: dict[str, int] = {"": 0}
+
+    @classmethod
+    def build(cls, pk_index: pd.Index, store: TagStore, key_column: str = None) -> "TagIndex":
+        """Join the project tags, keyed by primary key, to the row positions
+
+        With key_column, only the tags whose pks are values of that column are joined.
+        """
+        index = cls(pk_index.astype(str))
+        tags = store.tags()
+        if key_column is not None:
+            tags = [tag for tag in tags if store.matches(tag, key_column)]
+        index._names = set(tags)
+        if len(tags) == 0 or len(pk_index) == 0:
+            return index
+
+        members = [np.array(store.members(tag), dtype=object) for tag in tags]
+        pairs = pd.DataFrame({"pk": np.concatenate(members),
+                              "tag": np.repeat(np.arange(len(tags)), [len(m) for m in members])})
+        rows = pd.DataFrame({"pk": index.keys, "row": np.arange(len(pk_index))})
+        joined = rows.merge(pairs, on="pk").sort_values(["row", "tag"])
+
+        # Bitmaps in the order of the store
+        for code, group in joined.groupby("tag"):
+            bits = np.zeros(len(pk_index), dtype=bool)
+            bits[group["row"].to_numpy()] = True
+            index._bitmaps[tags[code]] = np.packbits(bits)
+
+        joined["tag"] = np.array(tags, dtype=object)[joined["tag"].to_numpy()]
+        row_labels = joined.groupby("row", sort=False)["tag"].agg(",".join)
+        labels = np.full(len(pk_index), "", dtype=object)
+        labels[row_labels.index.to_numpy()] = row_labels.to_numpy()
+        codes, uniques = pd.factorize(labels)
+        index.codes = codes.astype(np.int32)
+        index._labels = list(uniques)
+        index._label_codes = {label: code for code, label in enumerate(index._labels)}
+        if "" not in index._label_codes:
+            index._label_codes[""] = len(index._labels)
+            index._labels.append("")
+
+        return index
+
+    def positionsOf(self, pks: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """Return the row positions of the pks found and the pks themselves, duplicated keys included
+
+        Looked up in the hash table of the key index, the rows are not scanned.
+        """
+        if len(pks) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=object)
+
+        positions = self.keys.get_indexer_for(pd.Index(pks, dtype=object))
+        positions = positions[positions >= 0]
+        return positions, self.keys[positions].to_numpy()
+
+    def tags(self) -> list[str]:
+        return list(self._bitmaps.keys())
+
+    def hasTag(self, tag: str) -> bool:
+        return tag in self._names
+
+    def bitmap(self, tag: str) -> np.ndarray:
+        bitmap = self._bitmaps.get(tag)
+        if bitmap is None:
+            return np.zeros((self.num_rows + 7) // 8, dtype=np.uint8)
+        return bitmap
+
+    def contains(self, tag: str, positions: np.ndarray) -> np.ndarray:
+        """Return whether each row at positions has the tag"""
+        bitmap = self._bitmaps.get(tag)
+        if bitmap is None:
+            return np.zeros(len(positions), dtype=bool)
+        return ((bitmap[positions >> 3] >> (7 - (positions & 7))) & 1).astype(bool)
+
+    def isTagged(self, positions: np.ndarray) -> np.ndarray:
+        """Return whether each row at positions has at least one tag"""
+        return self.codes[positions] != self._label_codes[""]
+
+    def count(self, tag: str) -> int:
+        return int(POPCOUNT[self.bitmap(tag)].sum())
+
+    def counts(self) -> dict[str, int]:
+        """Return the number of rows of each tag"""
+        return {tag: int(POPCOUNT[bitmap].sum()) for tag, bitmap in self._bitmaps.items()}
+
+    def label(self, position: int) -> str:
+        """Return the Tags column value of a row"""
+        return self._labels[self.codes[position]]
+
+    def column(self) -> pd.Categorical:
+        """Return the Tags column of all rows"""
+        return pd.Categorical.from_codes(self.codes, self._labels)
+
+    def labelCode(self, label: str) -> int:
+        code = self._label_codes.get(label)
+        if code is None:
+            code = len(self._labels)
+            self._labels.append(label)
+            self._label_codes[label] = code
+        return code
+
+    def add(self, tag: str, positions: np.ndarray):
+        """Set the tag on the rows at positions"""
+        positions = np.asarray(positions, dtype=np.int64)
+        self._names.add(tag)
+        if len(positions) == 0:
+            return
+        if tag not in self._bitmaps:
+            self._bitmaps[tag] = self.bitmap(tag)
+
+        np.bitwise_or.at(self._bitmaps[tag], positions >> 3, (0x80 >> (positions & 7)).astype(np.uint8))
+        self.relabel(positions)
+
+    def remove(self, tag: str, positions: np.ndarray):
+        """Clear the tag from the rows at positions"""
+        positions = np.asarray(positions, dtype=np.int64)
+        if tag not in self._bitmaps:
+            return
+
+        np.bitwise_and.at(self._bitmaps[tag], positions >> 3, ~(0x80 >> (positions & 7)).astype(np.uint8))
+        self.relabel(positions)
+
+    def relabel(self, positions: np.ndarray):
+        """Recompute the Tags column of the rows at positions from the bitmaps"""
+        labels = [[] for _ in range(len(positions))]
+        for tag in self._bitmaps:
+            for i in np.flatnonzero(self.contains(tag, positions)).tolist():
+                labels[i].append(tag)
+
+        self.codes[positions] = [self.labelCode(",".join(row_tags)) for row_tags in labels]
+
+    def evaluate(self, expression: str) -> np.ndarray:
+        """Return the boolean row mask of a tag expression
+
+        Raises ValueError for a tag the store does not know, rather than
+        matching no rows, so a misspelled name fails the filter.
+        """
+        def evaluateNode(node) -> np.ndarray:
+            if isinstance(node, str):
+                if not self.hasTag(node):
+                    raise ValueError(f"Unknown tag in tag expression: {node}")
+                return self.bitmap(node)
+            if node[0] == "not":
+                return np.invert(evaluateNode(node[1]))
+            if node[0] == "and":
+                return np.bitwise_and(evaluateNode(node[1]), evaluateNode(node[2]))
+            return np.bitwise_or(evaluateNode(node[1]), evaluateNode(node[2]))
+
+        packed = evaluateNode(parseTagExpression(expression))
+        return np.unpackbits(packed, count=self.num_rows).astype(bool)
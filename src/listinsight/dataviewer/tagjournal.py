@@ -0,0 +1,158 @@
+import json
+import shutil
+import logging
+from pathlib import Path
+
+from utilities.utils import writeJsonAtomic, readJsonLines
+from .tagstore import TagStore
+
+logger = logging.getLogger(__name__)
+
+
+def applyOperation(store: TagStore, entry: dict):
+    """Replay a journal entry on the store"""
+    op = entry.get("op")
+    tag = entry.get("tag")
+
+    if op == "add":
+        store.add(tag, entry.get("pks", []))
+    elif op == "remove":
+        store.remove(tag, entry.get("pks", []))
+    elif op == "remove_tag":
+        store.removeTag(tag)
+    elif op == "rename_tag":
+        store.renameTag(tag, entry.get("name"))
+    elif op == "rename_pk":
+        store.renameMember(tag, entry.get("pk"), entry.get("name"))
+    elif op == "set_key":
+        # Recorded when the tag is created, before its first pks
+        store.addTag(tag)
+        store.setKey(tag, entry.get("key", ""))
+    else:
+        logger.warning(f"Skipping unknown tag operation {op}")
+
+
+def writeSnapshot(snapshot_file: Path, rotated_file: Path, document: dict, sequence: int,
+                  keys: dict = None) -> tuple[bool, str]:
+    """Write the compacted document with the sequence of the last entry it covers, then drop the journal it replaces"""
+    ok, err = writeJsonAtomic(snapshot_file.as_posix(), {"sequence": sequence, "tags": document, "keys": keys or {}})
+    if ok:
+        rotated_file.unlink(missing_ok=True)
+    return ok, err
+
+
+class TagJournal:
+    """Persistence of the Tagger: tagged.json snapshot and an append-only journal
+
+    Each tag operation appends one JSON line to tagged.journal, so saving
+    costs O(changed keys) whatever the number of tagged cases. Compaction
+    rotates the journal to tagged.journal.old, the snapshot is then
+    rewritten in the background and the rotated journal deleted.
+
+    Entries are numbered and the snapshot stores the sequence number of the
+    last entry it covers. Loading replays the rotated journal then the
+    journal on the snapshot, skipping the entries already folded into it:
+    renames are not idempotent, and a rotated journal survives a crash
+    between the snapshot write and its deletion.
+    """
+    COMPACT_AFTER = 1000 # operations
+
+    def __init__(self, snapshot_file: Path, operations: int = 0, sequence: int = 0):
+        self.snapshot_file = snapshot_file
+        self.journal_file = snapshot_file.with_suffix(".journal")
+        self.rotated_file = snapshot_file.with_suffix(".journal.old")
+        self.operations = operations # entries not folded into the snapshot
+        self.sequence = sequence     # number of the last entry appended
+        self._file = None
+
+    @classmethod
+    def readSnapshot(cls, snapshot_file: Path) -> tuple[dict, dict, int]:
+        """Return the {tag : [pk, ...]} document, the {tag : key column} of its tags and the sequence of the last entry folded into it
+
+        Snapshots written before entries were numbered are the bare document.
+        """
+        if not snapshot_file.exists() or snapshot_file.stat().st_size == 0:
+            return {}, {}, 0
+
+        with open(snapshot_file, mode='r', encoding='utf8') as file:
+            try:
+                document = json.load(file)
+            except json.JSONDecodeError:
+                logger.error(f"{snapshot_file.name} contains invalid JSON")
+                return {}, {}, 0
+
+        if isinstance(document.get("sequence"), int) and isinstance(document.get("tags"), dict):
+            keys = document.get("keys")
+            return document["tags"], keys if isinstance(keys, dict) else {}, document["sequence"]
+        return document, {}, 0
+
+    @classmethod
+    def read(cls, snapshot_file: Path) -> tuple[TagStore, int, int]:
+        """Load the snapshot and replay the journals
+
+        Returns the store, the number of replayed operations and the sequence
+        of the last entry.
+        """
+        store = TagStore()
+        document, keys, sequence = cls.readSnapshot(snapshot_file)
+        store.load(document, keys)
+        folded = sequence
+
+        operations = 0
+        journal = cls(snapshot_file)
+        for journal_file in [journal.rotated_file, journal.journal_file]:
+            if not journal_file.exists():
+                continue
+
+            for entry in readJsonLines(journal_file):
+                # Entries without a number predate the numbered snapshots
+                if folded > 0 and entry.get("seq", 0) <= folded:
+                    continue
+                applyOperation(store, entry)
+                operations += 1
+                sequence = max(sequence, entry.get("seq", 0))
+
+        return store, operations, sequence
+
+    def append(self, entry: dict):
+        if self._file is None:
+            self._file = open(self.journal_file, mode='a', encoding='utf8')
+            if self._file.tell() > 0 and not self.endsWithNewline():
+                # Do not glue the entry to a partially written line
+                self._file.write("\n")
+
+        self.sequence += 1
+        self._file.write(json.dumps({**entry, "seq": self.sequence}, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.operations += 1
+
+    def endsWithNewline(self) -> bool:
+        with open(self.journal_file, mode='rb') as file:
+            file.seek(-1, 2)
+            return file.read(1) == b"\n"
+
+    def isCompactionDue(self) -> bool:
+        return self.operations >= self.COMPACT_AFTER
+
+    def rotate(self):
+        """Start a new journal for the operations following the snapshot about to be written
+
+        Must not be called while a snapshot is being written.
+        """
+        self.close()
+
+        if self.journal_file.exists():
+            if self.rotated_file.exists():
+                # Left by a compaction that did not finish, the new snapshot covers both
+                with open(self.rotated_file, mode='ab') as rotated, open(self.journal_file, mode='rb') as journal:
+                    shutil.copyfileobj(journal, rotated)
+                self.journal_file.unlink()
+            else:
+                self.journal_file.replace(self.rotated_file)
+
+        self.operations = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
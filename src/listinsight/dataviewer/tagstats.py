@@ -0,0 +1,116 @@
+import logging
+import numpy as np
+import pandas as pd
+
+from .tagstore import TagStore
+
+logger = logging.getLogger(__name__)
+
+
+class TagCooccurrence:
+    """Number of cases sharing each pair of tags of a TagStore
+
+    With A the incidence matrix cases x tags, the co-occurrence is AᵀA; the
+    diagonal holds the number of cases of each tag. The product is computed
+    over the non-zeros of A only: each case with k tags contributes its k²
+    tag pairs, counted with bincount, so the cost is the sum of k² over the
+    tagged cases rather than cases x tags². It is then kept up to date from
+    the tag operations, in O(tags of the changed cases).
+    """
+    PAIRS_PER_CHUNK = 4_000_000
+
+    def __init__(self):
+        self._tags: list[str] = []
+        self._codes: dict[str, int] = {}
+        self.matrix = np.zeros((0, 0), dtype=np.int64)
+        self.built = False
+
+    def invalidate(self):
+        self.built = False
+
+    def build(self, store: TagStore):
+        self._tags = store.tags()
+        self._codes = {tag: code for code, tag in enumerate(self._tags)}
+        num_tags = len(self._tags)
+        self.built = True
+
+        sizes = np.array([store.count(tag) for tag in self._tags], dtype=np.int64)
+        if sizes.sum() == 0:
+            self.matrix = np.zeros((num_tags, num_tags), dtype=np.int64)
+            return
+
+        # Non-zeros of A: (case, tag) pairs, sorted by case
+        pk_codes, _ = pd.factorize(np.concatenate([np.array(store.members(tag), dtype=object) for tag in self._tags]))
+        tag_codes = np.repeat(np.arange(num_tags, dtype=np.int64), sizes)
+        order = np.argsort(pk_codes, kind="stable")
+        tag_codes = tag_codes[order]
+
+        degrees = np.bincount(pk_codes)
+        starts = np.concatenate([[0], np.cumsum(degrees)[:-1]])
+        pairs = np.zeros(num_tags * num_tags, dtype=np.int64)
+
+        # Cases with k tags are gathered into a (cases, k) array and their pairs counted at once
+        for k in np.unique(degrees):
+            cases = np.flatnonzero(degrees == k)
+            chunk = max(1, self.PAIRS_PER_CHUNK // (k * k))
+            for i in range(0, len(cases), chunk):
+                rows = tag_codes[starts[cases[i:i + chunk], None] + np.arange(k)]
+                pairs += np.bincount((rows[:, :, None] * num_tags + rows[:, None, :]).ravel(),
+                                     minlength=num_tags * num_tags)
+
+        self.matrix = pairs.reshape(num_tags, num_tags)
+
+    def code(self, tag: str) -> int:
+        code = self._codes.get(tag)
+        if code is None:
+            code = len(self._tags)
+            self._tags.append(tag)
+            self._codes[tag] = code
+            self.matrix = np.pad(self.matrix, ((0, 1), (0, 1)))
+        return code
+
+    def update(self, store: TagStore, tag: str, pks: list[str], sign: int):
+        """Count the pks added to (sign=1) or removed from (sign=-1) a tag, once the store is updated"""
+        if not self.built:
+            return
+
+        code = self.code(tag)
+        if len(pks) == 0:
+            return
+
+        others = np.array([self.code(other) for pk in pks for other in store.tagsOf(pk) if other != tag], dtype=np.int64)
+
+        self.matrix[code, code] += sign * len(pks)
+        np.add.at(self.matrix[code], others, sign)
+        np.add.at(self.matrix[:, code], others, sign)
+
+    def removeTag(self, tag: str):
+        code = self._codes.get(tag)
+        if not self.built or code is None:
+            return
+
+        self._tags.pop(code)
+        self._codes = {tag: code for code, tag in enumerate(self._tags)}
+        self.matrix = np.delete(np.delete(self.matrix, code, axis=0), code, axis=1)
+
+    def renameTag(self, tag: str, new_name: str):
+        code = self._codes.pop(tag, None)
+        if code is None:
+            return
+
+        self._tags[code] = new_name
+        self._codes[new_name] = code
+
+    def tags(self) -> list[str]:
+        return list(self._tags)
+
+    def count(self, tag: str, other: str = None) -> int:
+        """Return the number of cases having both tags, or the tag alone"""
+        code = self._codes.get(tag)
+        other_code = self._codes.get(tag if other is None else other)
+        if code is None or other_code is None:
+            return 0
+        return int(self.matrix[code, other_code])
+
+    def frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.matrix, index=self._tags, columns=self._tags)
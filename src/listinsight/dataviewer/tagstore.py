@@ -0,0 +1,170 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TagStore:
+    """Tagged primary keys of the project, indexed both ways
+
+    tag -> ordered set of pks and pk -> set of tags, so membership, dedup,
+    "tags of this case" and removal are O(1). Primary keys are kept as
+    strings, so that keys read as numbers or as text match.
+    The pk -> tags index is built on first use, loading only fills the tags.
+
+    Each tag also records the key column its pks are values of (e.g. CASE_ID),
+    so that datasets keyed by another column do not pick up its rows. Tags
+    without a key column, created before it was recorded, match any column.
+    """
+    def __init__(self):
+        self._members: dict[str, dict[str, None]] = {} # {tag : {pk : None}}, insertion ordered
+        self._tags: dict[str, set[str]] | None = None  # {pk : {tag}}
+        self._keys: dict[str, str] = {}                # {tag : key column}
+
+    def clear(self):
+        self._members.clear()
+        self._tags = None
+        self._keys.clear()
+
+    def reverseIndex(self) -> dict[str, set[str]]:
+        if self._tags is None:
+            self._tags = {}
+            for tag, members in self._members.items():
+                for pk in members:
+                    self._tags.setdefault(pk, set()).add(tag)
+        return self._tags
+
+    def load(self, document: dict, keys: dict = None):
+        """Load a {tag : [pk, ...]} document and the {tag : key column} of its tags, duplicated pks are dropped"""
+        self.clear()
+        for tag, pks in document.items():
+            if not isinstance(pks, list):
+                logger.warning(f"Skipping tag {tag}: list of primary keys expected")
+                continue
+            self.add(str(tag), pks)
+
+        for tag, key in (keys or {}).items():
+            self.setKey(str(tag), key)
+
+    def to_json(self) -> dict:
+        return {tag: list(members) for tag, members in self._members.items()}
+
+    def keys(self) -> dict[str, str]:
+        """Return the key column of the tags that have one"""
+        return dict(self._keys)
+
+    def tags(self) -> list[str]:
+        return list(self._members.keys())
+
+    def hasTag(self, tag: str) -> bool:
+        return tag in self._members
+
+    def keyOf(self, tag: str) -> str:
+        return self._keys.get(tag, "")
+
+    def setKey(self, tag: str, key: str):
+        """Record the key column of a tag's pks"""
+        if not tag in self._members:
+            return
+        if key:
+            self._keys[tag] = key
+        else:
+            self._keys.pop(tag, None)
+
+    def matches(self, tag: str, column: str) -> bool:
+        """Return whether the pks of a tag are values of column"""
+        key = self._keys.get(tag, "")
+        return key == "" or key == column
+
+    def members(self, tag: str) -> list[str]:
+        return list(self._members.get(tag, {}))
+
+    def count(self, tag: str) -> int:
+        return len(self._members.get(tag, {}))
+
+    def tagsOf(self, pk) -> set[str]:
+        return self.reverseIndex().get(str(pk), set())
+
+    def isTagged(self, pk, tag: str) -> bool:
+        return str(pk) in self._members.get(tag, {})
+
+    def addTag(self, tag: str) -> bool:
+        """Create an empty tag, return False if it exists"""
+        if tag in self._members:
+            return False
+        self._members[tag] = {}
+        return True
+
+    def add(self, tag: str, pks: list) -> list[str]:
+        """Add pks to a tag, created if needed, return the pks that were not tagged yet"""
+        self.addTag(tag)
+        members = self._members[tag]
+
+        added = [pk for pk in dict.fromkeys(map(str, pks)) if not pk in members]
+        members.update(dict.fromkeys(added))
+        if self._tags is not None:
+            for pk in added:
+                self._tags.setdefault(pk, set()).add(tag)
+
+        return added
+
+    def remove(self, tag: str, pks: list) -> list[str]:
+        """Remove pks from a tag, return the pks that were removed"""
+        members = self._members.get(tag)
+        if members is None:
+            return []
+
+        removed = []
+        for pk in pks:
+            pk = str(pk)
+            if not pk in members:
+                continue
+            del members[pk]
+            removed.append(pk)
+            if self._tags is None:
+                continue
+            tags = self._tags[pk]
+            tags.discard(tag)
+            if len(tags) == 0:
+                del self._tags[pk]
+
+        return removed
+
+    def removeTag(self, tag: str) -> list[str]:
+        """Delete a tag, return its former members"""
+        members = self.members(tag)
+        self.remove(tag, members)
+        self._members.pop(tag, None)
+        self._keys.pop(tag, None)
+        return members
+
+    def renameMember(self, tag: str, pk, new_pk) -> bool:
+        """Replace a pk of a tag, keeping its position"""
+        pk, new_pk = str(pk), str(new_pk)
+        members = self._members.get(tag, {})
+        if not pk in members or new_pk in members:
+            return False
+
+        self._members[tag] = {new_pk if p == pk else p: None for p in members}
+        if self._tags is None:
+            return True
+        self._tags[pk].discard(tag)
+        if len(self._tags[pk]) == 0:
+            del self._tags[pk]
+        self._tags.setdefault(new_pk, set()).add(tag)
+        return True
+
+    def renameTag(self, tag: str, new_name: str) -> bool:
+        if not tag in self._members or new_name in self._members:
+            return False
+
+        # Keep the tag order
+        self._members = {new_name if t == tag else t: m for t, m in self._members.items()}
+        if tag in self._keys:
+            self._keys[new_name] = self._keys.pop(tag)
+        if self._tags is None:
+            return True
+        for pk in self._members[new_name]:
+            tags = self._tags[pk]
+            tags.discard(tag)
+            tags.add(new_name)
+        return True
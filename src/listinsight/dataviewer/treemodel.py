@@ -6,6 +6,7 @@ class TreeItem:
         self.item_data = data
         self.parent_item = parent
         self.child_items = []
+        self.child_number = 0 # position in the parent, kept up to date by the parent
 
     def child(self, number: int) -> 'TreeItem':
         if number < 0 or number >= len(self.child_items):
@@ -20,7 +21,7 @@ class TreeItem:
 
     def childNumber(self) -> int:
         if self.parent_item:
-            return self.parent_item.child_items.index(self)
+            return self.child_number
         return 0
 
     def columnCount(self) -> int:
@@ -35,13 +36,16 @@ class TreeItem:
         if position < 0 or position > len(self.child_items):
             return False
 
-        for row in range(count):
-            data = [None] * columns
-            item = TreeItem(data.copy(), self)
-            self.child_items.insert(position, item)
+        self.child_items[position:position] = [TreeItem([None] * columns, self) for row in range(count)]
 
+        self.renumberChildren(position)
         return True
 
+    def renumberChildren(self, position: int = 0):
+        """Store the row of the children from position, after an insertion or a removal"""
+        for row in range(position, len(self.child_items)):
+            self.child_items[row].child_number = row
+
     def insertColumns(self, position: int, columns: int) -> bool:
         if position < 0 or position > len(self.item_data):
             return False
@@ -62,9 +66,9 @@ class TreeItem:
         if position < 0 or position + count > len(self.child_items):
             return False
 
-        for row in range(count):
-            self.child_items.pop(position)
+        del self.child_items[position:position + count]
 
+        self.renumberChildren(position)
         return True
 
     def removeColumns(self, position: int, columns: int) -> bool:
@@ -0,0 +1,171 @@
+import shutil
+import logging
+import tempfile
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pathlib import Path
+from typing import Callable
+
+from .storage import WriteProfile, tempPath, replaceFile
+
+logger = logging.getLogger(__name__)
+
+
+def headerNames(row: tuple) -> list[str]:
+    """Name the columns like pandas: Unnamed: i for blanks, .n suffix for duplicates"""
+    names = []
+    seen: dict[str, int] = {}
+    for i, value in enumerate(row):
+        name = f"Unnamed: {i}" if value is None or str(value).strip() == "" else str(value)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def columnArray(values: list) -> pa.Array:
+    """Convert the cell values of a column, as text if the types are mixed"""
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+        return pa.array([None if v is None else str(v) for v in values], pa.string())
+
+
+def commonType(types: list[pa.DataType]) -> pa.DataType:
+    """Return the type every batch of a column can be cast to"""
+    types = [t for t in types if not pa.types.is_null(t)]
+    if len(types) == 0:
+        return pa.string()
+
+    if all(t == types[0] for t in types):
+        return types[0]
+
+    if all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in types):
+        return pa.float64()
+
+    if all(pa.types.is_timestamp(t) for t in types):
+        return pa.timestamp("us")
+
+    return pa.string()
+
+
+def streamSheet(rows, spool: Path, batch_size: int, progress: Callable = None) -> tuple[list[Path], pa.Schema | None]:
+    """Write the rows of a sheet to spool files of batch_size rows
+
+    Each batch keeps the types found in its own rows. Returns the spool files
+    and the schema all of them can be cast to.
+    """
+    header = None
+    batch: list[tuple] = []
+    files: list[Path] = []
+    types: dict[str, list[pa.DataType]] = {}
+    count = 0
+
+    def flush():
+        columns = list(zip(*batch)) if len(batch) > 0 else [[] for _ in header]
+        table = pa.table({name: columnArray(list(values)) for name, values in zip(header, columns)})
+        for name, column in zip(header, table.columns):
+            types.setdefault(name, []).append(column.type)
+
+        spool_file = spool.joinpath(f"{len(files)}.parquet")
+        pq.write_table(table, spool_file.as_posix(), compression="none")
+        files.append(spool_file)
+        batch.clear()
+
+    for row in rows:
+        if header is None:
+            # Trailing blank header cells are sheet padding
+            row = list(row)
+            while len(row) > 0 and (row[-1] is None or str(row[-1]).strip() == ""):
+                row.pop()
+            header = headerNames(row)
+            continue
+
+        # Pad or cut rows to the header width
+        row = tuple(row[:len(header)]) + (None,) * (len(header) - len(row))
+        if all(v is None for v in row):
+            continue
+
+        batch.append(row)
+        count += 1
+
+        if len(batch) >= batch_size:
+            flush()
+            if progress is not None:
+                progress(count)
+
+    if header is None:
+        return [], None
+
+    if len(batch) > 0 or len(files) == 0:
+        flush()
+
+    schema = pa.schema([(name, commonType(types[name])) for name in header])
+    return files, schema
+
+
+def streamWorkbook(filepath: Path,
+                   parquet_folder: Path,
+                   profile: WriteProfile,
+                   batch_size: int = 10000,
+                   progress: Callable = None) -> list[Path]:
+    """Convert each sheet of a workbook to <SHEET>.parquet with bounded memory
+
+    Rows are read one at a time (openpyxl read-only mode) and spooled as
+    Arrow batches, so peak memory depends on batch_size and not on the
+    workbook size. The batches are then cast to a common schema and written
+    to the final parquet, one row group at a time.
+    progress(sheet, rows) is called after each batch, it may raise to cancel.
+    """
+    from openpyxl import load_workbook
+
+    parquets = []
+    workbook = load_workbook(filepath, read_only=True, data_only=True)
+    spool = Path(tempfile.mkdtemp(prefix="listinsight-"))
+
+    try:
+        for i, sheet in enumerate(workbook.worksheets):
+            parquetfile = parquet_folder.joinpath(f"{sheet.title.upper()}.parquet")
+            report = None if progress is None else lambda rows, name=sheet.title: progress(name, rows)
+
+            sheet_spool = spool.joinpath(str(i))
+            sheet_spool.mkdir()
+            files, schema = streamSheet(sheet.iter_rows(values_only=True), sheet_spool, batch_size, report)
+            if schema is None:
+                logger.info(f"Skipping empty sheet {sheet.title}")
+                continue
+
+            tmpfile = tempPath(parquetfile)
+            try:
+                with pq.ParquetWriter(tmpfile.as_posix(),
+                                      schema,
+                                      compression=profile.compression,
+                                      compression_level=profile.compression_level,
+                                      write_page_index=profile.write_page_index,
+                                      write_statistics=True) as writer:
+                    # Regroup the batches into row groups of the profile size
+                    pending = schema.empty_table()
+                    for spool_file in files:
+                        pending = pa.concat_tables([pending, pq.read_table(spool_file).cast(schema)])
+                        spool_file.unlink()
+
+                        full = pending.num_rows - pending.num_rows % profile.row_group_size
+                        if full > 0:
+                            writer.write_table(pending.slice(0, full), row_group_size=profile.row_group_size)
+                            pending = pending.slice(full)
+
+                    if pending.num_rows > 0:
+                        writer.write_table(pending, row_group_size=profile.row_group_size)
+                replaceFile(tmpfile, parquetfile)
+            finally:
+                tmpfile.unlink(missing_ok=True)
+
+            parquets.append(parquetfile)
+    finally:
+        workbook.close()
+        shutil.rmtree(spool, ignore_errors=True)
+
+    return parquets
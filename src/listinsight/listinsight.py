@@ -4,10 +4,16 @@ from qtpy import QtCore, QtWidgets, Slot, QtGui
 
 from dataviewer.dataviewer import DataViewer, DataSet # for testing
 from dataviewer.json_model import JsonModel # for testing
+from dataviewer.sqlconsole import SqlConsole # for testing
+from analyzer.rules import rule_tags # for testing
 # from listinsight.dataviewer.dataviewer import DataViewer, DataSet # for prod
 # from listinsight.dataviewer.json_model import JsonModel # for prod
+# from listinsight.dataviewer.sqlconsole import SqlConsole # for prod
+# from listinsight.analyzer.rules import rule_tags # for prod
 
 from utilities.utils import writeJson, readJson
+from utilities.worker import Worker
+from utilities.writer import JsonWriter
 from jsonschema import validate
 from json_schema import json_schema # for testing
 # from listinsight.json_schema import json_schema # for prod
@@ -43,6 +49,9 @@ class ListInsight(QtWidgets.QWidget):
         self._tagged_file: Path = self._rootpath.joinpath("tagged.json")
         self._project = {}
         self._project_name = project_name
+        self._workers: set[Worker] = set()
+        self._writer = JsonWriter(parent=self)
+        QtWidgets.QApplication.instance().aboutToQuit.connect(self._writer.flush)
         self.initUI()
 
     def initUI(self):
@@ -58,14 +67,20 @@ class ListInsight(QtWidgets.QWidget):
 
          # Dataviewer
         self.dataviewer = DataViewer()
+        self.dataviewer.setRuleTags(rule_tags)
 
         self.tab_widget.addTab(self.dataviewer, "DataViewer")
 
         self.tab_widget.addTab(QtWidgets.QWidget(), "Shaper")
         self.tab_widget.addTab(QtWidgets.QWidget(), "Analyzer")
 
+        # SQL console over the project parquets
+        self.sql_console = SqlConsole()
+        self.tab_widget.addTab(self.sql_console, "SQL")
+        self.sql_console.sigMessage.connect(self.updateStatusbarMessage)
+
         self.dataviewer.shortlister.sigSaveToJson.connect(self.saveShortList)
-        self.dataviewer.tag_pane.sigSaveToJson.connect(self.saveTags)
+        QtWidgets.QApplication.instance().aboutToQuit.connect(self.dataviewer.tag_pane.closeJournal)
         self.dataviewer.sigDatasetInfoChanged.connect(self.onDatasetInfoChanged)
         self.dataviewer.sigDatasetImported.connect(self.onDatasetImported)
         self.dataviewer.sigMessage.connect(self.updateStatusbarMessage)
@@ -99,12 +114,22 @@ class ListInsight(QtWidgets.QWidget):
                                                 self,
                                                 triggered=self.loadFiles)
         self.action_import_data.setDisabled(True)
+        self.action_import_directory = QtGui.QAction(QtGui.QIcon(":folder-open-line"), "Import partitioned dataset",
+                                                     self,
+                                                     triggered=self.loadDirectory)
+        self.action_import_directory.setDisabled(True)
+        self.action_append_data = QtGui.QAction(QtGui.QIcon(":file_add"), "Append to active dataset",
+                                                self,
+                                                triggered=self.appendFile)
+        self.action_append_data.setDisabled(True)
         self.action_projectInfo = QtGui.QAction(QtGui.QIcon(":information-2-line"), "Info", self, triggered=self.projectInfo)
 
         self.toolbar.addAction(self.action_new_project)
         self.toolbar.addAction(self.action_select_project)
         self.toolbar.addAction(self.action_load_project)
         self.toolbar.addAction(self.action_import_data)
+        self.toolbar.addAction(self.action_import_directory)
+        self.toolbar.addAction(self.action_append_data)
         self.toolbar.addAction(self.action_projectInfo)
 
         spacer = QtWidgets.QWidget()
@@ -117,6 +142,7 @@ class ListInsight(QtWidgets.QWidget):
         self.status_label = QtWidgets.QLabel()
         self.status_label.setMinimumWidth(150)
         self.statusbar.addPermanentWidget(self.status_label)
+        self.progress: QtWidgets.QProgressBar = None
 
     @Slot(str)
     def updateStatusbarMessage(self, msg: str):
@@ -124,18 +150,25 @@ class ListInsight(QtWidgets.QWidget):
     
     @Slot(int,str)
     def setProgessbar(self, i: int, m: str):
-        self.progress = QtWidgets.QProgressBar()
-        self.progress.setMinimum(0)
+        # Reuse the running progress bar when more work is queued
+        if self.progress is None:
+            self.progress = QtWidgets.QProgressBar()
+            self.progress.setMinimum(0)
+            self.progress.setFixedHeight(self.status_label.height())
+            self.statusbar.addWidget(self.progress)
         self.progress.setMaximum(i)
-        self.progress.setFixedHeight(self.status_label.height())
-        self.statusbar.addWidget(self.progress)
         self.status_label.setText(m)
 
     @Slot(int)
     def updateProgessbar(self, i: int):
+        if self.progress is None:
+            return
+
         self.progress.setValue(i)
         if self.progress.maximum() == i:
             self.statusbar.removeWidget(self.progress)
+            self.progress.deleteLater()
+            self.progress = None
     
     def initDialogs(self):
         self.info_dialog: ProjectInfo = None
@@ -230,6 +263,9 @@ class ListInsight(QtWidgets.QWidget):
         if not self._project_file.exists():
             return
 
+        # Pending writes target the previous project files
+        self._writer.flush()
+
         self._project, err = readJson(self._project_file.as_posix())
 
         if err != "":
@@ -244,31 +280,55 @@ class ListInsight(QtWidgets.QWidget):
         self._shortlist_file = Path(self._project["project_files"]["shortlist"])
         self._tagged_file = Path(self._project["project_files"]["tagged"])
 
-        self.dataviewer.loadProjectData()
+        # Shortlist and tags are read while the parquets load
         self.loadShortlist()
         self.loadTagger()
+        self.dataviewer.loadProjectData()
+        self.sql_console.setProject(self._project)
         self.updateActionState()
 
-    def loadShortlist(self):
-        if not self._shortlist_file.exists():
-            with open(self._shortlist_file, mode='w', encoding='utf8') as file:
+    def readJsonInBackground(self, json_file: Path, slot):
+        """Read a JSON file in the global thread pool and pass its content to slot"""
+        if not json_file.exists():
+            with open(json_file, mode='w', encoding='utf8') as file:
                 pass
 
-        data, err = readJson(self._shortlist_file.as_posix())
+        worker = Worker(readJson, json_file.as_posix())
+        worker.signals.sigResult.connect(slot)
+        worker.signals.sigFinished.connect(lambda: self._workers.discard(worker))
+        self._workers.add(worker)
+        QtCore.QThreadPool.globalInstance().start(worker)
+
+    def loadShortlist(self):
+        self.readJsonInBackground(self._shortlist_file, self.onShortlistRead)
+
+    @Slot(object)
+    def onShortlistRead(self, result: tuple[dict, str]):
+        data, err = result
         self.dataviewer.shortlister.model().load(data.copy())
 
     def loadTagger(self):
-        if not self._tagged_file.exists():
-            with open(self._tagged_file, mode='w', encoding='utf8') as file:
-                pass
-
-        data, err = readJson(self._tagged_file.as_posix())
-        self.dataviewer.tag_pane.model().load(data.copy())
+        self.dataviewer.tag_pane.open(self._tagged_file)
 
     def loadFiles(self):
         files = self.selectFiles(self._rootpath.as_posix(), filter="*.csv *.xlsx *.parquet")
         self.dataviewer.loadFiles(files)
 
+    def loadDirectory(self):
+        directory = QtWidgets.QFileDialog.getExistingDirectory(caption="Select partitioned dataset",
+                                                               directory=self._rootpath.as_posix())
+        if not directory:
+            return
+        self.dataviewer.loadDirectory(Path(directory))
+
+    def appendFile(self):
+        file = QtWidgets.QFileDialog.getOpenFileName(caption="Select new period",
+                                                     directory=self._rootpath.as_posix(),
+                                                     filter="*.csv *.xlsx *.parquet")
+        if not file[0]:
+            return
+        self.dataviewer.appendToDataset(Path(file[0]))
+
     @Slot(DataSet)
     def onDatasetInfoChanged(self, dataset: DataSet):
         for json_dataset in self._project.get("datasets"):
@@ -281,6 +341,7 @@ class ListInsight(QtWidgets.QWidget):
     def onDatasetImported(self, dataset: DataSet):
         self._project.get("datasets").append(dataset.serialize())
         self.saveProject()
+        self.sql_console.setProject(self._project)
 
     #TODO
     def update_dataset_by_id(self, dataset_id, key_path, new_value):
@@ -303,19 +364,24 @@ class ListInsight(QtWidgets.QWidget):
     def updateActionState(self):
         if "project_rootpath" in self._project:
             self.action_import_data.setEnabled(True)
+            self.action_import_directory.setEnabled(True)
+            self.action_append_data.setEnabled(True)
         else:
             self.action_import_data.setEnabled(False)
+            self.action_import_directory.setEnabled(False)
+            self.action_append_data.setEnabled(False)
        
     @Slot(dict)
     def saveShortList(self, data: dict):
-        writeJson(self._shortlist_file.as_posix(), data)
-
-    @Slot(dict)
-    def saveTags(self, data: dict):
-        writeJson(self._tagged_file.as_posix(), data)
+        # toJson builds a fresh document, copying the tag lists of the items
+        self._writer.schedule(self._shortlist_file.as_posix(), data, snapshot=False)
 
     def saveProject(self):
-        writeJson(self._project_file.as_posix(), self._project)
+        self._writer.schedule(self._project_file.as_posix(), self._project)
+
+    def closeEvent(self, a0):
+        self._writer.flush()
+        return super().closeEvent(a0)
 
 
 
@@ -1,7 +1,13 @@
+import os
 import json
+import logging
+from pathlib import Path
+from typing import Iterator
 
 from qtpy import QtCore
 
+logger = logging.getLogger(__name__)
+
 
 def writeJson(json_path: str, data: dict) -> tuple[bool, str]:
     """Write JSON file"""
@@ -23,6 +29,24 @@ def writeJson(json_path: str, data: dict) -> tuple[bool, str]:
 
     return True, err
 
+def writeJsonAtomic(json_path: str, data: dict) -> tuple[bool, str]:
+    """Write JSON file through a temporary file renamed over the target"""
+    filepath = Path(json_path)
+    tmpfile = filepath.with_name(f".{filepath.name}.tmp")
+    err = None
+
+    try:
+        with open(tmpfile, mode='w', encoding='utf8') as file:
+            json.dump(data, file, indent=4, sort_keys=True, ensure_ascii=False)
+        os.replace(tmpfile, filepath)
+    except (OSError, TypeError, ValueError) as e:
+        err = f"Writing Error: {e}"
+        return False, err
+    finally:
+        tmpfile.unlink(missing_ok=True)
+
+    return True, err
+
 def readJson(json_file: str) -> tuple[dict, str]:
         try:
             with open(json_file, mode='r', encoding='utf8') as file:
@@ -34,3 +58,19 @@ def readJson(json_file: str) -> tuple[dict, str]:
                 err = f"Error: {json_file} not found."
                 return {}, err
 
+def readJsonLines(json_path: Path) -> Iterator[dict]:
+    """Yield the entries of a JSON-lines file, one per line
+
+    A line that does not parse, such as a partially written last line, is
+    skipped with a warning.
+    """
+    with open(json_path, mode='r', encoding='utf8') as file:
+        for line in file:
+            if line.strip() == "":
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping corrupted line in {Path(json_path).name}")
+                continue
+            yield entry
@@ -0,0 +1,38 @@
+import logging
+from typing import Callable
+from qtpy import QtCore, Signal
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerSignals(QtCore.QObject):
+    sigResult = Signal(object)
+    sigFailed = Signal(str)
+    sigFinished = Signal()
+
+
+class Worker(QtCore.QRunnable):
+    """Run a callable in a QThreadPool
+
+    The result is handed back through sigResult, which is delivered in the
+    thread of the connected receiver (usually the GUI thread).
+    The owner must keep a reference to the worker until sigFinished.
+    """
+    def __init__(self, fn: Callable, *args, **kwargs):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.signals = WorkerSignals()
+        self._fn = fn
+        self._args = args
+        self._kwargs = kwargs
+
+    def run(self):
+        try:
+            result = self._fn(*self._args, **self._kwargs)
+        except Exception as e:
+            logger.exception(e)
+            self.signals.sigFailed.emit(str(e))
+        else:
+            self.signals.sigResult.emit(result)
+        finally:
+            self.signals.sigFinished.emit()
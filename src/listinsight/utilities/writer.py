@@ -0,0 +1,82 @@
+import copy
+import logging
+from typing import Callable
+from qtpy import QtCore, Slot
+
+from utilities.utils import writeJsonAtomic
+from utilities.worker import Worker
+
+logger = logging.getLogger(__name__)
+
+
+class JsonWriter(QtCore.QObject):
+    """Write-behind persistence of JSON documents
+
+    Saves of the same file are coalesced until no change happened for `delay` ms
+    (at most `max_delay` ms), then the latest snapshot of each file is serialized
+    and written atomically in a background thread. flush() must be called
+    before exiting.
+    """
+    def __init__(self, delay: int = 500, max_delay: int = 3000, parent=None):
+        super().__init__(parent)
+        self._pending: dict[str, dict | Callable] = {} # {json_path : snapshot}
+        self._workers: set[Worker] = set()
+        self._max_delay = max_delay
+        self._elapsed = QtCore.QElapsedTimer()
+
+        # A single thread keeps the writes of a file in order
+        self._pool = QtCore.QThreadPool(self)
+        self._pool.setMaxThreadCount(1)
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(delay)
+        self._timer.timeout.connect(self.commit)
+
+    def schedule(self, json_path: str, data: dict | Callable, snapshot: bool = True):
+        """Queue data to be written to json_path
+
+        Args:
+            data (dict | Callable): document, or a callable returning it which is
+                called once per burst, on the GUI thread, when the write is committed
+            snapshot (bool): copy a dict now, set to False if the caller will not mutate it
+        """
+        if len(self._pending) == 0:
+            self._elapsed.start()
+
+        if isinstance(data, dict) and snapshot:
+            data = copy.deepcopy(data)
+        self._pending[json_path] = data
+
+        # Keep a continuous burst from postponing the write forever
+        if self._elapsed.elapsed() >= self._max_delay:
+            self.commit()
+        else:
+            self._timer.start()
+
+    @Slot()
+    def commit(self):
+        """Hand the pending snapshots to the writer thread"""
+        pending, self._pending = self._pending, {}
+
+        for json_path, data in pending.items():
+            if callable(data):
+                data = data()
+
+            worker = Worker(writeJsonAtomic, json_path, data)
+            worker.signals.sigResult.connect(self.onWritten)
+            worker.signals.sigFinished.connect(lambda worker=worker: self._workers.discard(worker))
+            self._workers.add(worker)
+            self._pool.start(worker)
+
+    @Slot(object)
+    def onWritten(self, result: tuple[bool, str]):
+        ok, err = result
+        if not ok:
+            logger.error(err)
+
+    def flush(self):
+        """Write everything pending and wait for the writer thread"""
+        self._timer.stop()
+        self.commit()
+        self._pool.waitForDone()
@@ -0,0 +1,43 @@
+import pandas as pd
+import pytest
+
+from dataviewer.dataviewer import DataSet
+
+
+def makeDataset() -> DataSet:
+    dataset = DataSet(pd.DataFrame({"ID": [1, 2, 3],
+                                    "country": pd.Categorical(["BE", "FR", "BE"]),
+                                    "value": [1.0, None, 3.0]}), "T")
+    dataset.pk_name = "ID"
+    return dataset
+
+
+def test_upsert():
+    dataset = makeDataset()
+    period = pd.DataFrame({"ID": [2, 3, 4, 4],
+                           "country": ["FR", "NL", "DE", "LU"],
+                           "value": [None, 3.0, 4.0, 5.0]})
+
+    assert dataset.upsert(period) == (1, 1)
+
+    df = dataset.unfiltered_df
+    assert df["ID"].tolist() == [1, 2, 3, 4]
+    # Last row of a duplicated key wins, new categories are kept
+    assert df["country"].tolist() == ["BE", "FR", "NL", "LU"]
+    assert isinstance(df["country"].dtype, pd.CategoricalDtype)
+    assert df["value"].tolist()[2:] == [3.0, 5.0]
+    # Row 2 is unchanged, missing values compare equal
+    assert dataset.dirty_rows == {2, 3}
+    assert dataset.pkIndex().tolist() == [1, 2, 3, 4]
+
+
+def test_upsert_needs_a_primary_key_and_all_columns():
+    dataset = makeDataset()
+
+    with pytest.raises(ValueError):
+        dataset.upsert(pd.DataFrame({"ID": [1], "value": [0.0]}))
+
+    dataset.pk_name = ""
+    with pytest.raises(ValueError):
+        dataset.upsert(dataset.unfiltered_df)
+    assert not dataset.isDirty()
@@ -0,0 +1,63 @@
+import pandas as pd
+import pytest
+
+from dataviewer.filter import Filter, filterExpression
+from dataviewer.dataviewer import DataSet, PandasModel
+
+
+@pytest.fixture
+def df() -> pd.DataFrame:
+    return pd.DataFrame({"name": ["alpha", "beta", "gamma", None],
+                         "date": pd.to_datetime(["2024-01-01", "2024-02-01", "2024-03-01", None]),
+                         "country": pd.Categorical(["BE", "FR", "BE", "NL"]),
+                         "count": pd.array([1, None, 3, 4], dtype="Int64"),
+                         "ratio": [0.5, 1.5, 2.5, 3.5],
+                         "flag": [True, False, True, False]})
+
+
+def query(df: pd.DataFrame, column: str, oper: str, value: str) -> list[int]:
+    expression = filterExpression(column, df[column].dtype, oper, value)
+    return df.query(expression, local_dict={"pd": pd}).index.tolist()
+
+
+@pytest.mark.parametrize("column, oper, value, rows", [
+    ("name", "==", "beta", [1]),
+    ("name", "contains", "a", [0, 1, 2]),
+    ("name", "startswith", "g", [2]),
+    ("name", "in", "alpha, gamma", [0, 2]),
+    ("date", ">", "2024-01-15", [1, 2]),
+    ("date", "==", "2024-03-01", [2]),
+    ("date", "contains", "2024-02", [1]),
+    ("country", "==", "FR", [1]),
+    ("country", ">", "BE", [1, 3]),
+    ("country", "in", "BE,NL", [0, 2, 3]),
+    ("country", "endswith", "L", [3]),
+    ("count", ">=", "3", [2, 3]),
+    ("count", "==", "1", [0]),
+    ("count", "in", "1, 4", [0, 3]),
+    ("count", "contains", "3", [2]),
+    ("ratio", "<", "2", [0, 1]),
+    ("flag", "==", "true", [0, 2]),
+])
+def test_filter_expression(df, column, oper, value, rows):
+    assert query(df, column, oper, value) == rows
+
+
+def test_filter_expression_compares_columns(df):
+    df["other"] = [1.0, 2.0, 2.0, 5.0]
+    assert query(df, "ratio", "<", "other") == [0, 1, 3]
+
+
+def test_unknown_tag_fails_the_filter():
+    dataset = DataSet(pd.DataFrame({"ID": [1, 2, 3]}), "T")
+    dataset.pk_name = "ID"
+    dataset.tags.add("Late & Serious", ["1", "3"])
+    dataset.filters = [Filter(DataSet.TAGS_COLUMN, "matches", "", expr='"Late & Serious"', enabled=True)]
+    model = PandasModel(dataset)
+
+    model.apply_user_filter()
+    assert model.dataframe()["ID"].tolist() == [1, 3]
+
+    dataset.filters[0].expr = "Late & Serious"
+    model.apply_user_filter()
+    assert dataset.filters[0].failed
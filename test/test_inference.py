@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+from dataviewer.inference import INFERRED_TYPES, detectDateFormat, inferTypes
+
+
+def test_detect_date_format():
+    assert detectDateFormat(pd.Series(["2024-01-31", "2024-02-01", None])) == "%Y-%m-%d"
+    assert detectDateFormat(pd.Series(["31/01/2024", "01/02/2024"])) == "%d/%m/%Y"
+    assert detectDateFormat(pd.Series(["31-Jan-2024"])) == "%d-%b-%Y"
+    assert detectDateFormat(pd.Series(["2024-01-31", "soon"])) is None
+    assert detectDateFormat(pd.Series([1, 2])) is None
+
+
+def test_infer_types():
+    df = pd.DataFrame({"date": ["2024-01-31", "2024-02-01", None, "2024-02-03", "2024-02-04", "2024-02-05"],
+                       "country": ["BE", "BE", "FR", "BE", "BE", "FR"],
+                       "name": ["a", "b", "c", "d", "e", "f"],
+                       "count": [1.0, np.nan, 3.0, 4.0, 5.0, 6.0],
+                       "ratio": [0.5, np.nan, 1.0, 2.0, 2.0, 2.0]})
+
+    inferred = inferTypes(df)
+
+    assert pd.api.types.is_datetime64_any_dtype(inferred["date"])
+    assert inferred["date"].isna().sum() == 1
+    assert isinstance(inferred["country"].dtype, pd.CategoricalDtype)
+    assert inferred["name"].dtype == object
+    assert inferred["count"].dtype == "Int64"
+    assert inferred["ratio"].dtype == float
+    assert inferred.attrs[INFERRED_TYPES] == {"date": "datetime:%Y-%m-%d", "country": "category", "count": "Int64"}
+
+    # The source frame is not modified
+    assert df["date"].dtype == object
+
+
+def test_dates_not_parsing_outside_the_sample_stay_text():
+    values = pd.date_range("2000-01-01", periods=1500).strftime("%Y-%m-%d").tolist() + ["unknown"]
+    df = pd.DataFrame({"date": values})
+
+    inferred = inferTypes(df)
+
+    assert inferred["date"].dtype == object
+    assert inferred.attrs[INFERRED_TYPES] == {}
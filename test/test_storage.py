@@ -0,0 +1,191 @@
+import os
+import pandas as pd
+import pyarrow.parquet as pq
+
+from dataviewer.storage import (ConversionCache, fingerprint, WriteProfile, WRITE_PROFILES, writeParquet, rowGroupLayout, reloadRowGroups,
+                                 readParquet, footerFingerprint, ipcCachePath, readIpcCache, openPartitioned, partitionExpression)
+from dataviewer.filter import Filter
+from dataviewer.dataviewer import DataSet, DataViewer
+
+PROFILE = WriteProfile(row_group_size=10)
+
+
+def makeParquet(filepath, num_rows: int = 35) -> pd.DataFrame:
+    df = pd.DataFrame({"ID": range(num_rows), "value": [f"v{i}" for i in range(num_rows)]})
+    writeParquet(df, filepath, PROFILE)
+    return df
+
+
+def loadDataset(filepath) -> DataSet:
+    layout = rowGroupLayout(filepath)
+    dataset = DataSet(pd.read_parquet(filepath), "T")
+    dataset.parquet = filepath
+    dataset.layout = layout
+    return dataset
+
+
+def test_layout_finds_the_changed_row_groups(tmp_path):
+    filepath = tmp_path / "t.parquet"
+    df = makeParquet(filepath)
+    before = rowGroupLayout(filepath)
+
+    df.loc[15, "value"] = "edited"
+    writeParquet(df, filepath, PROFILE)
+    after = rowGroupLayout(filepath)
+
+    assert after.offsets == before.offsets == [0, 10, 20, 30, 35]
+    assert [a != b for a, b in zip(after.digests, before.digests)] == [False, True, False, False]
+
+
+def test_save_refuses_to_splice_into_a_parquet_changed_on_disk(tmp_path):
+    filepath = tmp_path / "t.parquet"
+    makeParquet(filepath)
+    dataset = loadDataset(filepath)
+
+    # Another process rewrites the parquet with other rows
+    other = pd.DataFrame({"ID": range(100, 135), "value": ["other"] * 35})
+    writeParquet(other, filepath, PROFILE)
+
+    dataset.setValue(3, 1, "edited")
+    assert dataset.changedOnDisk()
+    assert not DataViewer.saveDataset(dataset)
+    pd.testing.assert_frame_equal(pd.read_parquet(filepath), other)
+    assert dataset.isDirty()
+
+    # Confirmed by the user: the rows in memory replace the file
+    assert DataViewer.saveDataset(dataset, overwrite=True)
+    pd.testing.assert_frame_equal(pd.read_parquet(filepath), dataset.unfiltered_df)
+    assert not dataset.changedOnDisk()
+
+
+def test_save_writes_the_edited_rows(tmp_path):
+    filepath = tmp_path / "t.parquet"
+    makeParquet(filepath)
+    dataset = loadDataset(filepath)
+
+    dataset.setValue(12, 1, "edited")
+    assert DataViewer.saveDataset(dataset)
+
+    assert pd.read_parquet(filepath).loc[12, "value"] == "edited"
+    assert not dataset.isDirty()
+    assert not dataset.changedOnDisk()
+
+
+def test_reload_splices_the_changed_row_groups(tmp_path):
+    filepath = tmp_path / "t.parquet"
+    df = makeParquet(filepath)
+    dataset = loadDataset(filepath)
+
+    df.loc[25, "value"] = "changed"
+    df = pd.concat([df, pd.DataFrame({"ID": [35], "value": ["new"]})], ignore_index=True)
+    writeParquet(df, filepath, PROFILE)
+
+    result = reloadRowGroups(filepath, dataset.layout)
+    assert result.full is None
+    assert set(result.frames) == {2, 3}
+
+    dataset.spliceRowGroups(result.frames, result.layout)
+    pd.testing.assert_frame_equal(dataset.unfiltered_df, pq.read_table(filepath).to_pandas())
+
+
+def test_ipc_cache_is_rebuilt_when_the_parquet_changes(tmp_path):
+    filepath = tmp_path / "t.parquet"
+    df = makeParquet(filepath)
+
+    pd.testing.assert_frame_equal(readParquet(filepath, ipc_cache=True), df)
+    assert ipcCachePath(filepath).exists()
+    assert readIpcCache(filepath, footerFingerprint(filepath)) is not None
+
+    df.loc[3, "value"] = "edited"
+    writeParquet(df, filepath, PROFILE)
+    assert readIpcCache(filepath, footerFingerprint(filepath)) is None
+    pd.testing.assert_frame_equal(readParquet(filepath, ipc_cache=True), df)
+
+
+def test_conversion_cache_lookup(tmp_path):
+    source = tmp_path / "cases.csv"
+    source.write_text("ID,value\n1,a\n")
+    parquet = tmp_path / "CASES.parquet"
+    parquet.touch()
+
+    cache = ConversionCache(tmp_path / "conversions.json")
+    assert cache.lookup(source) is None
+
+    cache.store(source, [parquet])
+
+    # Read back from the cache file, found under another name
+    moved = source.rename(tmp_path / "moved.csv")
+    cache = ConversionCache(tmp_path / "conversions.json")
+    assert cache.lookup(moved) == [parquet]
+    assert cache.sourceOf(parquet) == source
+
+    parquet.unlink()
+    assert cache.lookup(moved) is None
+
+
+def test_conversion_cache_checks_the_content_when_the_file_was_touched(tmp_path):
+    # Large enough for the fingerprint to sample only the first and last MB
+    source = tmp_path / "cases.csv"
+    content = bytearray(b"x" * (3 << 20))
+    source.write_bytes(content)
+    parquet = tmp_path / "CASES.parquet"
+    parquet.touch()
+    cache = ConversionCache(tmp_path / "conversions.json")
+    cache.store(source, [parquet])
+    mtime = source.stat().st_mtime_ns
+
+    # Same content, new modification time
+    os.utime(source, ns=(mtime + 10**9, mtime + 10**9))
+    assert cache.lookup(source) == [parquet]
+
+    # Edited outside the sampled bytes: same fingerprint, other content
+    before = fingerprint(source)
+    content[len(content) // 2] = ord("y")
+    source.write_bytes(content)
+    os.utime(source, ns=(mtime + 2 * 10**9, mtime + 2 * 10**9))
+
+    assert fingerprint(source)["hash"] == before["hash"]
+    assert cache.lookup(source) is None
+
+
+def test_write_profiles(tmp_path):
+    df = pd.DataFrame({"ID": [3, 1, 2] * 10, "country": ["BE", "FR", "NL"] * 10, "text": [f"t{i}" for i in range(30)]})
+    filepath = tmp_path / "t.parquet"
+
+    writeParquet(df, filepath, WriteProfile(row_group_size=10, compression="snappy", compression_level=None), "ID")
+    metadata = pq.read_metadata(filepath)
+    column = metadata.row_group(0).column(1)
+    assert metadata.num_row_groups == 3
+    assert column.compression == "SNAPPY"
+    # Dictionary encoding for the low cardinality column only
+    assert column.has_dictionary_page
+    assert not metadata.row_group(0).column(2).has_dictionary_page
+    pd.testing.assert_frame_equal(pd.read_parquet(filepath), df)
+
+    writeParquet(df, filepath, WRITE_PROFILES["lookup"], "ID")
+    assert pd.read_parquet(filepath)["ID"].tolist() == sorted(df["ID"])
+    assert not (tmp_path / ".t.parquet.tmp").exists()
+
+
+def test_partition_expression(tmp_path):
+    df = pd.DataFrame({"YEAR": [2020, 2021, 2021, 2022], "COUNTRY": ["BE", "FR", "BE", "NL"], "value": range(4)})
+    df.to_parquet(tmp_path / "part", partition_cols=["YEAR", "COUNTRY"])
+    partitioned = openPartitioned(tmp_path / "part")
+
+    filters = [Filter("YEAR", ">=", "2021", enabled=True),
+               Filter("COUNTRY", "in", "BE, 'NL'", enabled=True),
+               Filter("value", "==", "1", enabled=True),      # not a partition column
+               Filter("YEAR", "contains", "20", enabled=True), # not pushed down
+               Filter("YEAR", "==", "2020")]                  # disabled
+    expression, covered = partitionExpression(filters, partitioned.partitioning.schema)
+
+    assert covered == filters[:2]
+    assert sorted(partitioned.to_table(filter=expression).column("value").to_pylist()) == [2, 3]
+
+
+def test_partition_expression_skips_values_of_another_type(tmp_path):
+    df = pd.DataFrame({"YEAR": [2020, 2021], "value": range(2)})
+    df.to_parquet(tmp_path / "part", partition_cols=["YEAR"])
+    schema = openPartitioned(tmp_path / "part").partitioning.schema
+
+    assert partitionExpression([Filter("YEAR", "==", "recent", enabled=True)], schema) == (None, [])
@@ -0,0 +1,77 @@
+from qtpy import QtCore
+
+from dataviewer.tagger import TagModel
+
+DISPLAY = QtCore.Qt.ItemDataRole.DisplayRole
+
+
+def rows(model: TagModel, parent: QtCore.QModelIndex) -> list[str]:
+    return [model.index(row, 0, parent).data(DISPLAY) for row in range(model.rowCount(parent))]
+
+
+def test_primary_keys_are_fetched_in_batches(monkeypatch):
+    monkeypatch.setattr(TagModel, "FETCH_SIZE", 2)
+    model = TagModel()
+    model.load({"A": [1, 2, 3], "B": []})
+
+    assert rows(model, QtCore.QModelIndex()) == ["A", "B"]
+    tag = model.index(0, 0)
+    assert model.hasChildren(tag) and not model.hasChildren(model.index(1, 0))
+    assert model.rowCount(tag) == 0
+
+    model.fetchMore(tag)
+    assert rows(model, tag) == ["1", "2"]
+    model.fetchMore(tag)
+    assert rows(model, tag) == ["1", "2", "3"]
+    assert not model.canFetchMore(tag)
+
+    pk = model.index(2, 0, tag)
+    assert model.parent(pk) == tag
+    assert not model.parent(tag).isValid()
+
+
+def test_tag_and_untag_update_the_fetched_rows(monkeypatch):
+    monkeypatch.setattr(TagModel, "FETCH_SIZE", 2)
+    model = TagModel()
+    model.load({"A": ["1", "2", "3"]})
+    tag = model.index(0, 0)
+    model.fetchMore(tag)
+    tagged = []
+    model.sigTagged.connect(lambda pks, name: tagged.append((pks, name)))
+
+    # Not shown before the remaining keys are fetched
+    model.add2Tag(["2", "4"], "A")
+    assert rows(model, tag) == ["1", "2"]
+    model.fetchMore(tag)
+    assert rows(model, tag) == ["1", "2", "3", "4"]
+
+    # Shown right away once the tag is complete
+    model.add2Tag(["5"], "A")
+    assert rows(model, tag) == ["1", "2", "3", "4", "5"]
+
+    model.removeFromTag(["2", "3", "5"], "A")
+    assert rows(model, tag) == ["1", "4"]
+    assert model.store().members("A") == ["1", "4"]
+
+    model.add2Tag(["1"], "New")
+    assert rows(model, QtCore.QModelIndex()) == ["A", "New"]
+    assert tagged == [(["4"], "A"), (["5"], "A"), (["1"], "New")]
+
+
+def test_rename_tag_and_primary_key():
+    model = TagModel()
+    model.load({"A": ["1", "2"], "B": ["3"]})
+    tag = model.index(0, 0)
+    model.fetchMore(tag)
+
+    assert model.setData(model.index(1, 0, tag), "9", QtCore.Qt.ItemDataRole.EditRole)
+    assert not model.setData(model.index(0, 0, tag), "9", QtCore.Qt.ItemDataRole.EditRole)
+    assert model.setData(tag, "C", QtCore.Qt.ItemDataRole.EditRole)
+    assert not model.setData(tag, "B", QtCore.Qt.ItemDataRole.EditRole)
+
+    assert rows(model, QtCore.QModelIndex()) == ["C", "B"]
+    assert rows(model, model.index(0, 0)) == ["1", "9"]
+    assert model.to_json() == {"C": ["1", "9"], "B": ["3"]}
+
+    model.removeTag("C")
+    assert rows(model, QtCore.QModelIndex()) == ["B"]
@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from dataviewer.tagindex import TagIndex, parseTagExpression
+from dataviewer.tagstore import TagStore
+
+
+def makeIndex() -> tuple[TagIndex, TagStore]:
+    store = TagStore()
+    store.add("Late", [1, 2, 3, 5])
+    store.add("Serious", [2, 3, 4])
+    store.add("Reviewed", [3])
+    store.add("Other dataset", [99])
+    # Case 2 appears on two rows
+    return TagIndex.build(pd.Index([1, 2, 2, 3, 4, 5, 6]), store), store
+
+
+def test_parse_precedence():
+    assert parseTagExpression("A | B & ~C") == ("or", "A", ("and", "B", ("not", "C")))
+    assert parseTagExpression("(A | B) & C") == ("and", ("or", "A", "B"), "C")
+    assert parseTagExpression("A AND NOT B OR C") == ("or", ("and", "A", ("not", "B")), "C")
+
+
+def test_parse_quoted_names():
+    assert parseTagExpression('"Late & Serious" | Other') == ("or", "Late & Serious", "Other")
+
+
+@pytest.mark.parametrize("expression", ["A &", "(A | B", "A B", ") A", ""])
+def test_parse_errors(expression):
+    with pytest.raises(ValueError):
+        parseTagExpression(expression)
+
+
+def test_build_joins_the_store_on_the_keys():
+    index, _ = makeIndex()
+
+    assert index.tags() == ["Late", "Serious", "Reviewed"]
+    assert index.counts() == {"Late": 5, "Serious": 4, "Reviewed": 1}
+    assert list(index.column()) == ["Late", "Late,Serious", "Late,Serious", "Late,Serious,Reviewed",
+                                    "Serious", "Late", ""]
+
+
+def test_evaluate():
+    index, _ = makeIndex()
+
+    assert index.evaluate("Late & Serious & ~Reviewed").tolist() == [False, True, True, False, False, False, False]
+    assert index.evaluate("Reviewed | ~Late").tolist() == [False, False, False, True, True, False, True]
+    assert index.evaluate('"Other dataset" | Reviewed').sum() == 1
+
+
+def test_evaluate_quoted_rule_tag():
+    """The analyzer tags rows with the single tag name 'Late & Serious'"""
+    store = TagStore()
+    store.add("Late & Serious", [1, 2])
+    store.add("Reviewed", [2])
+    index = TagIndex.build(pd.Index([1, 2, 3]), store)
+
+    assert index.evaluate('"Late & Serious" & ~Reviewed').tolist() == [True, False, False]
+
+
+@pytest.mark.parametrize("expression", ["Unknown", "~Unknown", "Late & Serious & Unknown"])
+def test_evaluate_unknown_tag(expression):
+    index, _ = makeIndex()
+
+    with pytest.raises(ValueError):
+        index.evaluate(expression)
+
+
+def test_evaluate_tag_created_after_the_build():
+    index, _ = makeIndex()
+
+    index.add("Empty", [])
+
+    assert index.evaluate("~Empty").sum() == index.num_rows
+
+
+def test_evaluate_beyond_a_byte():
+    keys = pd.Index(np.arange(20))
+    store = TagStore()
+    store.add("Even", list(range(0, 20, 2)))
+
+    index = TagIndex.build(keys, store)
+
+    assert np.flatnonzero(index.evaluate("~Even")).tolist() == list(range(1, 20, 2))
+
+
+def test_incremental_updates_match_a_rebuild():
+    index, store = makeIndex()
+
+    store.add("Serious", [5, 6])
+    positions, _ = index.positionsOf(["5", "6"])
+    index.add("Serious", positions)
+
+    store.remove("Late", [2])
+    positions, _ = index.positionsOf(["2"])
+    index.remove("Late", positions)
+
+    store.add("New", [1])
+    positions, _ = index.positionsOf(["1"])
+    index.add("New", positions)
+
+    rebuilt = TagIndex.build(pd.Index([1, 2, 2, 3, 4, 5, 6]), store)
+    assert list(index.column()) == list(rebuilt.column())
+    assert index.counts() == rebuilt.counts()
+    for tag in rebuilt.tags():
+        assert (index.bitmap(tag) == rebuilt.bitmap(tag)).all()
+
+
+def test_positions_of_duplicated_keys():
+    index, _ = makeIndex()
+
+    positions, keys = index.positionsOf(["2", "6", "missing"])
+
+    assert sorted(positions.tolist()) == [1, 2, 6]
+    assert sorted(keys.tolist()) == ["2", "2", "6"]
+
+
+def test_build_joins_only_the_tags_of_the_key_column():
+    store = TagStore()
+    store.add("Late", [1, 2])
+    store.setKey("Late", "CASE_ID")
+    store.add("Duplicate", [2])
+    store.setKey("Duplicate", "REPORT_ID")
+    store.add("Untyped", [1])
+
+    index = TagIndex.build(pd.Index([1, 2, 3]), store, "REPORT_ID")
+
+    assert index.counts() == {"Duplicate": 1, "Untyped": 1}
+    assert not index.hasTag("Late")
+    with pytest.raises(ValueError):
+        index.evaluate("Late")
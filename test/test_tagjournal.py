@@ -0,0 +1,127 @@
+import json
+
+from dataviewer.tagjournal import TagJournal, applyOperation, writeSnapshot
+from dataviewer.tagstore import TagStore
+
+
+def record(store: TagStore, journal: TagJournal, entry: dict):
+    applyOperation(store, entry)
+    journal.append(entry)
+
+
+def test_append_and_replay(tmp_path):
+    snapshot_file = tmp_path / "tagged.json"
+    store = TagStore()
+    journal = TagJournal(snapshot_file)
+
+    record(store, journal, {"op": "add", "tag": "Late", "pks": ["1", "2", "3"]})
+    record(store, journal, {"op": "remove", "tag": "Late", "pks": ["2"]})
+    record(store, journal, {"op": "rename_pk", "tag": "Late", "pk": "3", "name": "4"})
+    record(store, journal, {"op": "add", "tag": "Gone", "pks": ["1"]})
+    record(store, journal, {"op": "remove_tag", "tag": "Gone"})
+    record(store, journal, {"op": "rename_tag", "tag": "Late", "name": "Overdue"})
+    journal.close()
+
+    replayed, operations, sequence = TagJournal.read(snapshot_file)
+
+    assert replayed.to_json() == store.to_json() == {"Overdue": ["1", "4"]}
+    assert operations == 6
+    assert sequence == 6
+
+
+def test_rotate_and_compact(tmp_path):
+    snapshot_file = tmp_path / "tagged.json"
+    store = TagStore()
+    journal = TagJournal(snapshot_file)
+
+    record(store, journal, {"op": "add", "tag": "A", "pks": ["1"]})
+    journal.rotate()
+    record(store, journal, {"op": "add", "tag": "A", "pks": ["2"]})
+    assert journal.rotated_file.exists()
+
+    ok, err = writeSnapshot(snapshot_file, journal.rotated_file, store.to_json(), journal.sequence)
+    journal.close()
+
+    assert ok, err
+    assert not journal.rotated_file.exists()
+    replayed, _, sequence = TagJournal.read(snapshot_file)
+    assert replayed.to_json() == {"A": ["1", "2"]}
+    assert sequence == 2
+
+
+def test_replay_skips_entries_folded_into_the_snapshot(tmp_path):
+    """A rotated journal left by a crash after the snapshot write is not replayed twice"""
+    snapshot_file = tmp_path / "tagged.json"
+    store = TagStore()
+    journal = TagJournal(snapshot_file)
+
+    record(store, journal, {"op": "add", "tag": "A", "pks": ["1"]})
+    record(store, journal, {"op": "rename_tag", "tag": "A", "name": "B"})
+    record(store, journal, {"op": "add", "tag": "A", "pks": ["2"]})
+    journal.rotate()
+
+    # Snapshot written, the process stops before the rotated journal is deleted
+    snapshot_file.write_text(json.dumps({"sequence": journal.sequence, "tags": store.to_json()}))
+    record(store, journal, {"op": "rename_tag", "tag": "B", "name": "C"})
+    journal.close()
+
+    replayed, operations, _ = TagJournal.read(snapshot_file)
+
+    assert replayed.to_json() == store.to_json() == {"C": ["1"], "A": ["2"]}
+    assert operations == 1
+
+
+def test_replay_on_an_unnumbered_snapshot(tmp_path):
+    snapshot_file = tmp_path / "tagged.json"
+    snapshot_file.write_text(json.dumps({"A": ["1"]}))
+    snapshot_file.with_suffix(".journal").write_text(json.dumps({"op": "add", "tag": "A", "pks": ["2"]}) + "\n")
+
+    replayed, operations, sequence = TagJournal.read(snapshot_file)
+
+    assert replayed.to_json() == {"A": ["1", "2"]}
+    assert operations == 1
+    assert sequence == 0
+
+
+def test_partially_written_line(tmp_path):
+    snapshot_file = tmp_path / "tagged.json"
+    store = TagStore()
+    journal = TagJournal(snapshot_file)
+
+    record(store, journal, {"op": "add", "tag": "A", "pks": ["1"]})
+    journal.close()
+    with open(journal.journal_file, mode='a', encoding='utf8') as file:
+        file.write('{"op": "add", "tag"')
+
+    # The next entry starts on its own line
+    record(store, journal, {"op": "add", "tag": "A", "pks": ["2"]})
+    journal.close()
+
+    replayed, operations, _ = TagJournal.read(snapshot_file)
+    assert replayed.to_json() == {"A": ["1", "2"]}
+    assert operations == 2
+
+
+def test_key_columns_are_replayed_and_compacted(tmp_path):
+    snapshot_file = tmp_path / "tagged.json"
+    store = TagStore()
+    journal = TagJournal(snapshot_file)
+
+    record(store, journal, {"op": "set_key", "tag": "Late", "key": "CASE_ID"})
+    record(store, journal, {"op": "add", "tag": "Late", "pks": ["1"]})
+    record(store, journal, {"op": "set_key", "tag": "Dup", "key": "REPORT_ID"})
+    record(store, journal, {"op": "add", "tag": "Dup", "pks": ["1"]})
+    record(store, journal, {"op": "rename_tag", "tag": "Late", "name": "Overdue"})
+    journal.close()
+
+    replayed, _, _ = TagJournal.read(snapshot_file)
+    assert replayed.keys() == store.keys() == {"Overdue": "CASE_ID", "Dup": "REPORT_ID"}
+
+    journal.rotate()
+    ok, err = writeSnapshot(snapshot_file, journal.rotated_file, store.to_json(), journal.sequence, store.keys())
+    assert ok, err
+
+    replayed, operations, _ = TagJournal.read(snapshot_file)
+    assert operations == 0
+    assert replayed.keys() == {"Overdue": "CASE_ID", "Dup": "REPORT_ID"}
+    assert replayed.matches("Overdue", "CASE_ID") and not replayed.matches("Overdue", "REPORT_ID")
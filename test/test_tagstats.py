@@ -0,0 +1,79 @@
+import numpy as np
+
+from dataviewer.tagstats import TagCooccurrence
+from dataviewer.tagstore import TagStore
+
+
+def rebuilt(store: TagStore) -> TagCooccurrence:
+    cooccurrence = TagCooccurrence()
+    cooccurrence.build(store)
+    return cooccurrence
+
+
+def assertSameCounts(cooccurrence: TagCooccurrence, store: TagStore):
+    expected = rebuilt(store)
+    for tag in store.tags():
+        for other in store.tags():
+            assert cooccurrence.count(tag, other) == expected.count(tag, other), (tag, other)
+
+
+def test_build():
+    store = TagStore()
+    store.add("A", ["1", "2", "3"])
+    store.add("B", ["2", "3", "4"])
+    store.add("C", ["3"])
+
+    cooccurrence = rebuilt(store)
+
+    assert cooccurrence.frame().to_numpy().tolist() == [[3, 2, 1], [2, 3, 1], [1, 1, 1]]
+    assert cooccurrence.count("A") == 3
+    assert cooccurrence.count("A", "Unknown") == 0
+
+
+def test_build_in_chunks(monkeypatch):
+    store = TagStore()
+    for tag in range(5):
+        store.add(f"T{tag}", [str(pk) for pk in range(tag, 50, tag + 1)])
+    whole = rebuilt(store)
+
+    monkeypatch.setattr(TagCooccurrence, "PAIRS_PER_CHUNK", 8)
+
+    assert np.array_equal(rebuilt(store).matrix, whole.matrix)
+
+
+def test_incremental_updates():
+    store = TagStore()
+    store.add("A", ["1", "2"])
+    store.add("B", ["2"])
+    cooccurrence = rebuilt(store)
+
+    added = store.add("B", ["1", "3"])
+    cooccurrence.update(store, "B", added, 1)
+    assertSameCounts(cooccurrence, store)
+
+    added = store.add("New", ["1", "2"])
+    cooccurrence.update(store, "New", added, 1)
+    assertSameCounts(cooccurrence, store)
+
+    removed = store.remove("A", ["2"])
+    cooccurrence.update(store, "A", removed, -1)
+    assertSameCounts(cooccurrence, store)
+
+    cooccurrence.update(store, "A", [], -1)
+    assertSameCounts(cooccurrence, store)
+
+
+def test_remove_and_rename_tags():
+    store = TagStore()
+    store.add("A", ["1", "2"])
+    store.add("B", ["2", "3"])
+    store.add("C", ["1", "3"])
+    cooccurrence = rebuilt(store)
+
+    store.removeTag("B")
+    cooccurrence.removeTag("B")
+    store.renameTag("C", "D")
+    cooccurrence.renameTag("C", "D")
+
+    assert cooccurrence.tags() == ["A", "D"]
+    assertSameCounts(cooccurrence, store)
@@ -0,0 +1,54 @@
+from dataviewer.tagstore import TagStore
+
+
+def assertConsistent(store: TagStore):
+    """The pk -> tags index holds exactly the pairs of the tag -> pks index"""
+    forward = {(tag, pk) for tag in store.tags() for pk in store.members(tag)}
+    reverse = {(tag, pk) for pk, tags in store.reverseIndex().items() for tag in tags}
+    assert forward == reverse
+    assert all(len(tags) > 0 for tags in store.reverseIndex().values())
+
+
+def test_add_and_remove():
+    store = TagStore()
+
+    assert store.add("A", [1, "2", 2, 3]) == ["1", "2", "3"]
+    assert store.add("A", ["3", "4"]) == ["4"]
+    assert store.members("A") == ["1", "2", "3", "4"]
+    assert store.tagsOf(2) == {"A"}
+
+    assert store.remove("A", [2, "missing"]) == ["2"]
+    assert store.remove("Unknown", ["1"]) == []
+    assert not store.isTagged(2, "A")
+    assert store.tagsOf("2") == set()
+    assertConsistent(store)
+
+
+def test_reverse_index_follows_every_operation():
+    store = TagStore()
+    store.load({"A": ["1", "2"], "B": ["2", "3"], "C": "not a list"})
+    assert store.tags() == ["A", "B"]
+
+    # Built before the changes, then updated in place
+    store.reverseIndex()
+    store.add("C", ["1", "3"])
+    store.remove("B", ["2"])
+    assert store.renameMember("A", "1", "5")
+    assert not store.renameMember("A", "2", "5")
+    assert store.renameTag("C", "D")
+    assert not store.renameTag("A", "D")
+    assert store.removeTag("A") == ["5", "2"]
+    assertConsistent(store)
+
+    assert store.to_json() == {"B": ["3"], "D": ["1", "3"]}
+    assert store.tagsOf("3") == {"B", "D"}
+
+
+def test_rename_member_keeps_its_position():
+    store = TagStore()
+    store.add("A", ["1", "2", "3"])
+
+    store.renameMember("A", "2", "9")
+
+    assert store.members("A") == ["1", "9", "3"]
+    assertConsistent(store)
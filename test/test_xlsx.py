@@ -0,0 +1,48 @@
+import datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from dataviewer.storage import WriteProfile
+from dataviewer.xlsx import streamWorkbook
+
+
+openpyxl = pytest.importorskip("openpyxl")
+
+
+def makeWorkbook(filepath):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "Cases"
+    sheet.append(["ID", "value", "value", None, "date", None])
+    sheet.append([1, 1, "a", "x", datetime.datetime(2024, 1, 1)])
+    sheet.append([2, 2.5, "b", None, datetime.datetime(2024, 1, 2)])
+    sheet.append([None, None, None, None, None])
+    sheet.append([3, 3, 4, "z", None])
+    sheet.append([4, None, "d", None, datetime.datetime(2024, 1, 4), "beyond the header"])
+    workbook.create_sheet("Empty")
+    workbook.save(filepath)
+
+
+def test_stream_workbook(tmp_path):
+    source = tmp_path / "cases.xlsx"
+    makeWorkbook(source)
+    batches = []
+
+    parquets = streamWorkbook(source, tmp_path, WriteProfile(row_group_size=3), batch_size=2,
+                              progress=lambda sheet, rows: batches.append((sheet, rows)))
+
+    assert parquets == [tmp_path / "CASES.parquet"]
+    assert batches == [("Cases", 2), ("Cases", 4)]
+
+    table = pq.read_table(parquets[0])
+    assert table.column_names == ["ID", "value", "value.1", "Unnamed: 3", "date"]
+    assert table.column("ID").to_pylist() == [1, 2, 3, 4]
+    # Integers in one batch, floats in the other
+    assert table.schema.field("value").type == pa.float64()
+    assert table.column("value").to_pylist() == [1.0, 2.5, 3.0, None]
+    # Text and numbers mixed in a batch
+    assert table.column("value.1").to_pylist() == ["a", "b", "4", "d"]
+    assert pa.types.is_timestamp(table.schema.field("date").type)
+    metadata = pq.read_metadata(parquets[0])
+    assert [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)] == [3, 1]